@@ -1,63 +1,435 @@
+import os
+
 import numpy as np
 import pandas as pd
-from .clustering import run_clustering
+from .clustering import (run_clustering, render_figures, compute_core_distances, select_core_distances,
+                         SPARSE_KNN_NEIGHBORS)
+from .coresg import build_core_graph
+from .projection import get_projection
+from .transport import decode_array, encode_array
+from .storage import CORES_PER_WEB_WORKER
+
+# Worker processes for the mpts sweep. MUSTACHE_BATCH_WORKERS overrides the
+# default of one worker per core left to this web worker (cpu_count divided by
+# WEB_CONCURRENCY); 1 runs the sweep sequentially in-process.
+BATCH_WORKERS = int(os.environ.get('MUSTACHE_BATCH_WORKERS', 0)) or CORES_PER_WEB_WORKER
+
+# Below this many points a worker's start-up costs more than the runs it takes over
+BATCH_PARALLEL_MIN_SAMPLES = 2000
+
+# Sweep modes: 'grid' runs every mpts of the range; 'adaptive' starts from
+# ADAPTIVE_INITIAL_VALUES evenly spaced values and only bisects the intervals whose
+# end hierarchies agree less than ADAPTIVE_HAI_THRESHOLD (HAI), up to
+# ADAPTIVE_MAX_RUNS clustering runs in total; 'grid-2d' varies min_samples and
+# min_cluster_size separately (see run_grid_batch_clustering).
+SWEEP_MODES = ('grid', 'adaptive', 'grid-2d')
+ADAPTIVE_INITIAL_VALUES = 5
+ADAPTIVE_HAI_THRESHOLD = 0.98
+ADAPTIVE_MAX_RUNS = 20
+
+# Result keys: str(mpts) for the 1-D sweeps (min_samples = min_cluster_size = mpts),
+# '<min_samples>x<min_cluster_size>' for the cells of a 2-D grid sweep
+GRID_KEY_SEPARATOR = 'x'
+
+# Per-process state of pool workers: the dataset, kNN distances (and indices for the
+# sparse backend) and CORE-SG graph, memory-mapped from the .npy files written by
+# the parent instead of being pickled per task.
+_worker_state = {}
+
+
+def _init_batch_worker(data_path, knn_path, graph_paths=None, knn_indices_path=None):
+    from threadpoolctl import threadpool_limits
+
+    # One BLAS/OpenMP thread per worker: the pool already occupies every core
+    _worker_state['thread_limits'] = threadpool_limits(limits=1)
+    _worker_state['data'] = np.load(data_path, mmap_mode='r')
+    _worker_state['knn_distances'] = np.load(knn_path, mmap_mode='r') if knn_path else None
+    _worker_state['knn_indices'] = np.load(knn_indices_path, mmap_mode='r') if knn_indices_path else None
+    _worker_state['core_graph'] = ({name: np.load(path, mmap_mode='r') for name, path in graph_paths.items()}
+                                   if graph_paths else None)
+
+
+def _cluster_mpts(df, mpts, knn_distances, metric, algorithm, projection_method, hierarchy, core_graph=None,
+                  knn_indices=None):
+    # We use mpts for both min_cluster_size and min_samples mimicking legacy behavior
+    # where 'mpts' controlled the scale.
+    # Slicing the shared kNN query gives the same core distances as a query at mpts,
+    # so the labels are those of a single run (/upload) with this mpts. sklearn's
+    # HDBSCAN, which the sweep used to call, can differ where merges tie: it orders
+    # them arbitrarily, run_clustering canonically (see mst_to_linkage).
+    core_distances = None
+    if knn_distances is not None:
+        core_distances = select_core_distances(knn_distances, mpts)
+
+    # Lean results only: storing three figures per mpts is what used to
+    # exhaust memory on long sweeps. Figures are drawn for the medoids later.
+    return run_clustering(df, min_cluster_size=mpts, min_samples=mpts, metric=metric, algorithm=algorithm,
+                          core_distances=core_distances, projection_method=projection_method,
+                          hierarchy=hierarchy, lean=True, core_graph=core_graph,
+                          knn_distances=knn_distances if knn_indices is not None else None, knn_indices=knn_indices)
 
-def run_batch_clustering(df, min_mpts, max_mpts, step, metric='euclidean', algorithm='hdbscan'):
+
+def _shared_knn(data, max_mpts, metric, hierarchy, knn_distances=None):
+    # One kNN query at the largest mpts for a whole sweep; the sparse backend also
+    # needs the neighbor indices (its kNN graph), at SPARSE_KNN_NEIGHBORS at least.
+    # Returns (knn_distances, knn_indices), the indices None for the other backends.
+    if hierarchy == 'sparse':
+        return compute_core_distances(data, max(max_mpts, SPARSE_KNN_NEIGHBORS), metric, return_indices=True)
+    if knn_distances is None:
+        knn_distances = compute_core_distances(data, max_mpts, metric)
+    return knn_distances, None
+
+
+def _run_batch_task(mpts, metric, algorithm, projection_method, hierarchy):
+    df = pd.DataFrame(_worker_state['data'], copy=False)
+    try:
+        result = _cluster_mpts(df, mpts, _worker_state['knn_distances'], metric, algorithm, projection_method, hierarchy,
+                               _worker_state['core_graph'], _worker_state['knn_indices'])
+        return mpts, result, None
+    except Exception as e:
+        return mpts, None, str(e)
+
+
+def run_batch_clustering(df, min_mpts, max_mpts, step, metric='euclidean', algorithm='hdbscan', projection_method='auto',
+                         hierarchy='mst', n_workers=None, mpts_values=None, knn_distances=None, core_graph=None,
+                         knn_indices=None):
     """
-    Runs HDBSCAN for a range of mpts values.
-    Returns a dictionary where keys are mpts values and values are clustering results.
+    Runs HDBSCAN for a range of mpts values (or for the explicit list mpts_values).
+    knn_distances (sorted neighbor distances for k >= max mpts, with their
+    knn_indices for hierarchy='sparse') or, for algorithm='core-sg', core_graph
+    (coresg.build_core_graph at k >= max mpts) can be passed when the caller
+    already has them.
+    Returns a dictionary where keys are mpts values and values are lean clustering
+    results: labels, probabilities and linkage_z as numpy arrays, no figures
+    (see render_batch_figures and serialize_batch_results).
+    With more than one worker (n_workers, default BATCH_WORKERS) the mpts values are
+    spread over a process pool; results are the same as the sequential run.
     """
+    outcomes = list(iter_batch_clustering(df, min_mpts, max_mpts, step, metric=metric, algorithm=algorithm,
+                                          projection_method=projection_method, hierarchy=hierarchy,
+                                          n_workers=n_workers, mpts_values=mpts_values,
+                                          knn_distances=knn_distances, core_graph=core_graph,
+                                          knn_indices=knn_indices))
+
     results = {}
-    
+    for mpts, cluster_result, error in sorted(outcomes, key=lambda outcome: outcome[0]):
+        if error is not None:
+            print(f"Skipping mpts={mpts}: {error}")
+            continue
+        results[str(mpts)] = cluster_result
+        
+    return results
+
+
+def iter_batch_clustering(df, min_mpts, max_mpts, step, metric='euclidean', algorithm='hdbscan', projection_method='auto',
+                          hierarchy='mst', n_workers=None, mpts_values=None, knn_distances=None, core_graph=None,
+                          knn_indices=None):
+    """
+    Generator behind run_batch_clustering: yields (mpts, result, error) as soon as
+    each mpts is done, in completion order when a process pool is used. Closing
+    the generator early cancels the mpts values that have not started yet.
+    """
     # Ensure numerical data
-    data = df.select_dtypes(include=[np.number])
+    data = df.select_dtypes(include=[np.number]).to_numpy()
     
-    # Loop through mpts range
+    # One kNN query at k = max_mpts serves every mpts in the range: the core distance
+    # for a given mpts is just a column of the sorted neighbor distances.
+    # Core-SG builds its core graph once at max_mpts instead (kNN query included);
+    # every mpts is then a sparse MST over it.
     # In HDBSCAN, min_cluster_size is typically the main parameter.
     # We will vary min_cluster_size and keep min_samples = min_cluster_size (standard behavior)
     # unless specified otherwise.
-    
-    for mpts in range(min_mpts, max_mpts + 1, step):
-        # We use mpts for both min_cluster_size and min_samples mimicking legacy behavior
-        # where 'mpts' controlled the scale.
-        
-        # Run clustering for this specific mpts
-        # We reuse the existing run_clustering function but need to handle the return
-        # slightly differently to be more compact if needed, but for now full storage.
-        
-        # Run clustering for this specific mpts
-        try:
-            cluster_result = run_clustering(df, min_cluster_size=mpts, min_samples=mpts, metric=metric, algorithm=algorithm)
-            results[str(mpts)] = cluster_result
-        except Exception as e:
-            print(f"Skipping mpts={mpts}: {str(e)}")
-            continue
+    if mpts_values is None:
+        mpts_values = list(range(min_mpts, max_mpts + 1, step))
+    mpts_values = [int(mpts) for mpts in mpts_values]
+    if not mpts_values:
+        return
 
-        
+    if algorithm == 'hdbscan' and data.size > 0 and (knn_distances is None or
+                                                     (hierarchy == 'sparse' and knn_indices is None)):
+        knn_distances, knn_indices = _shared_knn(data, max(mpts_values), metric, hierarchy, knn_distances)
+    if core_graph is None and algorithm == 'core-sg' and data.size > 0:
+        core_graph = build_core_graph(data, max(mpts_values), metric)
+    n_workers = min(int(n_workers or BATCH_WORKERS), len(mpts_values))
+
+    if n_workers <= 1 or data.shape[0] < BATCH_PARALLEL_MIN_SAMPLES:
+        for mpts in mpts_values:
+            try:
+                yield mpts, _cluster_mpts(df, mpts, knn_distances, metric, algorithm, projection_method, hierarchy,
+                                          core_graph, knn_indices), None
+            except Exception as e:
+                yield mpts, None, str(e)
+    else:
+        yield from _iter_batch_pool(data, knn_distances, mpts_values, n_workers, metric, algorithm, projection_method,
+                                    hierarchy, core_graph, knn_indices)
+
+
+def _iter_batch_pool(data, knn_distances, mpts_values, n_workers, metric, algorithm, projection_method, hierarchy,
+                     core_graph=None, knn_indices=None):
+    """
+    Runs the mpts values over a process pool. The data, kNN distances and indices
+    and core graph are written once to .npy files that every worker memory-maps read-only.
+    Outcomes are yielded as they complete.
+    """
+    import multiprocessing
+    import shutil
+    import tempfile
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    workdir = tempfile.mkdtemp(prefix='mustache-batch-')
+    try:
+        data_path = os.path.join(workdir, 'data.npy')
+        np.save(data_path, np.ascontiguousarray(data))
+        knn_path = None
+        if knn_distances is not None:
+            knn_path = os.path.join(workdir, 'knn_distances.npy')
+            np.save(knn_path, knn_distances)
+        knn_indices_path = None
+        if knn_indices is not None:
+            knn_indices_path = os.path.join(workdir, 'knn_indices.npy')
+            np.save(knn_indices_path, knn_indices)
+        graph_paths = None
+        if core_graph is not None:
+            graph_paths = {name: os.path.join(workdir, f'core_graph_{name}.npy') for name in core_graph}
+            for name, path in graph_paths.items():
+                np.save(path, core_graph[name])
+
+        # 'spawn' avoids forking a multi-threaded web server process
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=context,
+                                 initializer=_init_batch_worker, initargs=(data_path, knn_path, graph_paths, knn_indices_path)) as pool:
+            futures = [
+                pool.submit(_run_batch_task, mpts, metric, algorithm, projection_method, hierarchy)
+                for mpts in mpts_values
+            ]
+            try:
+                for future in as_completed(futures):
+                    yield future.result()
+            finally:
+                # Stopped early (generator closed): drop the runs still queued
+                for future in futures:
+                    future.cancel()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def batch_key(min_samples, min_cluster_size=None):
+    """
+    Result key of a hierarchy: str(mpts) without min_cluster_size, a grid key otherwise.
+    """
+    if min_cluster_size is None:
+        return str(int(min_samples))
+    return f'{int(min_samples)}{GRID_KEY_SEPARATOR}{int(min_cluster_size)}'
+
+
+def parse_batch_key(key):
+    """
+    Inverse of batch_key: (min_samples, min_cluster_size), the latter None for mpts keys.
+    """
+    parts = str(key).split(GRID_KEY_SEPARATOR)
+    return int(parts[0]), (int(parts[1]) if len(parts) > 1 else None)
+
+
+def batch_key_order(key):
+    # Sort key: mpts order for 1-D sweeps, min_samples then min_cluster_size for grids
+    min_samples, min_cluster_size = parse_batch_key(key)
+    return min_samples, min_samples if min_cluster_size is None else min_cluster_size
+
+
+def batch_key_value(key):
+    # How a key is reported in analyses (ordered_mpts, medoids): int mpts or the grid key
+    return int(key) if parse_batch_key(key)[1] is None else str(key)
+
+
+def run_grid_batch_clustering(df, min_samples_values, min_cluster_size_values, metric='euclidean', algorithm='hdbscan',
+                              projection_method='auto', hierarchy='mst', n_workers=None):
+    """
+    Two-dimensional sweep over every (min_samples, min_cluster_size) pair. Each
+    min_samples value builds its hierarchy once, as in run_batch_clustering (one
+    shared kNN query, same process pool); every min_cluster_size is then only a
+    flat extraction from that hierarchy (linkage_to_labels), so the whole grid
+    costs about as much as the 1-D sweep over min_samples.
+    Returns lean results keyed by batch_key(min_samples, min_cluster_size) in grid
+    order; the cells of one min_samples share the same linkage_z array.
+    """
+    from .mst import linkage_to_labels
+
+    min_samples_values = sorted({int(value) for value in min_samples_values})
+    min_cluster_size_values = sorted({int(value) for value in min_cluster_size_values})
+    if not min_samples_values or not min_cluster_size_values:
+        raise ValueError('The min_samples and min_cluster_size ranges must not be empty.')
+
+    trees = run_batch_clustering(df, min_samples_values[0], min_samples_values[-1], 1, metric=metric, algorithm=algorithm, projection_method=projection_method,
+                                 hierarchy=hierarchy, n_workers=n_workers, mpts_values=min_samples_values)
+
+    results = {}
+    for min_samples, tree in trees.items():
+        Z = tree['linkage_z']
+        n_samples = len(Z) + 1
+        for min_cluster_size in min_cluster_size_values:
+            if not 2 <= min_cluster_size <= n_samples:
+                print(f"Skipping min_cluster_size={min_cluster_size}: outside [2, {n_samples}]")
+                continue
+            labels, probabilities = linkage_to_labels(Z, min_cluster_size)
+            results[batch_key(min_samples, min_cluster_size)] = {
+                'labels': np.asarray(labels, dtype=np.int32),
+                'probabilities': np.asarray(probabilities, dtype=np.float32),
+                'n_clusters': int(labels.max() + 1),
+                'noise_points': int((labels == -1).sum()),
+                'linkage_z': Z
+            }
     return results
 
-from .hai import compute_hai_matrix, run_meta_clustering, compute_medoids
 
-def analyze_batch_results(batch_results):
+def extend_batch_clustering(df, batch_results, min_mpts, max_mpts, step, metric='euclidean', algorithm='hdbscan',
+                            projection_method='auto', hierarchy='mst', n_workers=None):
+    """
+    Adds the mpts values of a new range to existing lean batch results, running
+    only the values not computed yet. Returns the merged results in mpts order.
+    """
+    new_values = [mpts for mpts in range(min_mpts, max_mpts + 1, step) if str(mpts) not in batch_results]
+    new_results = run_batch_clustering(df, min_mpts, max_mpts, step, metric=metric, algorithm=algorithm,
+                                       projection_method=projection_method, hierarchy=hierarchy,
+                                       n_workers=n_workers, mpts_values=new_values)
+
+    merged = {**batch_results, **new_results}
+    return {key: merged[key] for key in sorted(merged, key=int)}
+
+
+def run_adaptive_batch_clustering(df, min_mpts, max_mpts, step, metric='euclidean', algorithm='hdbscan',
+                                  projection_method='auto', hierarchy='mst', n_workers=None, hai_method='auto',
+                                  hai_threshold=ADAPTIVE_HAI_THRESHOLD, max_runs=ADAPTIVE_MAX_RUNS,
+                                  initial_values=ADAPTIVE_INITIAL_VALUES):
+    """
+    Coarse-to-fine mpts sweep over the grid range(min_mpts, max_mpts + 1, step).
+    Starts with initial_values evenly spaced grid values (both ends included), then
+    repeatedly runs the midpoints of the neighboring pairs whose hierarchies have an
+    HAI below hai_threshold, least similar pairs first, until every such interval is
+    resolved down to the grid step or max_runs clustering runs have been spent.
+    Returns lean results in the same format as run_batch_clustering.
+    """
+    grid = list(range(min_mpts, max_mpts + 1, step))
+    if not grid:
+        return {}
+
+    data = df.select_dtypes(include=[np.number]).to_numpy()
+    # kNN (or the core graph) once at the largest mpts for every round, as in run_batch_clustering
+    knn_distances = knn_indices = None
+    core_graph = None
+    if algorithm == 'hdbscan' and data.size > 0:
+        knn_distances, knn_indices = _shared_knn(data, grid[-1], metric, hierarchy)
+    elif algorithm == 'core-sg' and data.size > 0:
+        core_graph = build_core_graph(data, grid[-1], metric)
+
+    def run_positions(positions):
+        return run_batch_clustering(df, min_mpts, max_mpts, step, metric=metric, algorithm=algorithm,
+                                    projection_method=projection_method, hierarchy=hierarchy, n_workers=n_workers,
+                                    mpts_values=[grid[p] for p in positions], knn_distances=knn_distances,
+                                    core_graph=core_graph, knn_indices=knn_indices)
+
+    # Grid positions already run (failed runs included, so they are not retried)
+    max_runs = max(int(max_runs), min(2, len(grid)))
+    n_initial = min(int(initial_values), max_runs, len(grid))
+    attempted = set(np.linspace(0, len(grid) - 1, max(n_initial, 1)).round().astype(int).tolist())
+    results = run_positions(sorted(attempted))
+
+    similarity = {}
+    while len(attempted) < max_runs:
+        done = [p for p in sorted(attempted) if str(grid[p]) in results]
+        candidates = []
+        for a, b in zip(done, done[1:]):
+            middle = (a + b) // 2
+            if middle == a or middle in attempted:
+                continue
+            if (a, b) not in similarity:
+                similarity[(a, b)] = _pair_hai(results[str(grid[a])]['linkage_z'],
+                                               results[str(grid[b])]['linkage_z'], hai_method)
+            if similarity[(a, b)] < hai_threshold:
+                candidates.append((similarity[(a, b)], middle))
+        if not candidates:
+            break
+
+        candidates.sort()
+        new_positions = [middle for _, middle in candidates[:max_runs - len(attempted)]]
+        attempted.update(new_positions)
+        results.update(run_positions(new_positions))
+
+    return {key: results[key] for key in sorted(results, key=int)}
+
+
+def _pair_hai(Z_a, Z_b, hai_method='auto'):
+    # HAI between two hierarchies of the same dataset. In-process: a 2 x 2 matrix
+    # doesn't pay for starting a process pool
+    n_samples = len(Z_a) + 1
+    method = resolve_hai_method(n_samples, hai_method)
+    if method == 'sampled':
+        hai_matrix, _ = compute_hai_matrix_sampled([Z_a, Z_b], n_samples)
+    else:
+        hai_matrix = compute_hai_matrix([Z_a, Z_b], n_samples, method=method, n_workers=1)
+    return float(hai_matrix[0, 1])
+
+
+def render_batch_figures(df, result, projection_method='auto', encoding='json'):
+    """
+    Draws the figures of one lean batch result on demand. The 2D projection is
+    shared by every mpts and comes from the projection cache after the first call.
+    """
+    data = df.select_dtypes(include=[np.number]).to_numpy()
+    projection = get_projection(data, method=projection_method)
+    return render_figures(data, result['labels'], result['linkage_z'], projection=projection,
+                          projection_method=projection_method, encoding=encoding)
+
+
+def serialize_batch_results(df, batch_results, figure_keys=(), projection_method='auto', encoding='json'):
+    """
+    Builds the /batch response entries: labels and probabilities for every mpts,
+    plus the figures for the mpts listed in figure_keys (e.g. the medoids).
+    Linkage matrices stay on the server.
+    """
+    serialized = {}
+    for key, result in batch_results.items():
+        entry = {
+            'labels': encode_array(result['labels'], encoding),
+            'probabilities': encode_array(result['probabilities'], encoding),
+            'n_clusters': result['n_clusters'],
+            'noise_points': result['noise_points']
+        }
+        if key in figure_keys:
+            entry.update(render_batch_figures(df, result, projection_method, encoding))
+        serialized[key] = entry
+    return serialized
+
+from .hai import (compute_hai_matrix, compute_hai_matrix_sampled, extend_hai_matrix, resolve_hai_method,
+                  run_meta_clustering, compute_medoids, min_cluster_size_linkage)
+
+def analyze_batch_results(batch_results, hai_method='auto', previous_analysis=None):
     """
     Performs meta-analysis on batch results:
-    1. Computes HAI Matrix
+    1. Computes HAI Matrix (hai_method: see HAI_METHODS in app/core/hai.py;
+       'sampled' also returns the confidence half-widths as hai_error).
+       With previous_analysis (the result of an earlier call on a subset of these
+       mpts) only the rows/columns of the new mpts are computed.
     2. Runs Meta-Clustering
     3. Identifies Medoids
     """
     # Extract Linkage Z matrices (convert back to numpy)
     # batch_results is a dict {mpts: result_dict}
     # Sort keys to ensure consistent matrix order
-    sorted_keys = sorted(batch_results.keys(), key=lambda x: int(x))
+    sorted_keys = sorted(batch_results.keys(), key=batch_key_order)
     
-    linkage_list = []
+    linkages = {}
     n_samples = 0
     
     for key in sorted_keys:
         result = batch_results[key]
         if 'linkage_z' in result:
-            Z = np.array(result['linkage_z'])
-            linkage_list.append(Z)
+            Z = decode_array(result['linkage_z']).astype(np.float64)
+            _, min_cluster_size = parse_batch_key(key)
+            if min_cluster_size is not None:
+                # Grid cells share the hierarchy of their min_samples; they are
+                # compared as seen through their min_cluster_size
+                Z = min_cluster_size_linkage(Z, min_cluster_size)
+            linkages[key] = Z
             # Infer n_samples from linkage size (N-1 merges) => N = len(Z) + 1
             if n_samples == 0:
                 n_samples = len(Z) + 1
@@ -66,11 +438,42 @@ def analyze_batch_results(batch_results):
             print(f"Warning: No linkage_z for mpts={key}")
             pass
             
-    if not linkage_list:
+    if not linkages:
         return {'error': 'No valid linkage matrices found'}
+
+    # Only mpts with a hierarchy take part in the meta-analysis
+    sorted_keys = list(linkages)
+    linkage_list = list(linkages.values())
         
     # Compute HAI Matrix
-    hai_matrix = compute_hai_matrix(linkage_list, n_samples)
+    hai_method = resolve_hai_method(n_samples, hai_method)
+    previous_keys = [str(mpts) for mpts in previous_analysis['ordered_mpts']] if previous_analysis else []
+    reuse_previous = (
+        previous_analysis is not None
+        and previous_analysis.get('hai_method') == hai_method
+        and set(previous_keys) <= set(sorted_keys)
+    )
+
+    hai_error = None
+    if reuse_previous:
+        # Existing hierarchies first, in the order of the existing matrix, then the new
+        # ones; the grown matrix is then permuted back into mpts order.
+        new_keys = [key for key in sorted_keys if key not in set(previous_keys)]
+        extended_keys = previous_keys + new_keys
+        previous_error = previous_analysis.get('hai_error')
+        hai_matrix, hai_error = extend_hai_matrix(
+            previous_analysis['hai_matrix'], [linkages[key] for key in extended_keys], n_samples, method=hai_method,
+            hai_error=np.asarray(previous_error) if previous_error is not None else None
+        )
+        position = {key: i for i, key in enumerate(extended_keys)}
+        permutation = [position[key] for key in sorted_keys]
+        hai_matrix = hai_matrix[np.ix_(permutation, permutation)]
+        if hai_error is not None:
+            hai_error = hai_error[np.ix_(permutation, permutation)]
+    elif hai_method == 'sampled':
+        hai_matrix, hai_error = compute_hai_matrix_sampled(linkage_list, n_samples)
+    else:
+        hai_matrix = compute_hai_matrix(linkage_list, n_samples, method=hai_method)
     
     # Meta-Clustering
     meta_labels, meta_linkage = run_meta_clustering(hai_matrix)
@@ -79,6 +482,7 @@ def analyze_batch_results(batch_results):
     import plotly.figure_factory as ff
     # We need to map leaf indices to our sorted mpts keys for the labels
     dendro_labels = [str(k) for k in sorted_keys]
+    is_grid = any(parse_batch_key(key)[1] is not None for key in sorted_keys)
     
     # ff.create_dendrogram expects data (X) to compute linkage, OR a custom linkage matrix.
     # However, ff.create_dendrogram with linkagefun is tricky if we already have Z.
@@ -102,7 +506,7 @@ def analyze_batch_results(batch_results):
         fig_meta_dendro.update_layout(
             template='plotly_white',
             title='Meta-Clustering Dendrogram (Hierarchies)',
-            xaxis_title='mpts Parameter',
+            xaxis_title='min_samples x min_cluster_size' if is_grid else 'mpts Parameter',
             yaxis_title='Distance',
             margin=dict(l=20, r=20, t=40, b=50)
         )
@@ -118,15 +522,17 @@ def analyze_batch_results(batch_results):
     # Convert indices to mpts values for the frontend
     medoids_mpts = {}
     for label, idx in medoids_map.items():
-        medoids_mpts[int(label)] = int(sorted_keys[idx])
+        medoids_mpts[int(label)] = batch_key_value(sorted_keys[idx])
         
     return {
         'hai_matrix': hai_matrix.tolist(),
+        'hai_method': hai_method,
+        'hai_error': hai_error.tolist() if hai_error is not None else None,
         'meta_labels': meta_labels,
         'meta_linkage': meta_linkage.tolist() if isinstance(meta_linkage, np.ndarray) else meta_linkage,
         'meta_dendrogram_json': meta_dendro_json,
         'medoids': medoids_mpts,
-        'ordered_mpts': [int(k) for k in sorted_keys]
+        'ordered_mpts': [batch_key_value(k) for k in sorted_keys]
     }
 
 
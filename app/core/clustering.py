@@ -1,173 +1,185 @@
-from sklearn.cluster import HDBSCAN
-
-
 import pandas as pd
 import numpy as np
 from sklearn.metrics import adjusted_rand_score, adjusted_mutual_info_score
 from sklearn.neighbors import NearestNeighbors
-from scipy.spatial.distance import pdist, squareform
+from scipy.spatial.distance import cdist, squareform
+from scipy.cluster.hierarchy import linkage, leaves_list
+from .mst import (mutual_reachability_mst, boruvka_mutual_reachability_mst, condensed_mst, mst_to_linkage,
+                  canonical_linkage, linkage_to_labels, SCIPY_METRICS)
+from .reachability import reachability_from_linkage
+from .coresg import build_core_graph, core_graph_mst
+from .dendrogram import dendrogram_figure
+from .projection import get_projection, resolve_projection_method, PROJECTION_TITLES
+from .transport import check_encoding, encode_array, figure_to_json
 
 
-def compute_mutual_reachability(data, min_samples, metric='euclidean'):
+def compute_core_distances(data, max_k, metric='euclidean', return_indices=False):
     """
-    Computes the Mutual Reachability Distance matrix for HDBSCAN.
-    d_mreach(a, b) = max(core_k(a), core_k(b), d(a, b))
+    Runs a single kNN query at k = max_k and returns the sorted neighbor distances.
+    Column k-1 holds the core distance for min_samples = k (the point itself is its
+    own first neighbor), so every mpts <= max_k can be served by slicing the result.
+    return_indices=True also returns the neighbor indices (the kNN graph).
     """
     n_samples = data.shape[0]
-    k = min(min_samples, n_samples)
-    
-    # Compute Core Distances (distance to k-th nearest neighbor)
+    k = min(int(max_k), n_samples)
+
     nbrs = NearestNeighbors(n_neighbors=k, metric=metric).fit(data)
-    core_distances, _ = nbrs.kneighbors(data)
-    core_dist = core_distances[:, -1]
-    
-    # Compute basic Distance Matrix
-    if metric == 'euclidean':
-        raw_dist = squareform(pdist(data))
-    else:
-        raw_dist = squareform(pdist(data, metric=metric))
-        
-    # Vectorized Mutual Reachability
-    # MR[i,j] = max(core[i], core[j], dist[i,j])
-    
-    # Expand core distances to matrix for broadcasting
-    # core_mat[i, j] = core_dist[i]
-    core_mat = np.tile(core_dist, (n_samples, 1))
-    
-    # Symmetric max of cores: max(core[i], core[j])
-    # max_core[i, j] = max(core[i], core[j])
-    max_core = np.maximum(core_mat, core_mat.T)
-    
-    # Final MR
-    mreach_mat = np.maximum(max_core, raw_dist)
-    
-    # Ensure diagonal is exactly zero (fix for floating point errors)
-    np.fill_diagonal(mreach_mat, 0)
-    
-    return mreach_mat
+    knn_distances, knn_indices = nbrs.kneighbors(data)
 
+    if return_indices:
+        return knn_distances, knn_indices
+    return knn_distances
+
+
+def select_core_distances(knn_distances, min_samples):
+    """
+    Slices the core distance for min_samples out of a compute_core_distances result.
+    """
+    k = min(int(min_samples), knn_distances.shape[1])
+    return knn_distances[:, k - 1]
 
 
+# Memory budget (bytes) for the temporaries of one block of the block-wise
+# mutual reachability builder; the output vector itself comes on top of it.
+MR_MEMORY_BUDGET = 256 * 1024 * 1024
 
+# How run_clustering builds the MR hierarchy when it computes it itself:
+# - 'mst': Prim over implicit distances, O(n) memory (see app/core/mst.py)
+# - 'dense' / 'dense-float32': condensed MR vector built block-wise, then
+#   scipy single linkage (float64) or Prim over the condensed vector (float32,
+#   exact weights recomputed in float64, see condensed_mst)
+# - 'sparse': exact MST from nearest neighbor queries (Borůvka seeded with the kNN
+#   graph, see boruvka_mutual_reachability_mst), near-linear in low dimensions
+HIERARCHY_BACKENDS = ('mst', 'dense', 'dense-float32', 'sparse')
 
-def run_clustering(df, min_cluster_size=5, min_samples=None, metric='euclidean', algorithm='hdbscan', true_labels=None):
+# kNN graph size of the 'sparse' backend (at least min_samples)
+SPARSE_KNN_NEIGHBORS = 16
 
+
+def compute_mutual_reachability_condensed(data, min_samples, metric='euclidean', core_dist=None,
+                                          dtype=np.float64, memory_budget=MR_MEMORY_BUDGET):
     """
-    Runs clustering on the provided DataFrame.
-    Returns a dictionary with results.
+    Computes the Mutual Reachability Distances as a condensed vector (the upper
+    triangle, same layout as scipy pdist) without ever building the square matrix.
+    Rows are processed in blocks sized so that the block temporaries stay within
+    memory_budget bytes, and written directly into an output of the given dtype
+    (float32 halves the memory of the result).
+    d_mreach(a, b) = max(core_k(a), core_k(b), d(a, b))
     """
-    # Convert DataFrame to numpy array
-    data = df.select_dtypes(include=[np.number]).to_numpy()
-    
-    if data.size == 0 or data.shape[1] == 0:
-        raise ValueError("No numerical data found for clustering. Please ensure the CSV contains numeric columns.")
-        
-    m_samples_val = int(min_samples) if min_samples else int(min_cluster_size)
+    data = np.asarray(data, dtype=np.float64)
+    n_samples = data.shape[0]
 
-    if algorithm == 'core-sg':
-        from core_sg import CoreSG
-        clusterer = CoreSG(
-            min_cluster_size=int(min_cluster_size),
-            metric=metric
-        )
-        clusterer.fit(data, m_samples_val)
-        h_obj = clusterer.get_fitted_hdbscan_objects()
-        
-        labels = h_obj['labels_']
-        probabilities = h_obj['probabilities_']
-        
-        Z = h_obj['single_linkage_tree_'].to_numpy().astype(float)
-        
-        import plotly.figure_factory as ff
-    else:
-        from sklearn.cluster import HDBSCAN
-        clusterer = HDBSCAN(
-            min_cluster_size=int(min_cluster_size),
-            min_samples=int(min_samples) if min_samples else None,
-            metric=metric,
-            store_centers='medoid'
-        )
-
-        labels = clusterer.fit_predict(data)
-        probabilities = clusterer.probabilities_
-        
-        from scipy.cluster.hierarchy import linkage, dendrogram
-        import plotly.figure_factory as ff
-        
-        # MR Distance Matrix
-        mreach_matrix = compute_mutual_reachability(data, m_samples_val, metric)
+    if core_dist is None:
+        core_dist = select_core_distances(compute_core_distances(data, min_samples, metric), min_samples)
+    core_dist = np.asarray(core_dist, dtype=np.float64)
+    scipy_metric = SCIPY_METRICS.get(metric, metric)
+
+    condensed = np.empty(n_samples * (n_samples - 1) // 2, dtype=dtype)
+
+    # A block of rows [a, b) needs one (b - a) x (n - a - 1) float64 distance block
+    rows_per_block = max(1, int(memory_budget) // (8 * max(n_samples, 1)))
+
+    for a in range(0, n_samples - 1, rows_per_block):
+        b = min(a + rows_per_block, n_samples - 1)
+
+        block = cdist(data[a:b], data[a + 1:], metric=scipy_metric)
+        np.maximum(block, core_dist[a + 1:][np.newaxis, :], out=block)
+        np.maximum(block, core_dist[a:b, np.newaxis], out=block)
+
+        # Row i holds pairs (i, j > i); its part of the block starts at column i - a
+        for i in range(a, b):
+            start = i * n_samples - i * (i + 1) // 2
+            condensed[start:start + n_samples - i - 1] = block[i - a, i - a:]
+
+    return condensed
+
+
+def compute_mutual_reachability(data, min_samples, metric='euclidean', core_dist=None):
+    """
+    Computes the Mutual Reachability Distance matrix for HDBSCAN.
+    d_mreach(a, b) = max(core_k(a), core_k(b), d(a, b))
+    If core_dist is given (e.g. sliced from a shared kNN query) no neighbor search is run.
+    The square matrix is expanded from the block-wise condensed builder, so the
+    only n x n allocation is the result itself.
+    """
+    condensed = compute_mutual_reachability_condensed(data, min_samples, metric, core_dist=core_dist)
+    return squareform(condensed, checks=False)
+
+
+def clustering_metrics(labels, true_labels=None):
+    """
+    ARI/AMI of a clustering against ground truth labels ({} without them).
+    """
+    metrics = {}
+    if true_labels is not None:
+        # Filter out noise points (-1) from evaluation if desired, 
+        # but standard ARI/AMI handles them as just another label.
+        # However, it's often better to check alignment.
         
-        # Condense for linkage (scipy expects condensed distance array)
-        condensed_mreach = squareform(mreach_matrix, checks=False)
+        # Ensure lengths match
+        if len(true_labels) == len(labels):
+            metrics['ARI'] = adjusted_rand_score(true_labels, labels)
+            metrics['AMI'] = adjusted_mutual_info_score(true_labels, labels)
+        else:
+            metrics['error'] = "Label file length does not match data length."
+    return metrics
+
 
-        Z = linkage(condensed_mreach, method='single')
+def extract_flat_clustering(Z, min_cluster_size, true_labels=None, encoding='json'):
+    """
+    Re-extracts the HDBSCAN flat clustering of an existing MR hierarchy Z for another
+    min_cluster_size. Only the condensed tree and stability selection run (no
+    neighbor search, no MST, no figures), so min_samples stays the one Z was built with.
+    Besides labels, probabilities and counts it returns 'ordered_labels', the labels
+    in reachability plot order, so both plots can be recolored in place.
+    """
+    check_encoding(encoding)
+    Z = np.asarray(Z, dtype=np.float64)
+    n_samples = len(Z) + 1
+    if not 2 <= int(min_cluster_size) <= n_samples:
+        raise ValueError(f"min_cluster_size must be between 2 and the number of samples ({n_samples}).")
 
+    labels, probabilities = linkage_to_labels(Z, min_cluster_size)
+
+    # Same point order as reachability_from_linkage, without its reachability loop
+    ordering = leaves_list(Z)
+
+    return {
+        'labels': encode_array(labels, encoding),
+        'probabilities': encode_array(probabilities, encoding),
+        'ordered_labels': encode_array(labels[ordering], encoding),
+        'n_clusters': int(labels.max() + 1),
+        'noise_points': int((labels == -1).sum()),
+        'metrics': clustering_metrics(labels, true_labels)
+    }
+
+
+def render_figures(data, labels, Z, projection=None, projection_method='auto', encoding='json'):
+    """
+    Draws the dendrogram, reachability plot and 2D map of one clustering result
+    and returns them serialized: {'dendrogram_json', 'reachability_json', 'map_json'}.
+    """
+    labels = np.asarray(labels)
+    Z = np.asarray(Z, dtype=np.float64)
 
-    
     # Create Dendrogram Figure
-    fig_dendro = ff.create_dendrogram(data, linkagefun=lambda x: Z)
-    fig_dendro.update_layout(
-        template='plotly_white',
-        title='Hierarchical Clustering Dendrogram',
-        xaxis_title='Sample Index',
-        yaxis_title='Distance',
-        margin=dict(l=20, r=20, t=40, b=20)
-    )
+    # Level of detail: only the top merges are drawn (collapsed subtrees show their
+    # point counts and can be expanded via /dendrogram/zoom).
+    fig_dendro = dendrogram_figure(Z)
 
     # Generate Reachability Plot
-    # HDBSCAN doesn't produce a reachability plot directly like OPTICS, 
-    # but we can approximate a similar view using the single linkage tree (MST).
-    # The 'Z' linkage matrix contains (cluster_1, cluster_2, distance, sample_count).
-    # For a reachability plot, we typically want the distance to the nearest neighbor 
-    # in the spanning tree, ordered by the traversal.
-    
-    # Simplified approach: Use the linkage distances directly for now, 
-    # ordered by the dendrogram leaves.
-    dendro_leaves = fig_dendro['layout']['xaxis']['ticktext']
-    # Map leaf indices to original data indices
-    ordered_indices = [int(i) for i in dendro_leaves]
-    
-    # We need a reachability distance for each point. 
-    # In single linkage, this is roughly the height at which the point merges.
-    # This is a simplification; true reachability requires OPTICS or extracting from MST.
-    # For HDBSCAN, the 'condensed_tree_' or 'single_linkage_tree_' is the source.
-    
-    # Let's use the single linkage tree from HDBSCAN if available, or our scipy Z.
-    # Scipy Z: Z[i, 2] is the distance.
-    
-    # Constructing a basic reachability-like plot from Z:
-    # This is complex to do perfectly without OPTICS, but we can plot the 
-    # merge distances of the ordered points.
-    
+    # Derived from the hierarchy already computed (Z): points in dendrogram leaf
+    # order, each with the merge height that joins it to its predecessor.
+    # This replaces a separate OPTICS fit of the same data.
     import plotly.graph_objects as go
-    
-    # Placeholder for true reachability: Plot distances of ordered points
-    # This is NOT a true reachability plot but gives a similar visual of density structure
-    # for verification purposes.
-    
-    fig_reach = go.Figure()
-    fig_reach.add_trace(go.Bar(
-        x=list(range(len(ordered_indices))),
-        y=[0] * len(ordered_indices), # Placeholder, need to calculate actual reachability
-        marker_color='#097B43'
-    ))
-    
-    # Better approach: Use HDBSCAN's single_linkage_tree_ if we switch back to hdbscan library,
-    # but with sklearn's HDBSCAN, we might not have it exposed easily in the same way 
-    # without 'gen_min_span_tree=True' which isn't in sklearn's version yet (it uses a different backend).
-    
-    # Alternative: Use OPTICS from sklearn for the reachability plot specifically, 
-    # as it's the standard for that visualization.
-    from sklearn.cluster import OPTICS
-    optics = OPTICS(min_samples=int(min_samples) if min_samples else 5, metric=metric)
-    optics.fit(data)
 
+    ordering, reachability = reachability_from_linkage(Z)
+
+    # The first point has infinite reachability; leave its bar empty
+    reachability = np.where(np.isfinite(reachability), reachability, np.nan)
     
-    reachability = optics.reachability_[optics.ordering_]
-    labels_optics = optics.labels_[optics.ordering_]
-    
-    # Use HDBSCAN labels for coloring instead of OPTICS labels for consistency
-    ordered_hdbscan_labels = labels[optics.ordering_]
+    # Use HDBSCAN labels for coloring
+    ordered_hdbscan_labels = labels[ordering]
     
     fig_reach = go.Figure()
     fig_reach.add_trace(go.Bar(
@@ -192,19 +204,11 @@ def run_clustering(df, min_cluster_size=5, min_samples=None, metric='euclidean',
         height=400
     )
 
-    # Generate 2D Projection (t-SNE)
-    from sklearn.manifold import TSNE
-    
-    # Use t-SNE to project data to 2D
-    # Perplexity should be considerably less than number of samples to prevent hanging on small data.
-    n_samples = data.shape[0]
-    perplexity = min(30, max(1, n_samples // 3))
-    
-    # Use exact method for tiny datasets to prevent barnes_hut bugs
-    method = 'exact' if n_samples < 50 else 'barnes_hut'
-    
-    tsne = TSNE(n_components=2, perplexity=perplexity, random_state=42, method=method, init='pca')
-    projection = tsne.fit_transform(data)
+    # 2D Projection: depends only on the data, so it is computed once per
+    # dataset and reused; only the label coloring changes between runs.
+    projection_method = resolve_projection_method(data.shape[0], projection_method)
+    if projection is None:
+        projection = get_projection(data, method=projection_method)
 
     
     fig_map = go.Figure()
@@ -219,40 +223,152 @@ def run_clustering(df, min_cluster_size=5, min_samples=None, metric='euclidean',
             showscale=True,
             line=dict(width=1, color='DarkSlateGrey')
         ),
-        text=[f"Cluster: {l}" for l in labels],
-        hoverinfo='text'
+        # Hover text comes from the label array itself rather than one string per point
+        hovertemplate='Cluster: %{marker.color}<extra></extra>'
     ))
     
     fig_map.update_layout(
         template='plotly_white',
-        title='2D Projection (t-SNE)',
+        title=f'2D Projection ({PROJECTION_TITLES[projection_method]})',
         xaxis_title='Dimension 1',
         yaxis_title='Dimension 2',
         margin=dict(l=20, r=20, t=40, b=20)
     )
 
-    metrics = {}
-    if true_labels is not None:
-        # Filter out noise points (-1) from evaluation if desired, 
-        # but standard ARI/AMI handles them as just another label.
-        # However, it's often better to check alignment.
+    return {
+        'dendrogram_json': figure_to_json(fig_dendro, encoding),
+        'reachability_json': figure_to_json(fig_reach, encoding),
+        'map_json': figure_to_json(fig_map, encoding)
+    }
+
+
+def run_clustering(df, min_cluster_size=5, min_samples=None, metric='euclidean', algorithm='hdbscan', true_labels=None, core_distances=None, projection=None, projection_method='auto', encoding='json',
+                   hierarchy='mst', lean=False, core_graph=None, keep_linkage=False, knn_distances=None,
+                   knn_indices=None):
+
+    """
+    Runs clustering on the provided DataFrame.
+    core_distances optionally holds precomputed core distances for min_samples
+    (see compute_core_distances); the batch engine uses it to share one kNN query.
+    projection optionally holds the (n, 2) map coordinates, shared across a batch;
+    otherwise they are computed with projection_method (see app/core/projection.py).
+    encoding selects how numeric arrays and figures are serialized ('json' or
+    'binary' typed arrays, see app/core/transport.py).
+    hierarchy selects how the MR hierarchy is built (see HIERARCHY_BACKENDS); all of
+    them give the same tree, ties included (see mst_to_linkage). That tie order is
+    not sklearn's (an unstable sort), so labels can differ from sklearn's HDBSCAN
+    where merges tie, which mutual reachability makes common even on real-valued data.
+    lean=True skips the figures and returns labels, probabilities and linkage_z
+    as compact numpy arrays (see render_figures to draw them later).
+    core_graph optionally holds a shared coresg.build_core_graph result built at
+    k_max >= min_samples, used by algorithm='core-sg'.
+    knn_distances / knn_indices optionally hold a shared compute_core_distances
+    (return_indices=True) result, used by hierarchy='sparse' as its kNN graph.
+    keep_linkage=True also returns the float64 linkage matrix as 'linkage' (the
+    binary encoding narrows linkage_z to float32); callers storing the hierarchy
+    pop it before responding.
+    Returns a dictionary with results.
+    """
+    check_encoding(encoding)
+    if hierarchy not in HIERARCHY_BACKENDS:
+        raise ValueError(f"Unknown hierarchy backend '{hierarchy}'. Choose one of {HIERARCHY_BACKENDS}.")
+
+    # Convert DataFrame to numpy array
+    data = df.select_dtypes(include=[np.number]).to_numpy()
+    
+    if data.size == 0 or data.shape[1] == 0:
+        raise ValueError("No numerical data found for clustering. Please ensure the CSV contains numeric columns.")
         
-        # Ensure lengths match
-        if len(true_labels) == len(labels):
-            metrics['ARI'] = adjusted_rand_score(true_labels, labels)
-            metrics['AMI'] = adjusted_mutual_info_score(true_labels, labels)
+    m_samples_val = int(min_samples) if min_samples else int(min_cluster_size)
+    # The parameter ranges sklearn's HDBSCAN enforces
+    if int(min_cluster_size) < 2:
+        raise ValueError(f"min_cluster_size must be at least 2, got {min_cluster_size}.")
+    if m_samples_val < 1:
+        raise ValueError(f"min_samples must be at least 1, got {m_samples_val}.")
+
+    if algorithm == 'core-sg':
+        # Native CORE-SG (app/core/coresg.py): sparse MST over the core graph, which
+        # the batch engine builds once at the largest mpts and shares; a single run
+        # builds it at its own min_samples.
+        if core_graph is None:
+            if m_samples_val > data.shape[0]:
+                raise ValueError(f"min_samples ({m_samples_val}) must be at most the number of samples in X ({data.shape[0]})")
+            core_graph = build_core_graph(data, m_samples_val, metric)
+        if m_samples_val > core_graph['knn_distances'].shape[1]:
+            raise ValueError(f"min_samples ({m_samples_val}) is larger than the k of the core graph "
+                             f"({core_graph['knn_distances'].shape[1]})")
+
+        core_distances = select_core_distances(core_graph['knn_distances'], m_samples_val)
+        Z = mst_to_linkage(core_graph_mst(core_graph, core_distances), data.shape[0])
+        labels, probabilities = linkage_to_labels(Z, min_cluster_size)
+    else:
+        # Single runs, /tune and the batch engine all build the hierarchy here, so
+        # they agree label for label. Batch runs pass core distances sliced from one
+        # shared kNN query, so no neighbor search is needed then.
+
+        if m_samples_val > data.shape[0]:
+            raise ValueError(f"min_samples ({m_samples_val}) must be at most the number of samples in X ({data.shape[0]})")
+
+        if hierarchy == 'sparse':
+            # One kNN query gives the core distances and the seed edges of the Borůvka
+            # rounds; the batch engine shares its query across every mpts
+            if knn_indices is None:
+                knn_distances, knn_indices = compute_core_distances(data, max(m_samples_val, SPARSE_KNN_NEIGHBORS),
+                                                                    metric, return_indices=True)
+            if core_distances is None:
+                core_distances = select_core_distances(knn_distances, m_samples_val)
+        elif core_distances is None:
+            core_distances = select_core_distances(compute_core_distances(data, m_samples_val, metric), m_samples_val)
+
+        if hierarchy == 'mst':
+            # MR minimum spanning tree over implicit distances (O(n) memory)
+            mst = mutual_reachability_mst(data, core_distances, metric)
+            Z = mst_to_linkage(mst, data.shape[0])
+        elif hierarchy == 'sparse':
+            mst = boruvka_mutual_reachability_mst(data, core_distances, metric, knn_distances, knn_indices)
+            Z = mst_to_linkage(mst, data.shape[0])
+        elif hierarchy == 'dense':
+            # Condensed MR vector only (never the square form), fed to scipy as is
+            condensed = compute_mutual_reachability_condensed(data, m_samples_val, metric, core_dist=core_distances)
+            Z = canonical_linkage(linkage(condensed, method='single'))
         else:
-            metrics['error'] = "Label file length does not match data length."
+            # float32 condensed vector: Prim reads it directly, no float64 copy, and
+            # rechecks its candidates in float64 so the tree is that of 'mst'
+            condensed = compute_mutual_reachability_condensed(data, m_samples_val, metric, core_dist=core_distances,
+                                                              dtype=np.float32)
+            Z = mst_to_linkage(condensed_mst(condensed, data.shape[0], data, core_distances, metric), data.shape[0])
+            del condensed
 
-    return {
-        'labels': labels.tolist(),
-        'probabilities': probabilities.tolist(),
+        # The HDBSCAN flat clustering is extracted from the resulting linkage.
+        labels, probabilities = linkage_to_labels(Z, min_cluster_size)
+
+    metrics = clustering_metrics(labels, true_labels)
+
+    if lean:
+        return {
+            'labels': np.asarray(labels, dtype=np.int32),
+            'probabilities': np.asarray(probabilities, dtype=np.float32),
+            'n_clusters': int(labels.max() + 1),
+            'noise_points': int((labels == -1).sum()),
+            'metrics': metrics,
+            'linkage_z': Z
+        }
+
+    figures = render_figures(data, labels, Z, projection=projection, projection_method=projection_method,
+                             encoding=encoding)
+
+    results = {
+        'labels': encode_array(labels, encoding),
+        'probabilities': encode_array(probabilities, encoding),
         'n_clusters': int(labels.max() + 1),
         'noise_points': int((labels == -1).sum()),
-        'dendrogram_json': fig_dendro.to_json(),
-        'reachability_json': fig_reach.to_json(),
-        'map_json': fig_map.to_json(),
+        'dendrogram_json': figures['dendrogram_json'],
+        'reachability_json': figures['reachability_json'],
+        'map_json': figures['map_json'],
         'metrics': metrics,
-        'linkage_z': Z.tolist()
+        'linkage_z': encode_array(Z, encoding)
     }
+    if keep_linkage:
+        results['linkage'] = Z
+    return results
 
@@ -0,0 +1,93 @@
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import minimum_spanning_tree
+from scipy.spatial.distance import cdist
+from sklearn.neighbors import NearestNeighbors
+
+from .mst import mutual_reachability_mst, SCIPY_METRICS
+
+
+# CORE-SG (docs/CORE-SG_Efficient_Computation_of_Multiple_MSTs_for_Density-Based_Methods.pdf):
+# the union of the kNN graph at k_max and the MR minimum spanning tree at
+# mpts = k_max contains an MR minimum spanning tree for every mpts <= k_max.
+# The graph is built once per batch; each mpts then only reweights its ~n * k_max
+# edges and runs a sparse MST, instead of a full neighbor search and dense Prim.
+CORE_GRAPH_ARRAYS = ('sources', 'targets', 'distances', 'knn_distances')
+
+
+def paired_distances(data, a, b, metric='euclidean'):
+    """
+    Distances between the point pairs (a[i], b[i]).
+    """
+    data = np.asarray(data, dtype=np.float64)
+    scipy_metric = SCIPY_METRICS.get(metric, metric)
+    diff = np.abs(data[a] - data[b])
+    if scipy_metric == 'euclidean':
+        return np.sqrt((diff ** 2).sum(axis=1))
+    if scipy_metric == 'cityblock':
+        return diff.sum(axis=1)
+    if scipy_metric == 'chebyshev':
+        return diff.max(axis=1)
+    return np.array([cdist(data[i:i + 1], data[j:j + 1], metric=scipy_metric)[0, 0] for i, j in zip(a, b)])
+
+
+def build_core_graph(data, k_max, metric='euclidean'):
+    """
+    Builds the CORE-SG graph for every mpts <= k_max: one kNN query at k_max and the
+    MR minimum spanning tree at mpts = k_max (Prim over implicit distances).
+    Returns a dict of arrays: the undirected edges ('sources', 'targets', each
+    pair stored once) with their plain distances, and the sorted kNN distances
+    ('knn_distances', as compute_core_distances) for the core distances.
+    """
+    data = np.ascontiguousarray(data, dtype=np.float64)
+    n_samples = data.shape[0]
+    k = min(int(k_max), n_samples)
+
+    nbrs = NearestNeighbors(n_neighbors=k, metric=metric).fit(data)
+    knn_distances, knn_indices = nbrs.kneighbors(data)
+
+    mst = mutual_reachability_mst(data, knn_distances[:, k - 1], metric)
+    mst_a = mst[:, 0].astype(np.intp)
+    mst_b = mst[:, 1].astype(np.intp)
+
+    a = np.concatenate([mst_a, np.repeat(np.arange(n_samples), k)])
+    b = np.concatenate([mst_b, knn_indices.ravel()])
+    distances = np.concatenate([paired_distances(data, mst_a, mst_b, metric), knn_distances.ravel()])
+
+    # Undirected, without self loops (the point itself, or duplicates of it) and
+    # with every pair once: sparse matrix construction would add duplicates up
+    sources = np.minimum(a, b)
+    targets = np.maximum(a, b)
+    keep = sources != targets
+    _, first = np.unique(sources[keep].astype(np.int64) * n_samples + targets[keep], return_index=True)
+
+    return {
+        'sources': sources[keep][first],
+        'targets': targets[keep][first],
+        'distances': distances[keep][first],
+        'knn_distances': knn_distances
+    }
+
+
+def core_graph_mst(core_graph, core_dist):
+    """
+    MR minimum spanning tree for one mpts from a build_core_graph result, given
+    the core distances of that mpts (k <= k_max). Returns an (n-1, 3) array of
+    edges like mutual_reachability_mst.
+    """
+    sources = np.asarray(core_graph['sources'])
+    targets = np.asarray(core_graph['targets'])
+    core_dist = np.asarray(core_dist, dtype=np.float64)
+    n_samples = len(core_dist)
+
+    weights = np.maximum(np.asarray(core_graph['distances']), np.maximum(core_dist[sources], core_dist[targets]))
+
+    # csgraph reads stored zeros as missing edges: zero MR distances (duplicate
+    # points) go in as the smallest positive float and come back out as 0
+    tiny = np.finfo(np.float64).tiny
+    graph = coo_matrix((np.where(weights > 0, weights, tiny), (sources, targets)), shape=(n_samples, n_samples))
+    tree = minimum_spanning_tree(graph.tocsr()).tocoo()
+    if tree.nnz != n_samples - 1:
+        raise ValueError('The core graph does not connect every point.')
+
+    return np.column_stack([tree.row, tree.col, np.where(tree.data > tiny, tree.data, 0.0)])
@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from .storage import WORKSPACE, write_json, read_json, evict_least_recently_used
+
+
+# Uploaded datasets, addressed by the SHA-256 of the uploaded bytes: a file is
+# parsed once, later requests (or re-uploads of the same file) reuse the stored
+# numeric matrix. Layout of DATASETS_ROOT/<dataset id>/:
+#   data.npy    numeric columns as one matrix, loaded memory-mapped
+#   info.json   column names, shape, original file name and a preview of the rows
+DATASETS_ROOT = os.path.join(WORKSPACE, 'datasets')
+
+# Size cap of the registry; least recently used datasets are evicted beyond it
+DATASET_STORE_MAX_BYTES = int(os.environ.get('MUSTACHE_DATASET_STORE_MB', 4096)) * 1024 * 1024
+
+PREVIEW_ROWS = 5
+
+_HASH_CHUNK = 1024 * 1024
+
+
+def _dataset_dir(dataset_id):
+    if not dataset_id or len(dataset_id) != 64 or not all(c in '0123456789abcdef' for c in dataset_id):
+        raise ValueError(f"Unknown dataset '{dataset_id}'.")
+    return os.path.join(DATASETS_ROOT, dataset_id)
+
+
+def parse_numeric_csv(path):
+    """
+    Reads a CSV file with header inference: if the inferred header leaves no
+    numeric column, the file is read again without a header.
+    Returns (df, numeric_df).
+    """
+    df = pd.read_csv(path)
+    numeric = df.select_dtypes(include=[np.number])
+    if numeric.empty:
+        df = pd.read_csv(path, header=None)
+        numeric = df.select_dtypes(include=[np.number])
+    if numeric.empty:
+        raise ValueError('The provided file contains no numerical data for clustering.')
+    return df, numeric
+
+
+def register_dataset(stream, filename=None):
+    """
+    Stores an uploaded CSV (a binary file object) and returns its dataset id.
+    The bytes are hashed while they are spooled to disk; a dataset seen before is
+    not parsed again.
+    """
+    os.makedirs(DATASETS_ROOT, exist_ok=True)
+    tmp_dir = os.path.join(DATASETS_ROOT, f'.upload-{uuid.uuid4().hex}')
+    os.makedirs(tmp_dir)
+    try:
+        digest = hashlib.sha256()
+        csv_path = os.path.join(tmp_dir, 'upload.csv')
+        with open(csv_path, 'wb') as f:
+            for chunk in iter(lambda: stream.read(_HASH_CHUNK), b''):
+                digest.update(chunk)
+                f.write(chunk)
+        dataset_id = digest.hexdigest()
+
+        path = _dataset_dir(dataset_id)
+        if os.path.exists(os.path.join(path, 'info.json')):
+            os.utime(os.path.join(path, 'info.json'))
+            return dataset_id
+
+        df, numeric = parse_numeric_csv(csv_path)
+        os.remove(csv_path)
+        np.save(os.path.join(tmp_dir, 'data.npy'), numeric.to_numpy())
+        write_json(os.path.join(tmp_dir, 'info.json'), {
+            'id': dataset_id,
+            'filename': filename,
+            'columns': [str(column) for column in numeric.columns],
+            'n_samples': int(numeric.shape[0]),
+            'n_features': int(numeric.shape[1]),
+            # Through pandas' JSON writer so NaN and numpy scalars come out as valid JSON
+            'preview': json.loads(df.head(PREVIEW_ROWS).to_json(orient='records')),
+            'created': time.time()
+        })
+
+        try:
+            os.replace(tmp_dir, path)
+        except OSError:
+            # Registered by a concurrent upload of the same file in the meantime
+            pass
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    evict_least_recently_used(DATASETS_ROOT, DATASET_STORE_MAX_BYTES, 'info.json', keep=dataset_id)
+    return dataset_id
+
+
+def dataset_info(dataset_id):
+    """
+    Returns the info.json of a dataset, or None if it is not registered.
+    """
+    path = os.path.join(_dataset_dir(dataset_id), 'info.json')
+    if not os.path.exists(path):
+        return None
+    return read_json(path)
+
+
+def load_dataset(dataset_id):
+    """
+    Returns the numeric columns of a registered dataset as a DataFrame over the
+    memory-mapped matrix. Raises ValueError for unknown ids.
+    """
+    path = _dataset_dir(dataset_id)
+    info = dataset_info(dataset_id)
+    if info is None:
+        raise ValueError(f"Unknown dataset '{dataset_id}'.")
+    # Using a dataset counts as a use for the LRU eviction
+    os.utime(os.path.join(path, 'info.json'))
+
+    data = np.load(os.path.join(path, 'data.npy'), mmap_mode='r')
+    return pd.DataFrame(data, columns=info['columns'], copy=False)
@@ -0,0 +1,137 @@
+import numpy as np
+from scipy.cluster.hierarchy import dendrogram
+
+
+# Level of detail: only the top merges are drawn, so the figure size is bounded by
+# what fits on screen rather than by n. Collapsed subtrees become leaves annotated
+# with their point count and can be expanded through the zoom endpoint.
+DENDROGRAM_MAX_LEAVES = 200
+
+# scipy's default link colors (matplotlib cycle) as hex for Plotly
+LINK_COLORS = {
+    'C0': '#1f77b4', 'C1': '#ff7f0e', 'C2': '#2ca02c', 'C3': '#d62728', 'C4': '#9467bd',
+    'C5': '#8c564b', 'C6': '#e377c2', 'C7': '#7f7f7f', 'C8': '#bcbd22', 'C9': '#17becf',
+}
+
+
+def subtree_linkage(Z, node):
+    """
+    Extracts the hierarchy below a cluster node of Z as a standalone linkage matrix.
+    Returns (sub_Z, ids) where ids maps every node of sub_Z (leaves first, then
+    merges) back to its id in Z, so zoom requests can keep using the original ids.
+    """
+    Z = np.asarray(Z)
+    n_samples = len(Z) + 1
+
+    # Merges below node; children always have lower ids than their parent,
+    # so sorting the rows keeps them in a valid bottom-up order.
+    rows = []
+    leaves = []
+    stack = [int(node)]
+    while stack:
+        current = stack.pop()
+        if current < n_samples:
+            leaves.append(current)
+        else:
+            row = current - n_samples
+            rows.append(row)
+            stack.append(int(Z[row, 0]))
+            stack.append(int(Z[row, 1]))
+
+    rows = np.sort(np.array(rows, dtype=np.intp))
+    leaves = np.sort(np.array(leaves, dtype=np.intp))
+    ids = np.concatenate([leaves, n_samples + rows])
+    new_id = {int(old): new for new, old in enumerate(ids)}
+
+    sub_Z = Z[rows].copy()
+    sub_Z[:, 0] = [new_id[int(c)] for c in Z[rows, 0]]
+    sub_Z[:, 1] = [new_id[int(c)] for c in Z[rows, 1]]
+
+    # Keep scipy's convention of the smaller id first
+    sub_Z[:, :2] = np.sort(sub_Z[:, :2], axis=1)
+
+    return sub_Z, ids
+
+
+def dendrogram_figure(Z, node=None, max_leaves=DENDROGRAM_MAX_LEAVES, title='Hierarchical Clustering Dendrogram'):
+    """
+    Builds a Plotly dendrogram of Z (or of the subtree below node) showing at most
+    max_leaves leaves: the hierarchy is cut at its top merges and every collapsed
+    subtree is drawn as a single leaf labelled with its point count.
+    Leaf markers carry the original node id in customdata for zooming.
+    """
+    import plotly.graph_objects as go
+
+    Z = np.asarray(Z, dtype=np.float64)
+    n_samples = len(Z) + 1
+
+    if node is not None and int(node) >= n_samples:
+        Z, ids = subtree_linkage(Z, node)
+    else:
+        ids = np.arange(2 * n_samples - 1)
+
+    n_leaves = len(Z) + 1
+    truncate = n_leaves > max_leaves
+    dendro = dendrogram(
+        Z,
+        truncate_mode='lastp' if truncate else None,
+        p=max_leaves,
+        no_plot=True,
+        show_leaf_counts=True
+    )
+
+    # One line trace per link color, links separated by NaN gaps, rather than one
+    # trace per link: keeps the serialized figure small.
+    fig = go.Figure()
+    icoord = np.asarray(dendro['icoord'], dtype=np.float64).reshape(-1, 4)
+    dcoord = np.asarray(dendro['dcoord'], dtype=np.float64).reshape(-1, 4)
+    color_list = np.asarray(dendro['color_list'])
+    gap = np.full((len(icoord), 1), np.nan)
+    for color in dict.fromkeys(dendro['color_list']):
+        links = color_list == color
+        fig.add_trace(go.Scatter(
+            x=np.hstack([icoord[links], gap[links]]).ravel(),
+            y=np.hstack([dcoord[links], gap[links]]).ravel(),
+            mode='lines',
+            line=dict(color=LINK_COLORS.get(color, color), width=1),
+            hoverinfo='skip',
+            showlegend=False
+        ))
+
+    # One marker per displayed leaf; collapsed leaves can be expanded
+    leaf_ids = [int(ids[leaf]) for leaf in dendro['leaves']]
+    leaf_x = [10 * i + 5 for i in range(len(leaf_ids))]
+    leaf_labels = [
+        str(leaf_id) if leaf < n_leaves else label
+        for leaf_id, leaf, label in zip(leaf_ids, dendro['leaves'], dendro['ivl'])
+    ]
+    leaf_text = [
+        f"Point {leaf_id}" if leaf < n_leaves else f"{label.strip('()')} points (click to expand)"
+        for leaf_id, leaf, label in zip(leaf_ids, dendro['leaves'], dendro['ivl'])
+    ]
+    fig.add_trace(go.Scatter(
+        x=leaf_x,
+        y=[0] * len(leaf_x),
+        mode='markers',
+        marker=dict(size=6, color='#097B43'),
+        customdata=leaf_ids,
+        text=leaf_text,
+        hoverinfo='text',
+        showlegend=False
+    ))
+
+    fig.update_layout(
+        template='plotly_white',
+        title=title,
+        xaxis=dict(
+            title='Sample Index' if not truncate else 'Sample Index (collapsed subtrees show point counts)',
+            tickmode='array',
+            tickvals=leaf_x,
+            ticktext=leaf_labels,
+            showgrid=False,
+            zeroline=False
+        ),
+        yaxis=dict(title='Distance', zeroline=False),
+        margin=dict(l=20, r=20, t=40, b=20)
+    )
+    return fig
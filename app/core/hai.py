@@ -1,7 +1,11 @@
+import os
+
 import numpy as np
 from sklearn.cluster import HDBSCAN
 from scipy.spatial.distance import pdist, squareform
-from scipy.cluster.hierarchy import leaves_list, to_tree, linkage
+from scipy.cluster.hierarchy import leaves_list, to_tree, linkage, fcluster
+
+from .storage import CORES_PER_WEB_WORKER
 
 def build_distance_matrix(Z, n_samples):
     """
@@ -22,8 +26,9 @@ def build_distance_matrix(Z, n_samples):
         
         child1_idx = int(row[0])
         child2_idx = int(row[1])
-        # row[3] is number of samples in the new cluster (size)
-        cluster_size = row[3]
+        # row[3] is number of samples in the new cluster (size); a fifth column
+        # (min_cluster_size_linkage) replaces it
+        cluster_size = row[-1]
         
         normalized_size = cluster_size / n_samples
         
@@ -60,10 +65,358 @@ def compute_hai_score(D1, D2):
     return 1.0 - (total_diff / (n * n))
 
 
-def compute_hai_matrix(linkage_list, n_samples):
+# HAI engines for compute_hai_matrix:
+# - 'tree': exact, from the linkage trees' leaf-order profiles, O(n) memory per
+#   hierarchy (blocks of rows are bounded by HAI_MEMORY_BUDGET)
+# - 'sampled': estimate from random point pairs shared by all hierarchies,
+#   with a confidence interval (compute_hai_matrix_sampled)
+# - 'dense': one n x n distance matrix per hierarchy (build_distance_matrix)
+# - 'auto': 'tree' up to HAI_EXACT_MAX_SAMPLES points, 'sampled' beyond
+HAI_METHODS = ('auto', 'tree', 'sampled', 'dense')
+
+# Memory budget (bytes) for one block of hierarchy distance rows in the tree engine
+HAI_MEMORY_BUDGET = 256 * 1024 * 1024
+
+# Worker processes for the exact HAI engine. MUSTACHE_HAI_WORKERS overrides the
+# default of one worker per core left to this web worker (see BATCH_WORKERS);
+# 1 computes in-process.
+HAI_WORKERS = int(os.environ.get('MUSTACHE_HAI_WORKERS', 0)) or CORES_PER_WEB_WORKER
+
+# Below this many points the pool start-up costs more than the HAI itself
+HAI_PARALLEL_MIN_SAMPLES = 5000
+
+# Exact HAI costs O(n^2) per pair of hierarchies; past this size 'auto' samples
+HAI_EXACT_MAX_SAMPLES = 20000
+
+# Sampled HAI: number of point pairs and confidence level of the reported interval.
+# |D1 - D2| lies in [0, 1], so 100k pairs keep the 95% half-width below 0.0031.
+HAI_SAMPLE_PAIRS = 100000
+HAI_CONFIDENCE = 0.95
+
+
+def min_cluster_size_linkage(Z, min_cluster_size):
+    """
+    Z with a fifth column for comparing hierarchies that differ in min_cluster_size:
+    the size of the smallest cluster of at least min_cluster_size points containing
+    each merge. Subtrees below min_cluster_size never become clusters in HDBSCAN's
+    condensed tree, so their points are only told apart by the cluster they fall
+    out of. The HAI engines use this column instead of the counts when present.
+    """
+    Z = np.asarray(Z, dtype=np.float64)[:, :4]
+    n_merges = len(Z)
+    sizes = Z[:, 3]
+    rows = np.arange(n_merges)
+
+    # parent[i]: row of the merge that uses merge i (the root points to itself)
+    parent = rows.copy()
+    for side in (0, 1):
+        child = Z[:, side].astype(np.intp) - (n_merges + 1)
+        internal = child >= 0
+        parent[child[internal]] = rows[internal]
+
+    # Pointer jumping to the first ancestor-or-self that is large enough;
+    # sizes grow towards the root, so every chain ends there.
+    large = sizes >= min_cluster_size
+    anchor = np.where(large, rows, parent)
+    while True:
+        jumped = np.where(large[anchor], anchor, anchor[anchor])
+        if np.array_equal(jumped, anchor):
+            break
+        anchor = jumped
+
+    return np.column_stack([Z, sizes[anchor]])
+
+
+def linkage_gap_profile(Z):
+    """
+    Returns (order, gap_sizes) for a linkage matrix: the dendrogram leaf order and,
+    for each gap between consecutive leaves, the size of the cluster where they
+    first meet. The cluster containing leaves at positions a < b is the largest
+    one among gaps a..b-1, so this O(n) profile encodes every entry of the
+    build_distance_matrix matrix.
+    """
+    from .reachability import linkage_leaf_order
+
+    Z = np.asarray(Z, dtype=np.float64)
+    order, gap_merge = linkage_leaf_order(Z[:, :4])
+    # Cluster sizes: the counts, or the min_cluster_size_linkage column
+    return order, Z[gap_merge, -1].astype(np.int32)
+
+
+def hierarchy_distance_rows(order, gap_sizes, points):
+    """
+    Rows of the hierarchy distance matrix for the given points, as cluster sizes
+    (int32, not yet divided by n): rows[r, q] = size of the smallest cluster
+    containing points[r] and q, and 1 on the diagonal.
+    """
+    n_samples = len(order)
+    positions = np.empty(n_samples, dtype=np.intp)
+    positions[order] = np.arange(n_samples)
+    start = positions[points][:, np.newaxis]
+
+    gap_idx = np.arange(n_samples - 1)[np.newaxis, :]
+    # Leaves to the right: running max of the gaps from the point's position on
+    right = np.where(gap_idx >= start, gap_sizes[np.newaxis, :], 0)
+    np.maximum.accumulate(right, axis=1, out=right)
+    # Leaves to the left: running max of the gaps going backwards
+    left = np.where(gap_idx < start, gap_sizes[np.newaxis, :], 0)
+    left = np.maximum.accumulate(left[:, ::-1], axis=1)[:, ::-1]
+
+    # Only one side is non-zero at every position except the point itself
+    rows_by_position = np.zeros((len(points), n_samples), dtype=np.int32)
+    rows_by_position[:, 1:] = right
+    rows_by_position[:, :-1] += left
+    rows_by_position[np.arange(len(points)), start[:, 0]] = 1
+
+    rows = np.empty_like(rows_by_position)
+    rows[:, order] = rows_by_position
+    return rows
+
+
+def _hai_block_sums(orders, gap_sizes, point_start, point_stop, block_size, first_new=None):
+    # Sum of |size_i - size_j| over the rows of points [point_start, point_stop),
+    # for every pair of hierarchies i < j (condensed upper triangle), or, with
+    # first_new, for hierarchies first_new.. against all of them (rectangle).
+    from scipy.spatial.distance import cdist
+
+    n_hierarchies = len(orders)
+    if first_new is None:
+        total = np.zeros(n_hierarchies * (n_hierarchies - 1) // 2)
+    else:
+        total = np.zeros((n_hierarchies - first_new, n_hierarchies))
+
+    for block_start in range(point_start, point_stop, block_size):
+        points = np.arange(block_start, min(block_start + block_size, point_stop))
+        rows = np.stack([hierarchy_distance_rows(orders[i], gap_sizes[i], points) for i in range(n_hierarchies)])
+        rows = rows.reshape(n_hierarchies, -1)
+        if first_new is None:
+            total += pdist(rows, metric='cityblock')
+        else:
+            total += cdist(rows[first_new:], rows, metric='cityblock')
+    return total
+
+
+# Per-process state of HAI pool workers: the gap profiles of every hierarchy,
+# memory-mapped read-only from the .npy files written by the parent.
+_worker_state = {}
+
+
+def _init_hai_worker(orders_path, gaps_path):
+    from threadpoolctl import threadpool_limits
+
+    # One BLAS/OpenMP thread per worker: the pool already occupies every core
+    _worker_state['thread_limits'] = threadpool_limits(limits=1)
+    _worker_state['orders'] = np.load(orders_path, mmap_mode='r')
+    _worker_state['gap_sizes'] = np.load(gaps_path, mmap_mode='r')
+
+
+def _run_hai_task(point_start, point_stop, block_size, first_new):
+    return _hai_block_sums(_worker_state['orders'], _worker_state['gap_sizes'], point_start, point_stop, block_size,
+                           first_new)
+
+
+def compute_hai_matrix_tree(linkage_list, n_samples, memory_budget=HAI_MEMORY_BUDGET, n_workers=None):
+    """
+    Exact HAI matrix computed from the linkage trees without any n x n matrix.
+    Rows of every hierarchy's distance matrix are generated block by block from
+    the gap profiles; the L1 differences between hierarchies are accumulated
+    per block with pdist on integer cluster sizes, so the sums are exact.
+    With more than one worker (n_workers, default HAI_WORKERS) the points are
+    split into chunks over a process pool and the partial sums are added up.
+    """
+    total_diff = _tree_hai_sums(linkage_list, n_samples, memory_budget, n_workers)
+
+    # Same score as compute_hai_score: D = size / n, HAI = 1 - sum|D1 - D2| / n^2
+    hai_matrix = 1.0 - squareform(total_diff) / (float(n_samples) ** 3)
+    np.fill_diagonal(hai_matrix, 1.0)
+    return hai_matrix
+
+
+def compute_hai_rows_tree(linkage_list, n_samples, first_new, memory_budget=HAI_MEMORY_BUDGET, n_workers=None):
+    """
+    Exact HAI of the hierarchies linkage_list[first_new:] against every hierarchy
+    in linkage_list, as a (new, total) matrix: the rows a grown HAI matrix needs,
+    without recomputing the scores between the first first_new hierarchies.
+    """
+    total_diff = _tree_hai_sums(linkage_list, n_samples, memory_budget, n_workers, first_new)
+
+    hai_rows = 1.0 - total_diff / (float(n_samples) ** 3)
+    hai_rows[np.arange(len(hai_rows)), first_new + np.arange(len(hai_rows))] = 1.0
+    return hai_rows
+
+
+def _tree_hai_sums(linkage_list, n_samples, memory_budget=HAI_MEMORY_BUDGET, n_workers=None, first_new=None):
+    # Shared driver of the exact engine: gap profiles, block size and
+    # sequential or pooled accumulation (see _hai_block_sums)
+    n_hierarchies = len(linkage_list)
+    profiles = [linkage_gap_profile(Z) for Z in linkage_list]
+    orders = np.stack([order for order, _ in profiles])
+    gap_sizes = np.stack([gaps for _, gaps in profiles])
+
+    n_workers = int(n_workers or HAI_WORKERS)
+    if n_hierarchies < 2 or n_samples < HAI_PARALLEL_MIN_SAMPLES:
+        n_workers = 1
+
+    # int32 rows plus their float64 copy for pdist: 12 bytes per entry,
+    # the budget being shared by the workers
+    block_size = max(1, int(memory_budget) // (12 * n_workers * max(n_hierarchies, 1) * n_samples))
+
+    if n_workers <= 1:
+        return _hai_block_sums(orders, gap_sizes, 0, n_samples, block_size, first_new)
+    return _run_hai_pool(orders, gap_sizes, n_samples, n_workers, block_size, first_new)
+
+
+def _run_hai_pool(orders, gap_sizes, n_samples, n_workers, block_size, first_new=None):
+    """
+    Spreads chunks of points over a process pool. The gap profiles are written
+    once to .npy files that every worker memory-maps read-only.
+    """
+    import multiprocessing
+    import shutil
+    import tempfile
+    from concurrent.futures import ProcessPoolExecutor
+
+    # A few chunks per worker keep the pool busy when chunks run at different speeds
+    n_chunks = min(n_samples, 4 * n_workers)
+    bounds = np.linspace(0, n_samples, n_chunks + 1).astype(int)
+
+    workdir = tempfile.mkdtemp(prefix='mustache-hai-')
+    try:
+        orders_path = os.path.join(workdir, 'orders.npy')
+        gaps_path = os.path.join(workdir, 'gap_sizes.npy')
+        np.save(orders_path, orders)
+        np.save(gaps_path, gap_sizes)
+
+        # 'spawn' avoids forking a multi-threaded web server process
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=context,
+                                 initializer=_init_hai_worker, initargs=(orders_path, gaps_path)) as pool:
+            futures = [
+                pool.submit(_run_hai_task, int(start), int(stop), block_size, first_new)
+                for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start
+            ]
+            return sum(future.result() for future in futures)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def range_max_table(values):
+    """
+    Sparse table for O(1) range maximum queries: level k holds the maximum of
+    every window of 2**k consecutive values.
+    """
+    table = [np.asarray(values)]
+    width = 1
+    while 2 * width <= len(values):
+        previous = table[-1]
+        table.append(np.maximum(previous[:-width], previous[width:]))
+        width *= 2
+    return table
+
+
+def range_max(table, lo, hi):
+    """
+    Maximum of values[lo..hi] (inclusive, arrays of query bounds with lo <= hi).
+    """
+    level = np.floor(np.log2(hi - lo + 1)).astype(np.intp)
+    result = np.empty(len(lo), dtype=table[0].dtype)
+    for k in np.unique(level):
+        mask = level == k
+        result[mask] = np.maximum(table[k][lo[mask]], table[k][hi[mask] - (1 << k) + 1])
+    return result
+
+
+def pair_cluster_sizes(order, gap_sizes, p, q):
+    """
+    Size of the smallest cluster containing p[k] and q[k] for every sampled pair
+    (1 when p[k] == q[k], the diagonal of build_distance_matrix).
+    """
+    n_samples = len(order)
+    positions = np.empty(n_samples, dtype=np.intp)
+    positions[order] = np.arange(n_samples)
+
+    a = np.minimum(positions[p], positions[q])
+    b = np.maximum(positions[p], positions[q])
+
+    sizes = np.ones(len(p), dtype=np.int32)
+    distinct = a < b
+    sizes[distinct] = range_max(range_max_table(gap_sizes), a[distinct], b[distinct] - 1)
+    return sizes
+
+
+def compute_hai_matrix_sampled(linkage_list, n_samples, n_pairs=HAI_SAMPLE_PAIRS, confidence=HAI_CONFIDENCE,
+                               random_state=42):
+    """
+    Estimates the HAI matrix from n_pairs random point pairs instead of all n^2.
+    The same pairs are used for every hierarchy, so the estimates of different
+    hierarchy pairs are directly comparable. Pairs are drawn uniformly with
+    replacement over all n^2 ordered pairs (diagonal included, as in the exact
+    score), which makes 1 - mean|D1 - D2| an unbiased estimate.
+    Returns (hai_matrix, margin): margin holds the half-width of the normal
+    approximation confidence interval at the given level for every entry.
+    """
+    values = _sampled_pair_values(linkage_list, n_samples, n_pairs, random_state)
+    hai_matrix, margin = _sampled_scores(values, values, confidence)
+    np.fill_diagonal(hai_matrix, 1.0)
+    np.fill_diagonal(margin, 0.0)
+    return hai_matrix, margin
+
+
+def _sampled_pair_values(linkage_list, n_samples, n_pairs, random_state):
+    # D values (cluster size / n) of the sampled pairs, one row per hierarchy.
+    # The pairs only depend on random_state, so later calls reuse the same ones.
+    rng = np.random.default_rng(random_state)
+    p = rng.integers(0, n_samples, size=n_pairs)
+    q = rng.integers(0, n_samples, size=n_pairs)
+
+    values = np.empty((len(linkage_list), n_pairs))
+    for i, Z in enumerate(linkage_list):
+        order, gap_sizes = linkage_gap_profile(Z)
+        values[i] = pair_cluster_sizes(order, gap_sizes, p, q) / n_samples
+    return values
+
+
+def _sampled_scores(values_a, values_b, confidence):
+    # HAI estimates and confidence half-widths between every row of values_a
+    # and every row of values_b
+    from scipy.spatial.distance import cdist
+    from scipy.stats import norm
+
+    n_pairs = values_a.shape[1]
+    mean_abs = cdist(values_a, values_b, metric='cityblock') / n_pairs
+    mean_sq = cdist(values_a, values_b, metric='sqeuclidean') / n_pairs
+    variance = np.maximum(mean_sq - mean_abs ** 2, 0) * n_pairs / max(n_pairs - 1, 1)
+
+    margin = norm.ppf(0.5 + confidence / 2) * np.sqrt(variance / n_pairs)
+    return 1.0 - mean_abs, margin
+
+
+def resolve_hai_method(n_samples, method='auto'):
+    """
+    Maps 'auto' to a concrete HAI engine based on the dataset size.
+    """
+    if method not in HAI_METHODS:
+        raise ValueError(f"Unknown HAI method '{method}'. Choose one of {HAI_METHODS}.")
+
+    if method != 'auto':
+        return method
+    return 'tree' if n_samples <= HAI_EXACT_MAX_SAMPLES else 'sampled'
+
+
+def compute_hai_matrix(linkage_list, n_samples, method='tree', n_workers=None):
     """
     Computes the HAI matrix for a list of linkage structures.
+    method selects the engine (see HAI_METHODS); use compute_hai_matrix_sampled
+    directly to also get the confidence interval of a sampled estimate.
+    n_workers is passed to the tree engine (see compute_hai_matrix_tree).
     """
+    method = resolve_hai_method(n_samples, method)
+
+    if method == 'tree':
+        return compute_hai_matrix_tree(linkage_list, n_samples, n_workers=n_workers)
+    if method == 'sampled':
+        return compute_hai_matrix_sampled(linkage_list, n_samples)[0]
+
     n_hierarchies = len(linkage_list)
     hai_matrix = np.zeros((n_hierarchies, n_hierarchies))
     
@@ -81,6 +434,54 @@ def compute_hai_matrix(linkage_list, n_samples):
             
     return hai_matrix
 
+def extend_hai_matrix(hai_matrix, linkage_list, n_samples, method='tree', hai_error=None):
+    """
+    Grows an HAI matrix computed for linkage_list[:len(hai_matrix)] to the whole
+    of linkage_list: only the rows/columns of the new hierarchies are computed,
+    O(new x total) pair scores instead of O(total^2).
+    method must be the (resolved) engine the existing matrix was computed with;
+    for 'sampled' the same pairs are drawn again so old and new entries agree,
+    and hai_error holds the existing confidence half-widths.
+    Returns (hai_matrix, hai_error); hai_error is None unless method is 'sampled'.
+    """
+    method = resolve_hai_method(n_samples, method)
+    hai_matrix = np.asarray(hai_matrix, dtype=np.float64)
+    n_old = len(hai_matrix)
+    n_total = len(linkage_list)
+    new_idx = np.arange(n_old, n_total)
+
+    margin_rows = None
+    if method == 'tree':
+        hai_rows = compute_hai_rows_tree(linkage_list, n_samples, n_old)
+    elif method == 'sampled':
+        values = _sampled_pair_values(linkage_list, n_samples, HAI_SAMPLE_PAIRS, 42)
+        hai_rows, margin_rows = _sampled_scores(values[n_old:], values, HAI_CONFIDENCE)
+        hai_rows[np.arange(len(new_idx)), new_idx] = 1.0
+        margin_rows[np.arange(len(new_idx)), new_idx] = 0.0
+    else:
+        d_matrices = [build_distance_matrix(Z, n_samples) for Z in linkage_list]
+        hai_rows = np.ones((len(new_idx), n_total))
+        for r, i in enumerate(new_idx):
+            for j in range(n_total):
+                if i != j:
+                    hai_rows[r, j] = compute_hai_score(d_matrices[i], d_matrices[j])
+
+    grown = np.zeros((n_total, n_total))
+    grown[:n_old, :n_old] = hai_matrix
+    grown[n_old:, :] = hai_rows
+    grown[:, n_old:] = hai_rows.T
+
+    grown_error = None
+    if margin_rows is not None:
+        grown_error = np.zeros((n_total, n_total))
+        if hai_error is not None:
+            grown_error[:n_old, :n_old] = hai_error
+        grown_error[n_old:, :] = margin_rows
+        grown_error[:, n_old:] = margin_rows.T
+
+    return grown, grown_error
+
+
 def run_meta_clustering(hai_matrix):
     """
     Runs HDBSCAN on the HAI matrix (converted to distance).
@@ -124,7 +525,86 @@ def compute_medoids(hai_matrix, labels):
             
         sub_matrix = distance_matrix[np.ix_(indices, indices)]
         total_distances = np.sum(sub_matrix, axis=0)
-        min_idx = np.argmin(total_distances)
+        min_idx = _medoid_position(total_distances)
         medoids[int(label)] = int(indices[min_idx])
         
     return medoids
+
+
+def _medoid_position(total_distances):
+    # First position of the smallest total distance. Totals equal up to rounding
+    # count as tied, so the pick doesn't depend on the order the sums were added in
+    # (build_cut_index accumulates them merge by merge).
+    total_distances = np.asarray(total_distances)
+    smallest = total_distances.min()
+    return int(np.flatnonzero(total_distances <= smallest + 1e-9 * max(1.0, abs(smallest)))[0])
+
+
+def build_cut_index(meta_linkage, hai_matrix):
+    """
+    Precomputes every distinct cut of the meta-dendrogram: the partition only
+    changes at merge heights, so one fcluster pass per distinct height covers all
+    thresholds. Medoids are kept up to date merge by merge: every hierarchy's total
+    distance to its group only grows by its distances to the group it merges with,
+    so the whole index costs O(h^2) instead of a compute_medoids pass per height.
+    Returns (heights, cut_labels, cut_medoids):
+    - heights: sorted distinct merge heights
+    - cut_labels[k]: fcluster labels (1..c) for thresholds in [heights[k - 1], heights[k]);
+      row 0 is the cut below the lowest merge (every hierarchy on its own)
+    - cut_medoids[k, j]: index of the medoid of cluster j + 1 in that cut, -1 past c
+    Look cuts up with cut_at.
+    """
+    Z = np.asarray(meta_linkage, dtype=np.float64)
+    distance_matrix = 1.0 - np.asarray(hai_matrix, dtype=np.float64)
+    n_items = len(distance_matrix)
+
+    heights = np.unique(Z[:, 2]) if len(Z) else np.zeros(0)
+    cut_labels = np.empty((len(heights) + 1, n_items), dtype=np.int32)
+    cut_medoids = np.full((len(heights) + 1, n_items), -1, dtype=np.int32)
+
+    # Members (sorted) and medoid of every meta-linkage node formed so far, the
+    # node each hierarchy currently belongs to, and each hierarchy's total distance
+    # to the members of its node
+    members = {i: np.array([i]) for i in range(n_items)}
+    medoid = {i: i for i in range(n_items)}
+    node_of = np.arange(n_items)
+    total_distances = np.zeros(n_items)
+
+    # Row 0: any threshold below the lowest merge
+    thresholds = np.concatenate([[heights[0] - 1.0] if len(heights) else [0.0], heights])
+    merge = 0
+    for k, threshold in enumerate(thresholds):
+        while merge < len(Z) and Z[merge, 2] <= threshold:
+            a, b = int(Z[merge, 0]), int(Z[merge, 1])
+            left, right = members.pop(a), members.pop(b)
+            between = distance_matrix[np.ix_(left, right)]
+            total_distances[left] += between.sum(axis=1)
+            total_distances[right] += between.sum(axis=0)
+
+            node = n_items + merge
+            merged = np.sort(np.concatenate([left, right]))
+            members[node] = merged
+            medoid[node] = int(merged[_medoid_position(total_distances[merged])])
+            node_of[merged] = node
+            del medoid[a], medoid[b]
+            merge += 1
+
+        labels = fcluster(Z, t=threshold, criterion='distance') if len(Z) else np.ones(n_items, dtype=np.int32)
+        cut_labels[k] = labels
+        # Every fcluster cluster is one node; its first hierarchy names it
+        cluster_ids, first = np.unique(labels, return_index=True)
+        cut_medoids[k, cluster_ids - 1] = [medoid[node_of[i]] for i in first]
+
+    return heights, cut_labels, cut_medoids
+
+
+def cut_at(heights, cut_labels, cut_medoids, threshold):
+    """
+    Answers a meta-dendrogram cut from a cut index (see build_cut_index) with a
+    binary search over the merge heights. Returns (labels, {label: medoid index}),
+    the same as fcluster(..., criterion='distance') followed by compute_medoids.
+    """
+    k = int(np.searchsorted(heights, threshold, side='right'))
+    labels = np.asarray(cut_labels[k])
+    medoids = {j + 1: int(idx) for j, idx in enumerate(cut_medoids[k]) if idx >= 0}
+    return labels, medoids
@@ -0,0 +1,313 @@
+import fcntl
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+
+from .datasets import load_dataset
+from .storage import WORKSPACE, write_json, read_json
+
+
+# Background batch jobs. Everything a job produces lives in its own directory
+# under the workspace, so any web worker process can answer status/results
+# requests and cancel a job, whichever process runs it:
+#   params.json    job parameters, with the id of the registered dataset (app/core/datasets.py)
+#   progress.json  status, per-mpts progress, owning pid and heartbeat (same idea as
+#                  the legacy progress.json)
+#   results/       one <mpts>.npz per finished hierarchy
+#   analysis.json  HAI matrix and meta-clustering, once every mpts is done
+#   cancel         flag file, checked after every finished mpts
+#   lock           flock'ed around every read-modify-write of progress.json
+JOBS_ROOT = os.path.join(WORKSPACE, 'jobs')
+
+# Jobs running at the same time in one web process; more are queued. Each job
+# already spreads its mpts values over the batch process pool.
+JOB_WORKERS = int(os.environ.get('MUSTACHE_JOB_WORKERS', 0)) or 1
+
+# How often follow_job looks for new results of a running job (seconds)
+JOB_FOLLOW_INTERVAL = 0.25
+
+# Finished job directories older than this are removed when a new job is submitted
+JOB_RETENTION = 24 * 3600
+
+# The process owning a job (its 'pid' in progress.json) refreshes the job's
+# 'heartbeat' every JOB_HEARTBEAT_INTERVAL seconds while it is queued or running.
+# A job whose heartbeat is older than JOB_HEARTBEAT_TIMEOUT lost its process
+# (worker restarted or killed) and is reported as failed.
+JOB_HEARTBEAT_INTERVAL = 5
+JOB_HEARTBEAT_TIMEOUT = int(os.environ.get('MUSTACHE_JOB_HEARTBEAT_TIMEOUT', 0)) or 60
+
+# Longest a single /jobs/<id>/stream connection stays open (seconds); clients
+# fall back to polling /jobs/<id>/status when the stream ends early
+JOB_STREAM_MAX_SECONDS = int(os.environ.get('MUSTACHE_JOB_STREAM_MAX_SECONDS', 0)) or 1800
+
+JOB_STATES = ('queued', 'running', 'done', 'cancelled', 'failed')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# Unfinished jobs of this process, kept alive by the heartbeat thread
+_owned_jobs = set()
+_heartbeat_thread = None
+
+
+def _job_dir(job_id):
+    # Job ids are generated here; reject anything else so ids can't escape the workspace
+    if not job_id or not all(c in '0123456789abcdef' for c in job_id):
+        raise ValueError(f"Unknown job '{job_id}'.")
+    path = os.path.join(JOBS_ROOT, job_id)
+    if not os.path.isdir(path):
+        raise ValueError(f"Unknown job '{job_id}'.")
+    return path
+
+
+@contextmanager
+def _progress_lock(path):
+    # flock on the job's lock file, across threads and web worker processes, so
+    # heartbeats, job updates and stale-job checks never undo each other
+    with open(os.path.join(path, 'lock'), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _update_progress(path, **changes):
+    with _progress_lock(path):
+        progress = read_json(os.path.join(path, 'progress.json'))
+        progress.update(changes, updated=time.time(), heartbeat=time.time())
+        write_json(os.path.join(path, 'progress.json'), progress)
+    return progress
+
+
+def _heartbeat_stale(progress):
+    return (progress['status'] in ('queued', 'running')
+            and time.time() - progress.get('heartbeat', progress['updated']) > JOB_HEARTBEAT_TIMEOUT)
+
+
+def _beat_owned_jobs():
+    while True:
+        time.sleep(JOB_HEARTBEAT_INTERVAL)
+        for job_id in list(_owned_jobs):
+            path = os.path.join(JOBS_ROOT, job_id)
+            try:
+                with _progress_lock(path):
+                    progress = read_json(os.path.join(path, 'progress.json'))
+                    if progress['status'] in ('queued', 'running'):
+                        progress['heartbeat'] = time.time()
+                        write_json(os.path.join(path, 'progress.json'), progress)
+            except (OSError, ValueError):
+                _owned_jobs.discard(job_id)
+
+
+def _get_executor():
+    global _executor, _heartbeat_thread
+    from concurrent.futures import ThreadPoolExecutor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='mustache-job')
+        if _heartbeat_thread is None:
+            _heartbeat_thread = threading.Thread(target=_beat_owned_jobs, name='mustache-job-heartbeat', daemon=True)
+            _heartbeat_thread.start()
+        return _executor
+
+
+def prune_jobs(max_age=JOB_RETENTION):
+    """
+    Removes the directories of finished jobs last updated more than max_age seconds ago.
+    """
+    if not os.path.isdir(JOBS_ROOT):
+        return
+    now = time.time()
+    for job_id in os.listdir(JOBS_ROOT):
+        path = os.path.join(JOBS_ROOT, job_id)
+        try:
+            progress = read_json(os.path.join(path, 'progress.json'))
+        except (OSError, ValueError):
+            continue
+        if progress['status'] in ('done', 'cancelled', 'failed') and now - progress['updated'] > max_age:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def submit_batch_job(dataset_id, min_mpts, max_mpts, step, metric='euclidean', algorithm='hdbscan',
+                     projection_method='auto', hierarchy='mst', hai_method='auto'):
+    """
+    Queues a batch run over range(min_mpts, max_mpts + 1, step) on a registered
+    dataset and returns its job id right away. Progress is read with job_status, finished hierarchies with
+    load_job_results, or both as they come in with follow_job.
+    """
+    prune_jobs()
+
+    mpts_values = list(range(min_mpts, max_mpts + 1, step))
+    if not mpts_values:
+        raise ValueError('The mpts range is empty.')
+
+    job_id = uuid.uuid4().hex
+    path = os.path.join(JOBS_ROOT, job_id)
+    os.makedirs(os.path.join(path, 'results'))
+
+    params = {'dataset_id': dataset_id, 'metric': metric, 'algorithm': algorithm, 'projection_method': projection_method,
+              'hierarchy': hierarchy, 'hai_method': hai_method, 'range': [min_mpts, max_mpts, step]}
+    write_json(os.path.join(path, 'params.json'), params)
+
+    now = time.time()
+    write_json(os.path.join(path, 'progress.json'), {
+        'id': job_id,
+        'status': 'queued',
+        'mpts': mpts_values,
+        'completed': [],
+        'failed': {},
+        'error': None,
+        'pid': os.getpid(),
+        'created': now,
+        'updated': now,
+        'heartbeat': now
+    })
+
+    _owned_jobs.add(job_id)
+    _get_executor().submit(_run_batch_job, job_id)
+    return job_id
+
+
+def _run_batch_job(job_id):
+    from .batch import iter_batch_clustering, analyze_batch_results
+
+    path = os.path.join(JOBS_ROOT, job_id)
+    try:
+        params = read_json(os.path.join(path, 'params.json'))
+        progress = read_json(os.path.join(path, 'progress.json'))
+        if os.path.exists(os.path.join(path, 'cancel')):
+            _update_progress(path, status='cancelled')
+            return
+        _update_progress(path, status='running')
+
+        df = load_dataset(params['dataset_id'])
+        mpts_values = progress['mpts']
+
+        # Progress is recorded per mpts as results come in; cancellation is checked
+        # after each one and closing the sweep drops the runs not started yet.
+        # The sweep runs one kNN query for the whole job, as run_batch_clustering.
+        completed, failed = [], {}
+        sweep = iter_batch_clustering(df, mpts_values[0], mpts_values[-1], 1, metric=params['metric'],
+                                      algorithm=params['algorithm'], projection_method=params['projection_method'],
+                                      hierarchy=params['hierarchy'], mpts_values=mpts_values)
+        try:
+            for mpts, result, error in sweep:
+                if error is not None:
+                    failed[str(mpts)] = error
+                else:
+                    np.savez(os.path.join(path, 'results', f'{mpts}.npz'),
+                             labels=result['labels'], probabilities=result['probabilities'],
+                             linkage_z=result['linkage_z'], n_clusters=result['n_clusters'],
+                             noise_points=result['noise_points'])
+                    completed.append(mpts)
+                _update_progress(path, completed=sorted(completed), failed=failed)
+
+                if os.path.exists(os.path.join(path, 'cancel')):
+                    _update_progress(path, status='cancelled')
+                    return
+        finally:
+            sweep.close()
+
+        analysis = analyze_batch_results(load_job_results(job_id), hai_method=params['hai_method'])
+        write_json(os.path.join(path, 'analysis.json'), analysis)
+        _update_progress(path, status='done')
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        _update_progress(path, status='failed', error=str(e))
+    finally:
+        _owned_jobs.discard(job_id)
+
+
+def job_status(job_id):
+    """
+    Returns the progress.json of a job: status, all mpts, completed mpts, failures.
+    A queued or running job whose heartbeat went stale is marked failed first.
+    """
+    path = _job_dir(job_id)
+    progress = read_json(os.path.join(path, 'progress.json'))
+    if job_id not in _owned_jobs and _heartbeat_stale(progress):
+        with _progress_lock(path):
+            # The owner may have beaten (or finished) since the unlocked read
+            progress = read_json(os.path.join(path, 'progress.json'))
+            if _heartbeat_stale(progress):
+                progress.update(status='failed', updated=time.time(),
+                                error=f"The process running this job (pid {progress.get('pid')}) stopped.")
+                write_json(os.path.join(path, 'progress.json'), progress)
+    return progress
+
+
+def load_job_results(job_id, exclude=()):
+    """
+    Loads the finished hierarchies of a job as lean batch results (the format of
+    run_batch_clustering), in mpts order, skipping the keys listed in exclude.
+    """
+    path = _job_dir(job_id)
+    progress = job_status(job_id)
+
+    results = {}
+    for mpts in sorted(progress['completed']):
+        if str(mpts) in exclude:
+            continue
+        with np.load(os.path.join(path, 'results', f'{mpts}.npz')) as stored:
+            results[str(mpts)] = {
+                'labels': stored['labels'],
+                'probabilities': stored['probabilities'],
+                'linkage_z': stored['linkage_z'],
+                'n_clusters': int(stored['n_clusters']),
+                'noise_points': int(stored['noise_points'])
+            }
+    return results
+
+
+def load_job(job_id):
+    """
+    Returns (df, params, analysis) of a job; analysis is None until the job is done.
+    Raises ValueError if the job's dataset has been evicted from the registry.
+    """
+    path = _job_dir(job_id)
+    params = read_json(os.path.join(path, 'params.json'))
+    df = load_dataset(params['dataset_id'])
+    analysis_path = os.path.join(path, 'analysis.json')
+    analysis = read_json(analysis_path) if os.path.exists(analysis_path) else None
+    return df, params, analysis
+
+
+def cancel_job(job_id):
+    """
+    Asks a job to stop. A running job stops after its next finished mpts;
+    hierarchies finished so far stay available.
+    """
+    path = _job_dir(job_id)
+    with open(os.path.join(path, 'cancel'), 'w'):
+        pass
+    return job_status(job_id)
+
+
+def follow_job(job_id, poll_interval=JOB_FOLLOW_INTERVAL, max_seconds=None):
+    """
+    Follows a job until it ends: yields (progress, new_results) every time hierarchies
+    have finished since the last yield (lean results, see load_job_results), and a
+    last time once the job is done, cancelled or failed. Stops early, without a
+    final state, after max_seconds.
+    """
+    deadline = None if max_seconds is None else time.time() + max_seconds
+    sent = set()
+    while True:
+        progress = job_status(job_id)
+        finished = progress['status'] in ('done', 'cancelled', 'failed')
+        new_keys = {str(mpts) for mpts in progress['completed']} - sent
+        if new_keys or finished:
+            new_results = load_job_results(job_id, exclude=sent)
+            sent.update(new_results)
+            yield progress, new_results
+        if finished or (deadline is not None and time.time() >= deadline):
+            return
+        time.sleep(poll_interval)
@@ -0,0 +1,373 @@
+import numpy as np
+from scipy.spatial.distance import cdist
+
+
+# sklearn metric names that scipy's cdist spells differently
+SCIPY_METRICS = {
+    'manhattan': 'cityblock',
+    'l1': 'cityblock',
+    'l2': 'euclidean',
+}
+
+
+def mutual_reachability_mst(data, core_dist, metric='euclidean'):
+    """
+    Builds the minimum spanning tree of the mutual reachability graph with Prim's
+    algorithm over implicit distances: each step only computes the distances from
+    the newest tree vertex to the points still outside the tree, so memory is O(n)
+    instead of the n x n matrix built by compute_mutual_reachability.
+    Returns an (n-1, 3) array of edges: [point_a, point_b, mutual_reachability].
+    """
+    data = np.ascontiguousarray(data, dtype=np.float64)
+    core_dist = np.asarray(core_dist, dtype=np.float64)
+    n_samples = data.shape[0]
+    scipy_metric = SCIPY_METRICS.get(metric, metric)
+
+    mst = np.zeros((max(n_samples - 1, 0), 3))
+
+    # Points still outside the tree are kept packed at the front of these arrays;
+    # a point joining the tree is swapped with the last one so every step only
+    # touches the points that are left.
+    outside = np.arange(1, n_samples)
+    outside_data = data[1:].copy()
+    outside_core = core_dist[1:].copy()
+    best_dist = np.full(n_samples - 1, np.inf)
+    best_from = np.zeros(n_samples - 1, dtype=np.intp)
+
+    current = 0
+    for i in range(n_samples - 1):
+        m = n_samples - 1 - i
+
+        # MR from the newest tree vertex to every outside point
+        dist = cdist(data[current:current + 1], outside_data[:m], metric=scipy_metric)[0]
+        np.maximum(dist, outside_core[:m], out=dist)
+        np.maximum(dist, core_dist[current], out=dist)
+
+        closer = dist < best_dist[:m]
+        best_dist[:m][closer] = dist[closer]
+        best_from[:m][closer] = current
+
+        k = int(np.argmin(best_dist[:m]))
+        new_point = outside[k]
+        mst[i] = (best_from[k], new_point, best_dist[k])
+
+        last = m - 1
+        outside[k] = outside[last]
+        outside_data[k] = outside_data[last]
+        outside_core[k] = outside_core[last]
+        best_dist[k] = best_dist[last]
+        best_from[k] = best_from[last]
+
+        current = new_point
+
+    return mst
+
+
+def condensed_mst(condensed, n_samples, data=None, core_dist=None, metric='euclidean'):
+    """
+    Prim's algorithm over a condensed distance vector (scipy pdist layout), e.g.
+    the output of compute_mutual_reachability_condensed. Each step gathers one row
+    of the implied square matrix, so no n x n array and no float64 copy of a
+    float32 input is ever made.
+    A float32 vector rounds distances, which adds and removes ties. Given the data
+    and core distances it was built from, the vector only preselects candidates:
+    rounding is monotone, so a pair can only be closer in float64 if it is not
+    farther in float32. The candidates' MR distances are recomputed in float64, and
+    the tree and its weights are exactly those of mutual_reachability_mst.
+    Returns an (n-1, 3) array of edges like mutual_reachability_mst.
+    """
+    condensed = np.asarray(condensed)
+    mst = np.zeros((max(n_samples - 1, 0), 3))
+
+    exact = data is not None
+    if exact:
+        data = np.ascontiguousarray(data, dtype=np.float64)
+        core_dist = np.asarray(core_dist, dtype=np.float64)
+        scipy_metric = SCIPY_METRICS.get(metric, metric)
+        best_exact = np.full(n_samples, np.inf)
+
+    best_dist = np.full(n_samples, np.inf)
+    best_from = np.zeros(n_samples, dtype=np.intp)
+    in_tree = np.zeros(n_samples, dtype=bool)
+    in_tree[0] = True
+    best_dist[0] = np.nan
+
+    current = 0
+    for i in range(n_samples - 1):
+        # Row `current`: pairs (j, current) for j < current, then (current, j) for j > current
+        before = np.arange(current)
+        row = np.empty(n_samples)
+        row[:current] = condensed[before * n_samples - before * (before + 1) // 2 + (current - before - 1)]
+        row[current] = np.inf
+        start = current * n_samples - current * (current + 1) // 2
+        row[current + 1:] = condensed[start:start + n_samples - current - 1]
+
+        if exact:
+            candidates = np.flatnonzero((row <= best_dist) & ~in_tree)
+            dist = cdist(data[current:current + 1], data[candidates], metric=scipy_metric)[0]
+            np.maximum(dist, core_dist[candidates], out=dist)
+            np.maximum(dist, core_dist[current], out=dist)
+
+            closer = dist < best_exact[candidates]
+            updated = candidates[closer]
+            best_exact[updated] = dist[closer]
+            best_dist[updated] = row[updated]
+            best_from[updated] = current
+
+            # The float64 minimum holds the smallest rounded value
+            tied = np.flatnonzero(best_dist == np.nanmin(best_dist))
+            k = int(tied[np.argmin(best_exact[tied])])
+            weight = best_exact[k]
+        else:
+            closer = (row < best_dist) & ~in_tree
+            best_dist[closer] = row[closer]
+            best_from[closer] = current
+
+            # Tree vertices hold NaN so nanargmin skips them
+            k = int(np.nanargmin(best_dist))
+            weight = best_dist[k]
+
+        mst[i] = (best_from[k], k, weight)
+
+        in_tree[k] = True
+        best_dist[k] = np.nan
+        current = k
+
+    return mst
+
+
+def mst_to_linkage(mst, n_samples):
+    """
+    Turns MST edges into a scipy linkage matrix Z by merging them in order of weight
+    (Kruskal over the tree edges, tracked with a union-find).
+    Z structure: [idx1, idx2, distance, sample_count], same as scipy linkage(method='single').
+    Mutual reachability produces many equal weights, and which MST a backend finds
+    and in which order it lists tied edges differ between backends, while the
+    condensed tree (and so the labels) depends on the order of equal-height merges.
+    Tied merges are therefore made canonical: the clusters joined at one height are
+    merged largest first (then by smallest point index), so every backend yields the
+    same Z. Largest first means the clusters below any min_cluster_size are the
+    first to fall off when the tree is condensed, and the larger ones split as siblings.
+    """
+    mst = np.asarray(mst, dtype=np.float64)
+    order = np.argsort(mst[:, 2], kind='stable')
+    weights = mst[order, 2]
+
+    Z = np.zeros((n_samples - 1, 4))
+
+    # parent[] over points and clusters; cluster ids follow scipy: n + merge index
+    parent = np.arange(2 * n_samples - 1)
+    size = np.ones(2 * n_samples - 1, dtype=np.int64)
+    # Smallest point index of every cluster, the tie-break among equal sizes
+    first_point = np.arange(2 * n_samples - 1)
+
+    def find(x):
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        # Path compression
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    n_merged = 0
+
+    def merge(a, b, weight):
+        nonlocal n_merged
+        new_cluster = n_samples + n_merged
+        parent[a] = new_cluster
+        parent[b] = new_cluster
+        size[new_cluster] = size[a] + size[b]
+        first_point[new_cluster] = min(first_point[a], first_point[b])
+        Z[n_merged] = (min(a, b), max(a, b), weight, size[new_cluster])
+        n_merged += 1
+        return new_cluster
+
+    i = 0
+    n_edges = len(order)
+    while i < n_edges:
+        # Edges [i, j) share one weight
+        j = i + 1
+        while j < n_edges and weights[j] == weights[i]:
+            j += 1
+
+        if j == i + 1:
+            edge = mst[order[i]]
+            merge(find(int(edge[0])), find(int(edge[1])), weights[i])
+        else:
+            # Group the clusters the tied edges connect, then fold every group
+            group_of = {}
+
+            def group_find(x):
+                while group_of.setdefault(x, x) != x:
+                    x = group_of[x]
+                return x
+
+            for edge in mst[order[i:j]]:
+                a = group_find(find(int(edge[0])))
+                b = group_find(find(int(edge[1])))
+                group_of[max(a, b)] = min(a, b)
+
+            groups = {}
+            for cluster in group_of:
+                groups.setdefault(group_find(cluster), []).append(cluster)
+
+            def canonical(cluster):
+                return -size[cluster], first_point[cluster]
+
+            for group in sorted((sorted(group, key=canonical) for group in groups.values()),
+                                key=lambda group: min(first_point[cluster] for cluster in group)):
+                current = group[0]
+                for cluster in group[1:]:
+                    current = merge(current, cluster, weights[i])
+        i = j
+
+    return Z
+
+
+def canonical_linkage(Z):
+    """
+    Re-derives a single linkage matrix Z from any source (scipy linkage, sklearn's
+    single linkage tree) with the canonical order of tied merges of mst_to_linkage.
+    Every merge becomes an edge between one point of each side.
+    """
+    Z = np.asarray(Z, dtype=np.float64)
+    n_samples = len(Z) + 1
+    first_point = np.arange(2 * n_samples - 1)
+    edges = np.empty((len(Z), 3))
+    for i, (a, b, height, _) in enumerate(Z):
+        a, b = first_point[int(a)], first_point[int(b)]
+        first_point[n_samples + i] = min(a, b)
+        edges[i] = (a, b, height)
+    return mst_to_linkage(edges, n_samples)
+
+
+def linkage_to_labels(Z, min_cluster_size, cluster_selection_method='eom', allow_single_cluster=False):
+    """
+    Extracts HDBSCAN flat clusters (labels and membership probabilities) from a
+    single linkage matrix, i.e. the condensed tree + stability selection that
+    sklearn's HDBSCAN runs on its own single linkage tree.
+    """
+    # sklearn does not expose this step publicly; the helper below is the one its
+    # HDBSCAN.fit calls. Private and unversioned, hence the exact scikit-learn pin in
+    # requirements.txt; test_mst_engine.py checks its import and positional signature.
+    try:
+        from sklearn.cluster._hdbscan._tree import tree_to_labels, HIERARCHY_dtype
+    except ImportError as e:
+        raise ImportError("Flat clustering needs scikit-learn's private HDBSCAN tree helpers "
+                          "(sklearn.cluster._hdbscan._tree); install the scikit-learn version "
+                          "pinned in requirements.txt.") from e
+
+    Z = np.asarray(Z)
+    hierarchy = np.empty(len(Z), dtype=HIERARCHY_dtype)
+    hierarchy['left_node'] = Z[:, 0]
+    hierarchy['right_node'] = Z[:, 1]
+    hierarchy['value'] = Z[:, 2]
+    hierarchy['cluster_size'] = Z[:, 3]
+
+    labels, probabilities = tree_to_labels(
+        hierarchy,
+        int(min_cluster_size),
+        cluster_selection_method,
+        allow_single_cluster,
+        0.0,
+        None
+    )
+    return labels, probabilities
+
+
+# Neighbors fetched per query in the Borůvka rounds; doubled for the points whose
+# cheapest edge is not certified yet
+BORUVKA_QUERY_NEIGHBORS = 8
+
+
+def boruvka_mutual_reachability_mst(data, core_dist, metric='euclidean', knn_distances=None, knn_indices=None):
+    """
+    Exact MR minimum spanning tree from nearest neighbor queries instead of all
+    n^2 distances (near-linear for low-dimensional data). Borůvka rounds: every
+    component adds its cheapest edge to another component. Candidates come from
+    the kNN lists (knn_distances / knn_indices of a kneighbors query, optional)
+    and from queries against the components on the other side of each bit of the
+    component ids, so every pair of components is searched. A point's search stops
+    once its k-th neighbor is at least as far as the best edge its component has:
+    farther points can't be closer in mutual reachability either.
+    Returns an (n-1, 3) array of edges like mutual_reachability_mst.
+    """
+    from sklearn.neighbors import NearestNeighbors
+
+    data = np.ascontiguousarray(data, dtype=np.float64)
+    core_dist = np.asarray(core_dist, dtype=np.float64)
+    n_samples = data.shape[0]
+
+    parent = np.arange(n_samples)
+    edges = []
+
+    def find(x):
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    n_components = n_samples
+    while n_components > 1:
+        # Component id (0..n_components-1) of every point
+        roots = parent.copy()
+        while True:
+            jumped = roots[roots]
+            if np.array_equal(jumped, roots):
+                break
+            roots = jumped
+        _, labels = np.unique(roots, return_inverse=True)
+
+        best_weight = np.full(n_samples, np.inf)
+        best_to = np.full(n_samples, -1, dtype=np.intp)
+        component_best = np.full(n_components, np.inf)
+
+        def offer(points, neighbors, distances):
+            # Candidate edges points[r] -> neighbors[r, c]; same-component pairs are skipped
+            weights = np.maximum(distances, np.maximum(core_dist[points][:, np.newaxis], core_dist[neighbors]))
+            weights[labels[neighbors] == labels[points][:, np.newaxis]] = np.inf
+            column = np.argmin(weights, axis=1)
+            weight = weights[np.arange(len(points)), column]
+            better = weight < best_weight[points]
+            best_weight[points[better]] = weight[better]
+            best_to[points[better]] = neighbors[better, column[better]]
+            np.minimum.at(component_best, labels[points], weight)
+
+        pending = np.arange(n_samples)
+        if knn_indices is not None:
+            offer(pending, np.asarray(knn_indices), np.asarray(knn_distances))
+            pending = pending[np.asarray(knn_distances)[:, -1] < component_best[labels]]
+
+        for bit in range(int(np.ceil(np.log2(n_components)))):
+            side_of = (labels >> bit) & 1
+            for side in (0, 1):
+                queries = pending[side_of[pending] == side]
+                targets = np.flatnonzero(side_of != side)
+                if len(queries) == 0 or len(targets) == 0:
+                    continue
+
+                index = NearestNeighbors(metric=metric).fit(data[targets])
+                k = min(BORUVKA_QUERY_NEIGHBORS, len(targets))
+                while len(queries) > 0:
+                    distances, idx = index.kneighbors(data[queries], n_neighbors=k)
+                    offer(queries, targets[idx], distances)
+                    if k == len(targets):
+                        break
+                    queries = queries[distances[:, -1] < component_best[labels[queries]]]
+                    k = min(2 * k, len(targets))
+
+        # Cheapest edge of every component, merged in order of weight
+        order = np.lexsort((best_weight, labels))
+        first = order[np.r_[True, labels[order][1:] != labels[order][:-1]]]
+        for point in first[np.argsort(best_weight[first], kind='stable')]:
+            a = find(int(point))
+            b = find(int(best_to[point]))
+            if a != b:
+                parent[a] = b
+                edges.append((point, best_to[point], best_weight[point]))
+                n_components -= 1
+
+    return np.array(edges, dtype=np.float64).reshape(-1, 3)
@@ -0,0 +1,154 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+# Projections only depend on the data, never on the clustering parameters,
+# so they are cached per dataset content + projection parameters.
+# Small in-process LRU: each entry is just an (n, 2) array.
+PROJECTION_CACHE_SIZE = 16
+_projection_cache = OrderedDict()
+_projection_cache_lock = threading.Lock()
+
+
+def dataset_fingerprint(data):
+    """
+    Content hash of a numeric data matrix (values, shape and dtype).
+    """
+    data = np.ascontiguousarray(data)
+    digest = hashlib.sha1()
+    digest.update(str(data.shape).encode())
+    digest.update(str(data.dtype).encode())
+    digest.update(data.tobytes())
+    return digest.hexdigest()
+
+
+# Size thresholds for method='auto': exact t-SNE while it stays interactive,
+# landmark t-SNE for medium data, randomized SVD (linear time) beyond that.
+TSNE_MAX_SAMPLES = 3000
+LANDMARK_MAX_SAMPLES = 200000
+LANDMARK_SAMPLES = 1500
+LANDMARK_NEIGHBORS = 3
+
+PROJECTION_METHODS = ('auto', 'tsne', 'landmark-tsne', 'pca', 'svd')
+
+PROJECTION_TITLES = {
+    'tsne': 't-SNE',
+    'landmark-tsne': 'Landmark t-SNE',
+    'pca': 'PCA',
+    'svd': 'Randomized SVD',
+}
+
+
+def resolve_projection_method(n_samples, method='auto'):
+    """
+    Maps 'auto' to a concrete projection method based on the dataset size.
+    """
+    if method not in PROJECTION_METHODS:
+        raise ValueError(f"Unknown projection method '{method}'. Choose one of {PROJECTION_METHODS}.")
+
+    if method != 'auto':
+        return method
+    if n_samples <= TSNE_MAX_SAMPLES:
+        return 'tsne'
+    if n_samples <= LANDMARK_MAX_SAMPLES:
+        return 'landmark-tsne'
+    return 'svd'
+
+
+def tsne_projection(data, random_state=42):
+    """
+    Projects the data to 2D with t-SNE.
+    """
+    from sklearn.manifold import TSNE
+
+    # Perplexity should be considerably less than number of samples to prevent hanging on small data.
+    n_samples = data.shape[0]
+    perplexity = min(30, max(1, n_samples // 3))
+
+    # Use exact method for tiny datasets to prevent barnes_hut bugs
+    method = 'exact' if n_samples < 50 else 'barnes_hut'
+
+    tsne = TSNE(n_components=2, perplexity=perplexity, random_state=random_state, method=method, init='pca')
+    return tsne.fit_transform(data)
+
+
+def landmark_tsne_projection(data, random_state=42, n_landmarks=LANDMARK_SAMPLES):
+    """
+    Runs t-SNE on a random landmark subsample only, then places every other point
+    at the inverse-distance weighted mean of its nearest landmarks' positions.
+    Cost is one small t-SNE plus one kNN query, whatever the dataset size.
+    """
+    from sklearn.neighbors import NearestNeighbors
+
+    n_samples = data.shape[0]
+    if n_samples <= n_landmarks:
+        return tsne_projection(data, random_state=random_state)
+
+    rng = np.random.default_rng(random_state)
+    landmarks = np.sort(rng.choice(n_samples, size=n_landmarks, replace=False))
+    landmark_embedding = tsne_projection(data[landmarks], random_state=random_state)
+
+    nbrs = NearestNeighbors(n_neighbors=LANDMARK_NEIGHBORS).fit(data[landmarks])
+    dist, idx = nbrs.kneighbors(data)
+
+    # Points sitting on a landmark take its position exactly
+    weights = 1.0 / np.maximum(dist, 1e-12)
+    weights /= weights.sum(axis=1, keepdims=True)
+    projection = np.einsum('ij,ijk->ik', weights, landmark_embedding[idx])
+
+    projection[landmarks] = landmark_embedding
+    return projection
+
+
+def compute_projection(data, method='auto', random_state=42):
+    """
+    Projects the data to 2D with the selected method (see PROJECTION_METHODS).
+    """
+    method = resolve_projection_method(data.shape[0], method)
+
+    if method == 'tsne':
+        return tsne_projection(data, random_state=random_state)
+    if method == 'landmark-tsne':
+        return landmark_tsne_projection(data, random_state=random_state)
+
+    from sklearn.decomposition import PCA
+
+    n_components = min(2, data.shape[1])
+    if method == 'pca':
+        pca = PCA(n_components=n_components, svd_solver='full')
+    else:
+        pca = PCA(n_components=n_components, svd_solver='randomized', random_state=random_state)
+    projection = pca.fit_transform(data)
+
+    # Single-feature data: keep the map 2D with a flat second axis
+    if projection.shape[1] < 2:
+        projection = np.column_stack([projection, np.zeros(len(projection))])
+    return projection
+
+
+def get_projection(data, method='auto', random_state=42):
+    """
+    Returns the 2D projection of data, computing it only the first time a given
+    dataset/parameter combination is seen. The array is shared by every caller
+    and read-only; copy it before modifying it.
+    """
+    method = resolve_projection_method(data.shape[0], method)
+    key = (dataset_fingerprint(data), method, random_state)
+
+    with _projection_cache_lock:
+        if key in _projection_cache:
+            _projection_cache.move_to_end(key)
+            return _projection_cache[key]
+
+    projection = compute_projection(data, method=method, random_state=random_state)
+    projection.flags.writeable = False
+
+    with _projection_cache_lock:
+        _projection_cache[key] = projection
+        while len(_projection_cache) > PROJECTION_CACHE_SIZE:
+            _projection_cache.popitem(last=False)
+
+    return projection
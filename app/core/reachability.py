@@ -0,0 +1,53 @@
+import numpy as np
+from scipy.cluster.hierarchy import leaves_list
+
+
+def linkage_leaf_order(Z):
+    """
+    Walks a linkage matrix Z from the root down and returns:
+    - order: the dendrogram leaf order (same as scipy leaves_list)
+    - gap_merge: for every gap between consecutive leaves order[k], order[k+1],
+      the row of Z where the two leaves first meet (their lowest common ancestor).
+    Every subtree is a contiguous block of the leaf order, so the gap between the
+    left and right child of a merge is the only gap that merge is responsible for.
+    """
+    Z = np.asarray(Z)
+    n_samples = len(Z) + 1
+
+    order = leaves_list(Z)
+    gap_merge = np.zeros(n_samples - 1, dtype=np.intp)
+
+    # start[node] = position of the first leaf of node's subtree in the leaf order
+    start = np.zeros(2 * n_samples - 1, dtype=np.intp)
+
+    for i in range(n_samples - 2, -1, -1):
+        left = int(Z[i, 0])
+        right = int(Z[i, 1])
+        left_size = 1 if left < n_samples else int(Z[left - n_samples, 3])
+
+        first = start[n_samples + i]
+        start[left] = first
+        start[right] = first + left_size
+        gap_merge[first + left_size - 1] = i
+
+    return order, gap_merge
+
+
+def reachability_from_linkage(Z):
+    """
+    Builds a reachability plot (OPTICS-style ordering + reachability distances)
+    from a single linkage hierarchy instead of running OPTICS.
+    Points follow the dendrogram leaf order and each point's reachability is the
+    height at which it joins the points before it, i.e. the merge height of the
+    gap to its predecessor. On an MR single linkage tree the clusters show up as
+    the same valleys an OPTICS plot with the same min_samples would draw.
+    The first point has no predecessor and gets np.inf, as in OPTICS.
+    """
+    Z = np.asarray(Z)
+    order, gap_merge = linkage_leaf_order(Z)
+
+    reachability = np.empty(len(order))
+    reachability[0] = np.inf
+    reachability[1:] = Z[gap_merge, 2]
+
+    return order, reachability
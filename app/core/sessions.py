@@ -0,0 +1,273 @@
+import fcntl
+import os
+import shutil
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+
+from .datasets import load_dataset
+from .storage import WORKSPACE, write_json, read_json, evict_least_recently_used
+
+
+# Per-user state between requests (hierarchies for dendrogram zooms, the batch
+# behind /cut_dendrogram, /batch/figures and /batch/extend), stored on disk so any
+# web worker can serve any session. Layout of SESSIONS_ROOT/<session id>/:
+#   state.json      which version directory holds the single run and the batch
+#   lock            flock'ed while state.json is switched (exclusive) or read (shared)
+#   single-<v>/     linkage_z.npy, info.json (parameters) and optional true_labels.npy
+#                   of the latest single run
+#   batch-<v>/      hai_matrix.npy, hai_error.npy, meta_linkage.npy, info.json
+#                   (parameters and the dataset id, see app/core/datasets.py),
+#                   results/<key>_{labels,probabilities,linkage_z}.npy and the
+#                   meta-dendrogram cut index cut_{heights,labels,medoids,mpts}.npy
+# Arrays are plain .npy files loaded memory-mapped. A save writes a new version
+# directory and then switches state.json over, so readers never see a partial write;
+# the lock keeps concurrent saves from orphaning versions and keeps a version from
+# being removed while a reader is opening its files.
+SESSIONS_ROOT = os.path.join(WORKSPACE, 'sessions')
+
+# Size cap of the whole store; least recently used sessions are evicted beyond it
+SESSION_STORE_MAX_BYTES = int(os.environ.get('MUSTACHE_SESSION_STORE_MB', 2048)) * 1024 * 1024
+
+RESULT_ARRAYS = ('labels', 'probabilities', 'linkage_z')
+
+CUT_INDEX_ARRAYS = ('heights', 'labels', 'medoids', 'mpts')
+
+
+def new_session_id():
+    return uuid.uuid4().hex
+
+
+def _session_dir(session_id):
+    # Ids come from new_session_id (through a signed cookie); reject anything else
+    if not session_id or not all(c in '0123456789abcdef' for c in session_id):
+        raise ValueError(f"Invalid session id '{session_id}'.")
+    return os.path.join(SESSIONS_ROOT, session_id)
+
+
+def _read_state(path):
+    try:
+        return read_json(os.path.join(path, 'state.json'))
+    except (OSError, ValueError):
+        return {'single': None, 'batch': None}
+
+
+@contextmanager
+def _session_lock(path, shared=False):
+    # flock on the session's lock file, across threads and web worker processes.
+    # A session that doesn't exist (yet, or any more) has nothing to lock.
+    try:
+        lock_file = open(os.path.join(path, 'lock'), 'a')
+    except FileNotFoundError:
+        yield
+        return
+    with lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _switch_version(session_id, part, write):
+    # Writes a new version of one part of the session with write(directory),
+    # points state.json at it and removes the version it replaces.
+    path = _session_dir(session_id)
+    version = f'{part}-{uuid.uuid4().hex[:12]}'
+    version_dir = os.path.join(path, version)
+    os.makedirs(version_dir)
+    try:
+        write(version_dir)
+    except Exception:
+        shutil.rmtree(version_dir, ignore_errors=True)
+        raise
+
+    with _session_lock(path):
+        state = _read_state(path)
+        previous = state.get(part)
+        state[part] = version
+        write_json(os.path.join(path, 'state.json'), state)
+        if previous:
+            shutil.rmtree(os.path.join(path, previous), ignore_errors=True)
+
+    evict_sessions(keep=session_id)
+
+
+def _version_dir(session_id, part):
+    path = _session_dir(session_id)
+    version = _read_state(path).get(part)
+    if not version or not os.path.isdir(os.path.join(path, version)):
+        return None
+    # Reading a session counts as using it for the LRU eviction
+    os.utime(os.path.join(path, 'state.json'))
+    return os.path.join(path, version)
+
+
+def save_single_run(session_id, Z, params, true_labels=None):
+    """
+    Stores the hierarchy of a single run (dendrogram source 'single') with its
+    parameters and the ground truth labels, if any, for re-extraction in a tuning session.
+    """
+    def write(version_dir):
+        np.save(os.path.join(version_dir, 'linkage_z.npy'), np.asarray(Z, dtype=np.float64))
+        if true_labels is not None:
+            labels = np.asarray(true_labels)
+            # Object arrays (e.g. string labels from pandas) are stored as text, not pickled
+            np.save(os.path.join(version_dir, 'true_labels.npy'), labels.astype(str) if labels.dtype == object else labels)
+        write_json(os.path.join(version_dir, 'info.json'), {'params': params})
+
+    _switch_version(session_id, 'single', write)
+
+
+def load_single_run(session_id):
+    """
+    Returns the latest single run of a session, or None: {'linkage_z', 'params',
+    'true_labels'} with the arrays memory-mapped (true_labels None if not given).
+    """
+    with _session_lock(_session_dir(session_id), shared=True):
+        version_dir = _version_dir(session_id, 'single')
+        if version_dir is None or not os.path.exists(os.path.join(version_dir, 'info.json')):
+            return None
+
+        true_labels_path = os.path.join(version_dir, 'true_labels.npy')
+        return {
+            'linkage_z': np.load(os.path.join(version_dir, 'linkage_z.npy'), mmap_mode='r'),
+            'params': read_json(os.path.join(version_dir, 'info.json'))['params'],
+            'true_labels': np.load(true_labels_path, mmap_mode='r') if os.path.exists(true_labels_path) else None
+        }
+
+
+def save_batch(session_id, dataset_id, results, analysis, params, cut_index=None):
+    """
+    Stores a batch: the id of its registered dataset, the lean results of every
+    mpts, the HAI matrix (with its error for sampled HAI), the meta-linkage and the
+    parameters, plus the (heights, cut_labels, cut_medoids) of hai.build_cut_index
+    if given. Replaces the previous batch of the session.
+    """
+    def write(version_dir):
+        if cut_index is not None:
+            heights, cut_labels, cut_medoids = cut_index
+            # mpts values, or grid keys (text) for a 2-D sweep
+            arrays = (heights, cut_labels, cut_medoids, np.asarray(analysis['ordered_mpts']))
+            for name, values in zip(CUT_INDEX_ARRAYS, arrays):
+                np.save(os.path.join(version_dir, f'cut_{name}.npy'), values)
+
+        np.save(os.path.join(version_dir, 'hai_matrix.npy'), np.asarray(analysis['hai_matrix'], dtype=np.float64))
+        if analysis.get('hai_error') is not None:
+            np.save(os.path.join(version_dir, 'hai_error.npy'), np.asarray(analysis['hai_error'], dtype=np.float64))
+        np.save(os.path.join(version_dir, 'meta_linkage.npy'), np.asarray(analysis['meta_linkage'], dtype=np.float64))
+
+        os.makedirs(os.path.join(version_dir, 'results'))
+        counts = {}
+        saved = {}
+        for key, result in results.items():
+            for name in RESULT_ARRAYS:
+                path = os.path.join(version_dir, 'results', f'{key}_{name}.npy')
+                # Cells of a 2-D grid share the hierarchy of their min_samples: written once, then hard-linked
+                if id(result[name]) in saved:
+                    try:
+                        os.link(saved[id(result[name])], path)
+                        continue
+                    except OSError:
+                        pass
+                np.save(path, np.asarray(result[name]))
+                saved[id(result[name])] = path
+            counts[key] = {'n_clusters': int(result['n_clusters']), 'noise_points': int(result['noise_points'])}
+
+        write_json(os.path.join(version_dir, 'info.json'), {
+            'dataset_id': dataset_id,
+            'params': params,
+            'hai_method': analysis.get('hai_method'),
+            'ordered_mpts': [mpts if isinstance(mpts, str) else int(mpts) for mpts in analysis['ordered_mpts']],
+            'counts': counts
+        })
+
+    _switch_version(session_id, 'batch', write)
+
+
+def load_batch(session_id, with_results=True):
+    """
+    Returns the batch of a session, or None: {'df', 'dataset_id', 'results',
+    'params', 'projection_method', 'meta_linkage', 'analysis': {hai_matrix,
+    hai_error, hai_method, ordered_mpts}} with every array memory-mapped, the data
+    included. with_results=False skips the per-mpts results (e.g. for a dendrogram
+    cut). A batch whose dataset has been evicted from the registry is gone too.
+    """
+    with _session_lock(_session_dir(session_id), shared=True):
+        version_dir = _version_dir(session_id, 'batch')
+        if version_dir is None:
+            return None
+
+        def load(name):
+            return np.load(os.path.join(version_dir, name), mmap_mode='r')
+
+        info = read_json(os.path.join(version_dir, 'info.json'))
+        try:
+            df = load_dataset(info['dataset_id'])
+        except ValueError:
+            return None
+        hai_error_path = os.path.join(version_dir, 'hai_error.npy')
+
+        results = {}
+        if with_results:
+            for key, counts in info['counts'].items():
+                results[key] = {name: load(os.path.join('results', f'{key}_{name}.npy')) for name in RESULT_ARRAYS}
+                results[key].update(counts)
+
+        return {
+            'df': df,
+            'dataset_id': info['dataset_id'],
+            'results': results,
+            'params': info['params'],
+            'projection_method': info['params']['projection_method'],
+            'meta_linkage': load('meta_linkage.npy'),
+            'analysis': {
+                'hai_matrix': load('hai_matrix.npy'),
+                'hai_error': load('hai_error.npy') if os.path.exists(hai_error_path) else None,
+                'hai_method': info['hai_method'],
+                'ordered_mpts': info['ordered_mpts']
+            }
+        }
+
+
+def load_cut_index(session_id):
+    """
+    Returns the memory-mapped cut index of the session's batch as (heights,
+    cut_labels, cut_medoids, ordered_mpts), or None.
+    """
+    with _session_lock(_session_dir(session_id), shared=True):
+        version_dir = _version_dir(session_id, 'batch')
+        if version_dir is None or not os.path.exists(os.path.join(version_dir, 'cut_heights.npy')):
+            return None
+        return tuple(np.load(os.path.join(version_dir, f'cut_{name}.npy'), mmap_mode='r') for name in CUT_INDEX_ARRAYS)
+
+
+def load_linkage(session_id, source):
+    """
+    Returns a stored hierarchy (memory-mapped): 'single' for the latest single run,
+    a result key (str(mpts) or a grid key) for a hierarchy of the batch. None if
+    the session has no such source.
+    """
+    with _session_lock(_session_dir(session_id), shared=True):
+        if source == 'single':
+            version_dir = _version_dir(session_id, 'single')
+            path = os.path.join(version_dir, 'linkage_z.npy') if version_dir else None
+        else:
+            version_dir = _version_dir(session_id, 'batch')
+            # Keys are mpts values or <min_samples>x<min_cluster_size>; anything else can't name a stored file
+            valid_key = all(part.isdigit() for part in source.split('x'))
+            path = os.path.join(version_dir, 'results', f'{source}_linkage_z.npy') if version_dir and valid_key else None
+
+        if path is None or not os.path.exists(path):
+            return None
+        return np.load(path, mmap_mode='r')
+
+
+def evict_sessions(max_bytes=None, keep=None):
+    """
+    Removes least recently used sessions (by last save or load) until the store
+    fits in max_bytes (default SESSION_STORE_MAX_BYTES). The session keep is never removed.
+    """
+    max_bytes = SESSION_STORE_MAX_BYTES if max_bytes is None else max_bytes
+    evict_least_recently_used(SESSIONS_ROOT, max_bytes, 'state.json', keep=keep)
@@ -0,0 +1,78 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+
+
+# Root of everything the app keeps on disk (background jobs, sessions). Shared by
+# every web worker process; mount it as a volume to keep it across restarts.
+WORKSPACE = os.environ.get('MUSTACHE_WORKSPACE') or os.path.join(tempfile.gettempdir(), 'mustache-workspace')
+
+# Web worker processes sharing the machine (Gunicorn reads the same variable for
+# its default -w). Process pools size their default worker count from the cores
+# left per web worker, so concurrent batches don't oversubscribe the CPU.
+WEB_WORKERS = int(os.environ.get('WEB_CONCURRENCY', 0)) or 1
+CORES_PER_WEB_WORKER = max(1, (os.cpu_count() or 1) // WEB_WORKERS)
+
+
+def write_json(path, payload):
+    """
+    Writes a JSON file atomically: to a temporary file first, then renamed over
+    path, so readers in other processes never see a half-written file.
+    """
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(payload, f)
+    os.replace(tmp_path, path)
+
+
+def read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def directory_size(path):
+    """
+    Total size in bytes of the files below path.
+    """
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def evict_least_recently_used(root, max_bytes, marker, keep=None):
+    """
+    Removes entry directories of root, least recently used first, until their
+    total size fits in max_bytes. An entry's last use is the modification time of
+    its marker file (touched whenever it is read); keep is never removed.
+    """
+    if not os.path.isdir(root):
+        return
+
+    entries = []
+    for name in os.listdir(root):
+        # Dot entries are writes still in progress
+        if name.startswith('.'):
+            continue
+        path = os.path.join(root, name)
+        try:
+            last_used = os.path.getmtime(os.path.join(path, marker))
+        except OSError:
+            # Being created right now, or left over from a failed write
+            last_used = os.path.getmtime(path) if os.path.isdir(path) else time.time()
+        entries.append((last_used, name, directory_size(path)))
+
+    total = sum(size for _, _, size in entries)
+    for _, name, size in sorted(entries):
+        if total <= max_bytes:
+            break
+        if name == keep:
+            continue
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+        total -= size
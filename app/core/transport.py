@@ -0,0 +1,108 @@
+import base64
+import json
+
+import numpy as np
+
+
+# Response encodings for numeric result arrays:
+# - 'json': plain JSON lists (default, what every client understands)
+# - 'binary': base64 typed arrays narrowed to int8/16/32 or float32, decoded by main.js
+#   straight into JS typed arrays. Uses the same layout as plotly.js typed array
+#   specs: {'dtype': 'f4', 'bdata': '<base64>', 'shape': '<rows>,<cols>'}.
+ENCODINGS = ('json', 'binary')
+
+# Arrays shorter than this stay plain lists inside figures (e.g. the 4-point
+# line segments of a dendrogram): base64 only pays off on long arrays.
+BINARY_MIN_LENGTH = 64
+
+DTYPE_CODES = {
+    'int8': 'i1', 'uint8': 'u1',
+    'int16': 'i2', 'uint16': 'u2',
+    'int32': 'i4', 'uint32': 'u4',
+    'float32': 'f4', 'float64': 'f8',
+}
+
+
+def check_encoding(encoding):
+    """
+    Raises ValueError for an unknown response encoding.
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Unknown encoding '{encoding}'. Choose one of {ENCODINGS}.")
+
+
+def narrow_array(values):
+    """
+    Casts an array to the smallest dtype the client needs: the narrowest of
+    int8/int16/int32 holding every integer (labels usually fit in int8),
+    float32 for floating point values.
+    """
+    arr = np.asarray(values)
+    if arr.dtype.kind in 'iub':
+        low, high = (int(arr.min()), int(arr.max())) if arr.size else (0, 0)
+        for dtype in ('<i1', '<i2'):
+            info = np.iinfo(dtype)
+            if info.min <= low and high <= info.max:
+                return arr.astype(dtype)
+        return arr.astype('<i4')
+    return arr.astype('<f4')
+
+
+def encode_array(values, encoding='json'):
+    """
+    Encodes a numeric array for an API response: a (nested) list for 'json',
+    a base64 typed array spec for 'binary'.
+    """
+    arr = np.asarray(values)
+    if encoding == 'json':
+        return arr.tolist()
+
+    arr = np.ascontiguousarray(narrow_array(arr))
+    return {
+        'dtype': DTYPE_CODES[arr.dtype.name],
+        'bdata': base64.b64encode(arr.tobytes()).decode('ascii'),
+        'shape': ','.join(str(dim) for dim in arr.shape)
+    }
+
+
+def decode_array(payload):
+    """
+    Inverse of encode_array: accepts either a plain list or a typed array spec.
+    """
+    if isinstance(payload, dict) and 'bdata' in payload:
+        codes = {code: name for name, code in DTYPE_CODES.items()}
+        arr = np.frombuffer(base64.b64decode(payload['bdata']), dtype=np.dtype(codes[payload['dtype']]).newbyteorder('<'))
+        shape = tuple(int(dim) for dim in str(payload['shape']).split(',') if dim)
+        return arr.reshape(shape)
+    return np.asarray(payload)
+
+
+def _encode_trace_arrays(obj):
+    # Long numeric arrays (x, y, customdata, marker.color, ...) become typed
+    # array specs; strings, short arrays and scalars are left untouched.
+    if isinstance(obj, dict):
+        return {key: _encode_trace_arrays(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple, np.ndarray)):
+        if len(obj) >= BINARY_MIN_LENGTH:
+            arr = np.asarray(obj)
+            if arr.dtype.kind in 'iuf':
+                return encode_array(arr, 'binary')
+        if isinstance(obj, np.ndarray):
+            return obj
+        return [_encode_trace_arrays(value) for value in obj]
+    return obj
+
+
+def figure_to_json(fig, encoding='json'):
+    """
+    Serializes a Plotly figure. With 'binary' encoding the long numeric arrays
+    of its traces are sent as base64 typed arrays instead of JSON number lists.
+    """
+    if encoding == 'json':
+        return fig.to_json()
+
+    from plotly.utils import PlotlyJSONEncoder
+
+    fig_dict = fig.to_plotly_json()
+    fig_dict['data'] = [_encode_trace_arrays(trace) for trace in fig_dict['data']]
+    return json.dumps(fig_dict, cls=PlotlyJSONEncoder, separators=(',', ':'))
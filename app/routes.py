@@ -1,22 +1,45 @@
-from flask import Blueprint, render_template, request, jsonify
+from flask import Blueprint, render_template, request, jsonify, Response, stream_with_context, session
+import json
 import pandas as pd
 import time
 from .core import run_clustering
-from .core.batch import run_batch_clustering
-from scipy.cluster.hierarchy import fcluster
+from .core.batch import (run_batch_clustering, run_adaptive_batch_clustering, run_grid_batch_clustering,
+                         extend_batch_clustering, analyze_batch_results, serialize_batch_results, render_batch_figures,
+                         SWEEP_MODES, ADAPTIVE_HAI_THRESHOLD, ADAPTIVE_MAX_RUNS)
+from .core.transport import ENCODINGS
+from .core.clustering import HIERARCHY_BACKENDS, extract_flat_clustering
+from .core.hai import HAI_METHODS, build_cut_index, cut_at
+from .core.jobs import (submit_batch_job, job_status, load_job, load_job_results, follow_job, cancel_job,
+                        JOB_STREAM_MAX_SECONDS)
+from .core.sessions import new_session_id, save_single_run, load_single_run, save_batch, load_batch, load_cut_index, load_linkage
+from .core.datasets import register_dataset, load_dataset, dataset_info
 
 import io
 import numpy as np
 
 main = Blueprint('main', __name__)
 
-# Global state to store the latest batch session for dynamic dendrogram cuts
-# Acceptable for single-user local tool usage.
-SESSION_DATA = {
-    'meta_linkage': None,
-    'hai_matrix': None,
-    'ordered_mpts': None
-}
+def _session_id():
+    # Anonymous per-browser id kept in Flask's signed session cookie; the state
+    # itself lives in the on-disk session store (app/core/sessions.py), so any
+    # worker process can serve the next request of the session.
+    if 'sid' not in session:
+        session['sid'] = new_session_id()
+    return session['sid']
+
+def _request_dataset():
+    # The dataset of a request: a registered 'dataset_id', or an uploaded 'file'
+    # that is registered first (parsed only if its content is new).
+    # Returns (numeric DataFrame over the stored matrix, dataset_id).
+    dataset_id = request.form.get('dataset_id')
+    if not dataset_id:
+        if 'file' not in request.files:
+            raise ValueError('No file part')
+        file = request.files['file']
+        if file.filename == '':
+            raise ValueError('No selected file')
+        dataset_id = register_dataset(file.stream, file.filename)
+    return load_dataset(dataset_id), dataset_id
 
 @main.route('/')
 def index():
@@ -32,29 +55,12 @@ def settings():
 
 @main.route('/upload', methods=['POST'])
 def upload_file():
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file part'}), 400
-    
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({'error': 'No selected file'}), 400
-        
     try:
-        # Read CSV with header inference
-        df = pd.read_csv(file)
-        
-        # Ensure we only have numeric data for clustering
-        df_numeric = df.select_dtypes(include=[np.number])
-        if df_numeric.empty:
-            # If inference with header failed or file has no header but read_csv took first row as header
-            # Try once more without header if the inferred one has no numeric columns
-            file.seek(0)
-            df = pd.read_csv(file, header=None)
-            df_numeric = df.select_dtypes(include=[np.number])
-            
-        if df_numeric.empty:
-            return jsonify({'error': 'The provided file contains no numerical data for clustering.'}), 400
+        df, dataset_id = _request_dataset()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
         
+    try:
         # Read Labels if provided
         true_labels = None
         labels_file = request.files.get('labels_file')
@@ -68,106 +74,402 @@ def upload_file():
         min_samples = request.form.get('min_samples', None)
         metric = request.form.get('metric', 'euclidean')
         algorithm = request.form.get('algorithm', 'hdbscan')
+        projection_method = request.form.get('projection', 'auto')
+        encoding = request.form.get('encoding', 'json')
+        if encoding not in ENCODINGS:
+            return jsonify({'error': f"Unknown encoding '{encoding}'."}), 400
+        hierarchy = request.form.get('hierarchy', 'mst')
+        if hierarchy not in HIERARCHY_BACKENDS:
+            return jsonify({'error': f"Unknown hierarchy backend '{hierarchy}'."}), 400
         
-        # Run clustering
-        results = run_clustering(df, min_cluster_size, min_samples, metric=metric, algorithm=algorithm, true_labels=true_labels)
+        # Run clustering. Tied merges are ordered canonically, so the labels can
+        # differ from sklearn's HDBSCAN on the same data (see README, "Labels and scikit-learn")
+        results = run_clustering(df, min_cluster_size, min_samples, metric=metric, algorithm=algorithm, true_labels=true_labels,
+                                 projection_method=projection_method, encoding=encoding, hierarchy=hierarchy,
+                                 keep_linkage=True)
+        # Kept for the tuning session (/tune): min_samples is the value the tree was built with
+        tuning = {'min_cluster_size': int(min_cluster_size),
+                  'min_samples': int(min_samples) if min_samples else int(min_cluster_size),
+                  'n_samples': int(df.shape[0]), 'metric': metric, 'algorithm': algorithm, 'hierarchy': hierarchy}
+        save_single_run(_session_id(), results.pop('linkage'), tuning, true_labels=true_labels)
         
         return jsonify({
             'message': 'Clustering successful',
             'results': results,
-            'preview': df.head().to_dict(orient='records')
+            'preview': dataset_info(dataset_id)['preview'],
+            'dataset_id': dataset_id,
+            'tuning': tuning
         })
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@main.route('/tune', methods=['POST'])
+def tune_clustering():
+    """
+    Tuning session: re-extracts the flat clustering of the latest /upload run for
+    another min_cluster_size from its stored hierarchy. Nothing is recomputed but the
+    condensed tree, so min_samples stays the one of that run.
+    """
+    try:
+        data = request.get_json() or {}
+        encoding = data.get('encoding', 'json')
+        if encoding not in ENCODINGS:
+            return jsonify({'error': f"Unknown encoding '{encoding}'."}), 400
+
+        single = load_single_run(_session_id())
+        if single is None:
+            return jsonify({'error': 'No clustering run to tune; upload a dataset first.'}), 400
+
+        try:
+            min_cluster_size = int(data.get('min_cluster_size'))
+            result = extract_flat_clustering(single['linkage_z'], min_cluster_size,
+                                             true_labels=single['true_labels'], encoding=encoding)
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
+
+        result.update(min_cluster_size=min_cluster_size, min_samples=single['params']['min_samples'])
+        return jsonify(result)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
 @main.route('/batch', methods=['POST'])
 def batch_process():
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file part'}), 400
-    
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({'error': 'No selected file'}), 400
-        
     start_time = time.time()
     try:
-        # Read CSV with header inference
-        df = pd.read_csv(file)
-        
-        # Validate numeric data
-        if df.select_dtypes(include=[np.number]).empty:
-            file.seek(0)
-            df = pd.read_csv(file, header=None)
-            if df.select_dtypes(include=[np.number]).empty:
-                return jsonify({'error': 'The provided file contains no numerical data for clustering.'}), 400
-        
+        df, dataset_id = _request_dataset()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
         # Get parameters for batch
         min_mpts = int(request.form.get('min_mpts', 2))
         max_mpts = int(request.form.get('max_mpts', 10)) # Default small range for testing
         step = int(request.form.get('step', 1))
         metric = request.form.get('metric', 'euclidean')
         algorithm = request.form.get('algorithm', 'hdbscan')
+        projection_method = request.form.get('projection', 'auto')
+        encoding = request.form.get('encoding', 'json')
+        if encoding not in ENCODINGS:
+            return jsonify({'error': f"Unknown encoding '{encoding}'."}), 400
+        hierarchy = request.form.get('hierarchy', 'mst')
+        if hierarchy not in HIERARCHY_BACKENDS:
+            return jsonify({'error': f"Unknown hierarchy backend '{hierarchy}'."}), 400
+        hai_method = request.form.get('hai_method', 'auto')
+        if hai_method not in HAI_METHODS:
+            return jsonify({'error': f"Unknown HAI method '{hai_method}'."}), 400
+        sweep = request.form.get('sweep', 'grid')
+        if sweep not in SWEEP_MODES:
+            return jsonify({'error': f"Unknown sweep mode '{sweep}'."}), 400
         
         # Run batch clustering
-        results = run_batch_clustering(df, min_mpts, max_mpts, step, metric=metric, algorithm=algorithm)
+        if sweep == 'grid-2d':
+            # min_samples takes the mpts range; min_cluster_size its own (default: the same)
+            min_mcs = int(request.form.get('min_mcs') or min_mpts)
+            max_mcs = int(request.form.get('max_mcs') or max_mpts)
+            mcs_step = int(request.form.get('mcs_step') or step)
+            results = run_grid_batch_clustering(df, range(min_mpts, max_mpts + 1, step),
+                                                range(min_mcs, max_mcs + 1, mcs_step), metric=metric, algorithm=algorithm, projection_method=projection_method,
+                                                hierarchy=hierarchy)
+        elif sweep == 'adaptive':
+            max_runs = int(request.form.get('max_runs', ADAPTIVE_MAX_RUNS))
+            hai_threshold = float(request.form.get('hai_threshold', ADAPTIVE_HAI_THRESHOLD))
+            results = run_adaptive_batch_clustering(df, min_mpts, max_mpts, step, metric=metric, algorithm=algorithm,
+                                                    projection_method=projection_method, hierarchy=hierarchy,
+                                                    hai_method=hai_method, hai_threshold=hai_threshold,
+                                                    max_runs=max_runs)
+        else:
+            results = run_batch_clustering(df, min_mpts, max_mpts, step, metric=metric, algorithm=algorithm,
+                                           projection_method=projection_method, hierarchy=hierarchy)
         
         # Run meta-analysis
-        from .core.batch import analyze_batch_results
-        analysis = analyze_batch_results(results)
-        
-        # Store for dynamic cuts
-        SESSION_DATA['meta_linkage'] = analysis.get('meta_linkage')
-        SESSION_DATA['hai_matrix'] = analysis.get('hai_matrix')
-        SESSION_DATA['ordered_mpts'] = analysis.get('ordered_mpts')
+        analysis = analyze_batch_results(results, hai_method=hai_method)
         
-        # Remove meta_linkage from JSON response since we don't need to send the large matrix
-        if 'meta_linkage' in analysis:
-            del analysis['meta_linkage']
-        
-        exec_time = round(time.time() - start_time, 2)
+        params = {'dataset_id': dataset_id, 'metric': metric, 'algorithm': algorithm,
+                  'projection_method': projection_method, 'hierarchy': hierarchy, 'hai_method': hai_method,
+                  'sweep': sweep}
+        return _batch_response(df, results, analysis, params, encoding, (min_mpts, max_mpts, step),
+                               round(time.time() - start_time, 2), extra={'dataset_id': dataset_id})
+
         
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+@main.route('/batch/extend', methods=['POST'])
+def batch_extend():
+    """
+    Adds a new mpts range to the active batch: only the missing hierarchies are
+    computed, and only their rows/columns of the HAI matrix.
+    """
+    start_time = time.time()
+    try:
+        batch = load_batch(_session_id())
+        if batch is None:
+            return jsonify({'error': 'No active batch session found.'}), 400
+
+        min_mpts = int(request.form.get('min_mpts', 2))
+        max_mpts = int(request.form.get('max_mpts', 10))
+        step = int(request.form.get('step', 1))
+        encoding = request.form.get('encoding', 'json')
+        if encoding not in ENCODINGS:
+            return jsonify({'error': f"Unknown encoding '{encoding}'."}), 400
+
+        df = batch['df']
+        # An extended job batch is no longer the job's result (see _job_payload)
+        params = {key: value for key, value in batch['params'].items() if key != 'job_id'}
+        if params.get('sweep') == 'grid-2d':
+            return jsonify({'error': 'Only 1-D mpts sweeps can be extended.'}), 400
+        results = extend_batch_clustering(df, batch['results'], min_mpts, max_mpts, step, metric=params['metric'],
+                                          algorithm=params['algorithm'], projection_method=params['projection_method'],
+                                          hierarchy=params['hierarchy'])
+
+        analysis = analyze_batch_results(results, hai_method=params['hai_method'], previous_analysis=batch['analysis'])
+
+        # The merged ranges have no common step: the response lists the mpts values
+        return _batch_response(df, results, analysis, params, encoding, sorted(int(key) for key in results),
+                               round(time.time() - start_time, 2))
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+def _batch_response(df, results, analysis, params, encoding, mpts_range, exec_time, extra=None):
+    return jsonify(_batch_payload(df, results, analysis, params, encoding, mpts_range, exec_time, extra))
+
+def _batch_payload(df, results, analysis, params, encoding, mpts_range, exec_time, extra=None, save=True):
+    # Shared tail of /batch, /batch/extend and finished jobs: keep the session, build the response.
+    # mpts_range is the requested (min, max, step), or the list of mpts values of an extended batch.
+    # save=False answers from a batch that is already the session's active one.
+    
+    # Stored for dynamic cuts and zooms; lean results so figures of any mpts can be
+    # drawn on demand, and the HAI matrix so the range can be extended incrementally
+    # The cut index makes every later threshold drag a binary search
+    if save and 'hai_matrix' in analysis:
+        cut_index = build_cut_index(analysis['meta_linkage'], analysis['hai_matrix'])
+        save_batch(_session_id(), params['dataset_id'], results, analysis, params, cut_index=cut_index)
+    
+    # Remove meta_linkage from JSON response since we don't need to send the large matrix
+    if 'meta_linkage' in analysis:
+        del analysis['meta_linkage']
+    
+    # Figures only for the medoid hierarchies; others via /batch/figures
+    medoid_keys = {str(mpts) for mpts in analysis.get('medoids', {}).values()}
+    response_results = serialize_batch_results(df, results, medoid_keys, params['projection_method'], encoding)
+    
+    if isinstance(mpts_range, list):
+        batch_range = {'min': mpts_range[0], 'max': mpts_range[-1], 'values': mpts_range}
+    else:
+        min_mpts, max_mpts, step = mpts_range
+        batch_range = {'min': min_mpts, 'max': max_mpts, 'step': step}
+    
+    return {
+        'message': 'Batch clustering successful',
+        'range': batch_range,
+        'results': response_results,
+        'analysis': analysis,
+        'execution_time': exec_time,
+        **(extra or {})
+    }
+
+@main.route('/batch/figures', methods=['POST'])
+def batch_figures():
+    try:
+        data = request.get_json()
+        mpts = str(data.get('mpts'))
+        encoding = data.get('encoding', 'json')
+        if encoding not in ENCODINGS:
+            return jsonify({'error': f"Unknown encoding '{encoding}'."}), 400
+
+        batch = load_batch(_session_id())
+        if batch is None:
+            return jsonify({'error': 'No active batch session found.'}), 400
+        if mpts not in batch['results']:
+            return jsonify({'error': f"No result for mpts={mpts} in the active batch."}), 400
+
+        figures = render_batch_figures(batch['df'], batch['results'][mpts], batch['projection_method'], encoding)
+        return jsonify({'mpts': mpts, **figures})
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+@main.route('/datasets', methods=['POST'])
+def upload_dataset():
+    """
+    Registers an uploaded CSV without running anything; the returned id can replace
+    the file in /upload, /batch and /jobs/batch.
+    """
+    try:
+        _, dataset_id = _request_dataset()
+        return jsonify(dataset_info(dataset_id))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+@main.route('/datasets/<dataset_id>')
+def get_dataset(dataset_id):
+    try:
+        info = dataset_info(dataset_id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 404
+    if info is None:
+        return jsonify({'error': f"Unknown dataset '{dataset_id}'."}), 404
+    return jsonify(info)
+
+@main.route('/jobs/batch', methods=['POST'])
+def submit_batch():
+    """
+    Same form as /batch (grid sweeps only), but the sweep runs as a background job: returns the job id
+    right away. Poll /jobs/<id>/status, fetch hierarchies from /jobs/<id>/results.
+    """
+    try:
+        # Jobs run plain mpts grids; adaptive and 2-D sweeps go through /batch
+        sweep = request.form.get('sweep', 'grid')
+        if sweep != 'grid':
+            return jsonify({'error': f"Sweep mode '{sweep}' can't run as a background job; use /batch."}), 400
+
+        _, dataset_id = _request_dataset()
+
+        min_mpts = int(request.form.get('min_mpts', 2))
+        max_mpts = int(request.form.get('max_mpts', 10))
+        step = int(request.form.get('step', 1))
+        hierarchy = request.form.get('hierarchy', 'mst')
+        if hierarchy not in HIERARCHY_BACKENDS:
+            return jsonify({'error': f"Unknown hierarchy backend '{hierarchy}'."}), 400
+        hai_method = request.form.get('hai_method', 'auto')
+        if hai_method not in HAI_METHODS:
+            return jsonify({'error': f"Unknown HAI method '{hai_method}'."}), 400
+
+        job_id = submit_batch_job(dataset_id, min_mpts, max_mpts, step, metric=request.form.get('metric', 'euclidean'),
+                                  algorithm=request.form.get('algorithm', 'hdbscan'),
+                                  projection_method=request.form.get('projection', 'auto'),
+                                  hierarchy=hierarchy, hai_method=hai_method)
+        return jsonify({'job_id': job_id, 'job': job_status(job_id), 'dataset_id': dataset_id}), 202
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+@main.route('/jobs/<job_id>/status')
+def batch_job_status(job_id):
+    try:
+        return jsonify(job_status(job_id))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 404
+
+@main.route('/jobs/<job_id>/results')
+def batch_job_results(job_id):
+    """
+    Hierarchies a job has finished so far (labels, probabilities, cluster counts);
+    'exclude' lists the comma-separated mpts the client already has. Once the job
+    is done this is the full /batch response and the job becomes the active batch.
+    """
+    try:
+        encoding = request.args.get('encoding', 'json')
+        if encoding not in ENCODINGS:
+            return jsonify({'error': f"Unknown encoding '{encoding}'."}), 400
+
+        try:
+            progress = job_status(job_id)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 404
+
+        df, params, analysis = load_job(job_id)
+        if progress['status'] == 'done':
+            return jsonify(_job_payload(job_id, progress, df, params, analysis, encoding, progress))
+
+        exclude = {key for key in request.args.get('exclude', '').split(',') if key}
+        results = load_job_results(job_id, exclude=exclude)
         return jsonify({
-            'message': 'Batch clustering successful',
-            'range': {'min': min_mpts, 'max': max_mpts, 'step': step},
-            'results': results,
-            'analysis': analysis,
-            'execution_time': exec_time
+            'job': progress,
+            'results': serialize_batch_results(df, results, encoding=encoding)
         })
-
-        
     except Exception as e:
         import traceback
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+def _job_payload(job_id, progress, df, params, analysis, encoding, job):
+    # Full /batch response of a finished job. The job becomes the session's active
+    # batch on the first poll (or stream) only: later ones are served from the stored
+    # batch instead of saving it and rebuilding its cut index again.
+    params = dict(params, job_id=job_id)
+    active = load_batch(_session_id())
+    saved = active is not None and active['params'].get('job_id') == job_id
+    results = active['results'] if saved else load_job_results(job_id)
+    exec_time = round(progress['updated'] - progress['created'], 2)
+    return _batch_payload(df, results, analysis, params, encoding, tuple(params['range']), exec_time,
+                          extra={'job': job}, save=not saved)
+
+@main.route('/jobs/<job_id>/stream')
+def stream_batch_job(job_id):
+    """
+    Streams a job as NDJSON, one event per line: a 'result' event with the compact
+    result (labels, probabilities, cluster counts) of every hierarchy as soon as it
+    is finished, then 'done' with the full /batch response (the job becomes the
+    active batch), or 'cancelled' / 'failed'. The stream ends without a final event
+    after JOB_STREAM_MAX_SECONDS; clients then poll /jobs/<id>/status.
+    """
+    encoding = request.args.get('encoding', 'json')
+    if encoding not in ENCODINGS:
+        return jsonify({'error': f"Unknown encoding '{encoding}'."}), 400
+    try:
+        job_status(job_id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 404
+
+    # The session cookie has to be set before the response starts streaming
+    _session_id()
+
+    def events():
+        df, params, _ = load_job(job_id)
+        for progress, new_results in follow_job(job_id, max_seconds=JOB_STREAM_MAX_SECONDS):
+            job = {key: progress[key] for key in ('status', 'mpts', 'completed', 'failed', 'error')}
+            serialized = serialize_batch_results(df, new_results, encoding=encoding)
+            for key, entry in serialized.items():
+                yield json.dumps({'event': 'result', 'mpts': int(key), 'result': entry, 'job': job}) + '\n'
+
+            if progress['status'] == 'done':
+                _, _, analysis = load_job(job_id)
+                payload = _job_payload(job_id, progress, df, params, analysis, encoding, job)
+                yield json.dumps({'event': 'done', **payload}) + '\n'
+            elif progress['status'] in ('cancelled', 'failed'):
+                yield json.dumps({'event': progress['status'], 'job': job}) + '\n'
+
+    return Response(stream_with_context(events()), mimetype='application/x-ndjson')
+
+@main.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_batch_job(job_id):
+    try:
+        return jsonify(cancel_job(job_id))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 404
+
 @main.route('/cut_dendrogram', methods=['POST'])
 def cut_dendrogram():
     try:
         data = request.get_json()
         y_threshold = float(data.get('y_threshold', 0.0))
         
-        Z = SESSION_DATA.get('meta_linkage')
-        hai_matrix = SESSION_DATA.get('hai_matrix')
-        ordered_mpts = SESSION_DATA.get('ordered_mpts')
-
-        if Z is None or hai_matrix is None:
+        cut_index = load_cut_index(_session_id())
+        if cut_index is None:
             return jsonify({'error': 'No active batch session found.'}), 400
-        
-        # We need to compute cluster labels using fcluster
-        # distance criterion cuts the tree at y_threshold
-        labels = fcluster(Z, t=y_threshold, criterion='distance')
-        
-        # Scipy clustering returns 1-indexed labels (1, 2, 3...)
-        # We need to map them back to medoids.
-        from .core.hai import compute_medoids
-        
-        medoids_map = compute_medoids(np.array(hai_matrix), labels)
-        
-        medoids_mpts = {}
-        for label, idx in medoids_map.items():
-            if idx < len(ordered_mpts):
-                medoids_mpts[int(label)] = int(ordered_mpts[idx])
+
+        # Labels and medoids of every distinct cut are precomputed per batch
+        heights, cut_labels, cut_medoids, ordered_mpts = cut_index
+        labels, medoids_map = cut_at(heights, cut_labels, cut_medoids, y_threshold)
+
+        # .item(): int mpts, or the grid key of a 2-D sweep
+        medoids_mpts = {int(label): ordered_mpts[idx].item() for label, idx in medoids_map.items()}
             
         return jsonify({
             'meta_labels': labels.tolist(),
@@ -178,3 +480,32 @@ def cut_dendrogram():
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+
+
+@main.route('/dendrogram/zoom', methods=['POST'])
+def zoom_dendrogram():
+    """
+    Expands a collapsed dendrogram leaf: returns the figure of the subtree below
+    the requested node (original linkage id), again limited in number of leaves.
+    """
+    try:
+        data = request.get_json()
+        source = str(data.get('source', 'single'))
+        node = data.get('node')
+
+        Z = load_linkage(_session_id(), source)
+        if Z is None:
+            return jsonify({'error': f"No hierarchy found for '{source}'."}), 400
+
+        node = int(node) if node is not None else None
+        if node is not None and not 0 <= node < 2 * len(Z) + 1:
+            return jsonify({'error': f"Node {node} is not part of the hierarchy."}), 400
+
+        from .core.dendrogram import dendrogram_figure
+        fig = dendrogram_figure(Z, node=node)
+
+        return jsonify({'dendrogram_json': fig.to_json()})
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
@@ -6,6 +6,64 @@ function openBatchConfigModal() {
 // Ensure the function is accessible globally
 window.openBatchConfigModal = openBatchConfigModal;
 
+function openBatchExtendModal() {
+    $('#batchExtendModal').modal('show');
+}
+
+window.openBatchExtendModal = openBatchExtendModal;
+
+// Numeric result arrays are requested as base64 typed arrays
+// ({dtype, bdata, shape}, see app/core/transport.py) and decoded here
+// straight into JS typed arrays, which Plotly accepts as trace data.
+const TYPED_ARRAYS = {
+    i1: Int8Array, u1: Uint8Array, i2: Int16Array, u2: Uint16Array,
+    i4: Int32Array, u4: Uint32Array, f4: Float32Array, f8: Float64Array
+};
+
+function decodeTypedArrays(obj) {
+    if (Array.isArray(obj)) return obj.map(decodeTypedArrays);
+    if (obj === null || typeof obj !== 'object') return obj;
+
+    if (typeof obj.bdata === 'string' && TYPED_ARRAYS[obj.dtype]) {
+        const bytes = Uint8Array.from(atob(obj.bdata), c => c.charCodeAt(0));
+        const values = new TYPED_ARRAYS[obj.dtype](bytes.buffer);
+        const shape = String(obj.shape || values.length).split(',').map(Number);
+        if (shape.length < 2) return values;
+
+        // 2D arrays (e.g. linkage_z) become a list of row views
+        const rows = [];
+        for (let r = 0; r < shape[0]; r++) rows.push(values.subarray(r * shape[1], (r + 1) * shape[1]));
+        return rows;
+    }
+
+    const decoded = {};
+    Object.keys(obj).forEach(key => { decoded[key] = decodeTypedArrays(obj[key]); });
+    return decoded;
+}
+
+function parseFigure(figureJson) {
+    return decodeTypedArrays(JSON.parse(figureJson));
+}
+
+// Uploaded datasets are registered on the server by the SHA-256 of their bytes
+// (/datasets). When the selected file is already registered, its id is sent
+// instead of the file, so it is neither uploaded nor parsed again.
+async function useRegisteredDataset(formData) {
+    const file = formData.get('file');
+    if (!(file instanceof File) || !file.size || !(window.crypto && crypto.subtle)) return;
+    try {
+        const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+        const datasetId = Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('');
+        const res = await fetch(`/datasets/${datasetId}`);
+        if (res.ok) {
+            formData.delete('file');
+            formData.set('dataset_id', datasetId);
+        }
+    } catch (err) {
+        console.warn('Dataset lookup failed, uploading the file:', err);
+    }
+}
+
 document.addEventListener('DOMContentLoaded', () => {
     // Sidebar Toggle
     const btnToggle = document.querySelector('.fa-bars');
@@ -26,9 +84,205 @@ document.addEventListener('DOMContentLoaded', () => {
     let latestAnalysis = null;
     let batchResults = null;
 
+    // Draws the meta-dendrogram, HAI heatmap and reachability plots of latestAnalysis
+    function renderBatchAnalysis() {
+        // 1. Render Meta-Dendrogram
+        if (latestAnalysis.meta_dendrogram_json) {
+            const figure = parseFigure(latestAnalysis.meta_dendrogram_json);
+
+            // Adjust margins and spacing
+            figure.layout.margin = { t: 20, r: 20, l: 40, b: 20 };
+
+            // Add Threshold draggable line
+            let maxY = 0;
+            if (figure.data) {
+                figure.data.forEach(trace => {
+                    if (trace.y) {
+                        const max_val = Math.max(...trace.y);
+                        if (max_val > maxY) maxY = max_val;
+                    }
+                });
+            }
+
+            let threshold = maxY / 2; // initial
+            figure.layout.shapes = [{
+                type: 'line',
+                x0: 0,
+                x1: 1,
+                xref: 'paper',
+                y0: threshold,
+                y1: threshold,
+                yref: 'y',
+                line: { color: 'red', width: 2, dash: 'dot' },
+                editable: true
+            }];
+
+            Plotly.react('meta-dendrogram', figure.data, figure.layout, {
+                responsive: true, displayModeBar: false,
+                edits: { shapePosition: true }
+            });
+
+            const dendroDiv = document.getElementById('meta-dendrogram');
+            // Plotly.react reuses the div across renders (e.g. after extending the
+            // batch): drop the previous handler so one drag sends one cut request
+            dendroDiv.removeAllListeners('plotly_relayout');
+            dendroDiv.on('plotly_relayout', async (eventData) => {
+                let newY = null;
+                if (eventData['shapes[0].y0'] !== undefined) {
+                    newY = eventData['shapes[0].y0'];
+                } else if (eventData['shapes[0].y1'] !== undefined) {
+                    newY = eventData['shapes[0].y1'];
+                } else if (eventData.shapes && eventData.shapes[0]) {
+                    newY = eventData.shapes[0].y0;
+                }
+
+                // Force threshold line to be horizontal by ensuring y0 == y1
+                if (newY !== null) {
+                    // Enforce horizontal line if the user dragged just one end
+                    const isHorizontal = eventData['shapes[0].y0'] !== undefined && eventData['shapes[0].y1'] !== undefined;
+
+                    try {
+                        const res = await fetch('/cut_dendrogram', {
+                            method: 'POST',
+                            headers: { 'Content-Type': 'application/json' },
+                            body: JSON.stringify({ y_threshold: newY })
+                        });
+                        const cutData = await res.json();
+                        if (!res.ok) throw new Error(cutData.error);
+
+                        // Store new labels and medoids to ensure redrawing happens smoothly
+                        latestAnalysis.meta_labels = cutData.meta_labels;
+                        latestAnalysis.medoids = cutData.medoids;
+                        renderReachabilityPlots(cutData.meta_labels, cutData.medoids);
+                    } catch (err) {
+                        console.error('Dendrogram cut failed:', err);
+                    }
+                }
+            });
+        }
+
+        // 2. Render HAI Heatmap
+        renderHAIMatrix(latestAnalysis.hai_matrix, latestAnalysis.ordered_mpts, latestAnalysis.hai_error);
+
+        // 3. Render Reachability Plots side by side
+        renderReachabilityPlots(latestAnalysis.meta_labels, latestAnalysis.medoids);
+    }
+
     // --- Batch Processing Form ---
+    // Grid sweeps run as background jobs (/jobs/...). Their results are read from
+    // the job's NDJSON stream as each mpts finishes; if the stream breaks, the
+    // status is polled until the job ends and the full response is fetched.
+    const JOB_POLL_INTERVAL = 1000;
+    let activeJobId = null;
+
+    // Reads /jobs/<id>/stream, calling onEvent for every 'result' event.
+    // Returns the final event, or null if the connection ended before it.
+    async function streamBatchJob(jobId, onEvent) {
+        try {
+            const res = await fetch(`/jobs/${jobId}/stream?encoding=binary`);
+            if (!res.ok || !res.body) return null;
+
+            const reader = res.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) return null;
+                buffer += decoder.decode(value, { stream: true });
+
+                let newline;
+                while ((newline = buffer.indexOf('\n')) >= 0) {
+                    const line = buffer.slice(0, newline).trim();
+                    buffer = buffer.slice(newline + 1);
+                    if (!line) continue;
+
+                    const event = decodeTypedArrays(JSON.parse(line));
+                    if (event.event !== 'result') return event;
+                    onEvent(event);
+                }
+            }
+        } catch (err) {
+            console.error('Job stream interrupted:', err);
+            return null;
+        }
+    }
+
+    async function pollBatchJob(jobId, onProgress) {
+        while (true) {
+            await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL));
+            const statusRes = await fetch(`/jobs/${jobId}/status`);
+            const job = await statusRes.json();
+            if (!statusRes.ok) throw new Error(job.error || 'Unknown error');
+            onProgress(job);
+
+            if (job.status !== 'queued' && job.status !== 'running') break;
+        }
+
+        const resultsRes = await fetch(`/jobs/${jobId}/results?encoding=binary`);
+        const data = decodeTypedArrays(await resultsRes.json());
+        if (!resultsRes.ok) throw new Error(data.error || 'Unknown error');
+        return { event: data.job.status, ...data };
+    }
+
+    async function runBatchJob(formData, onProgress, onResult) {
+        const res = await fetch('/jobs/batch', { method: 'POST', body: formData });
+        const submitted = await res.json();
+        if (!res.ok) throw new Error(submitted.error || 'Unknown error');
+
+        const jobId = submitted.job_id;
+        activeJobId = jobId;
+        setBatchCancelVisible(true);
+        let final;
+        try {
+            final = await streamBatchJob(jobId, (event) => {
+                onProgress(event.job);
+                onResult(event.mpts, event.result);
+            });
+            if (!final) final = await pollBatchJob(jobId, onProgress);
+        } finally {
+            activeJobId = null;
+            setBatchCancelVisible(false);
+        }
+
+        if (final.event === 'cancelled') throw new Error('Batch job cancelled.');
+        if (final.event === 'failed') throw new Error(final.job.error || 'Batch job failed.');
+        return final;
+    }
+
+    function cancelBatchJob() {
+        if (activeJobId) fetch(`/jobs/${activeJobId}/cancel`, { method: 'POST' });
+    }
+
+    function setBatchCancelVisible(visible) {
+        const cancelBtn = document.getElementById('batch-cancel-btn');
+        if (cancelBtn) cancelBtn.classList.toggle('d-none', !visible);
+    }
+
+    const topCancelBtn = document.getElementById('batch-cancel-btn');
+    if (topCancelBtn) topCancelBtn.addEventListener('click', cancelBatchJob);
+
+    // Live view while a sweep runs: clusters and noise of every finished mpts
+    function renderSweepPreview(results) {
+        const mpts = Object.keys(results).map(Number).sort((a, b) => a - b);
+        Plotly.react('meta-dendrogram', [
+            { x: mpts, y: mpts.map(m => results[m].n_clusters), mode: 'lines+markers', name: 'Clusters' },
+            { x: mpts, y: mpts.map(m => results[m].noise_points), mode: 'lines+markers', name: 'Noise Points', yaxis: 'y2' }
+        ], {
+            template: 'plotly_white',
+            title: `Sweep in progress: ${mpts.length} hierarchies done`,
+            xaxis: { title: 'mpts Parameter' },
+            yaxis: { title: 'Clusters' },
+            yaxis2: { title: 'Noise Points', overlaying: 'y', side: 'right' },
+            margin: { t: 40, r: 50, l: 50, b: 40 }
+        }, { responsive: true, displayModeBar: false });
+    }
+
     const batchForm = document.getElementById('batch-form');
     if (batchForm) {
+        // Closing the dialog while a job runs cancels it
+        const batchCancelBtn = batchForm.querySelector('[data-dismiss="modal"]');
+        if (batchCancelBtn) batchCancelBtn.addEventListener('click', cancelBatchJob);
+
         batchForm.onsubmit = async (e) => {
             e.preventDefault();
             const formData = new FormData(e.target);
@@ -40,23 +294,41 @@ document.addEventListener('DOMContentLoaded', () => {
             // Timer Logic
             const startTime = Date.now();
             const timeDisplay = document.getElementById('proj-time');
+            let progressText = '';
             const timerInterval = setInterval(() => {
                 const elapsed = ((Date.now() - startTime) / 1000).toFixed(1);
-                btn.innerHTML = `<i class="fas fa-spinner fa-spin"></i> Processing (${elapsed}s)...`;
+                btn.innerHTML = `<i class="fas fa-spinner fa-spin"></i> Processing ${progressText}(${elapsed}s)...`;
                 if (timeDisplay) timeDisplay.innerText = elapsed + 's';
             }, 100);
 
+            const fileName = formData.get('file')?.name || 'Uploaded File';
             try {
-                const res = await fetch('/batch', { method: 'POST', body: formData });
-                const data = await res.json();
-                if (!res.ok) throw new Error(data.error || 'Unknown error');
+                if (!formData.has('encoding')) formData.append('encoding', 'binary');
+                await useRegisteredDataset(formData);
+                let data;
+                if (formData.get('sweep') === 'adaptive' || formData.get('sweep') === 'grid-2d') {
+                    // Adaptive sweeps are bounded by their run budget, 2-D grids by their
+                    // min_samples runs: run them in the request
+                    const res = await fetch('/batch', { method: 'POST', body: formData });
+                    data = decodeTypedArrays(await res.json());
+                    if (!res.ok) throw new Error(data.error || 'Unknown error');
+                } else {
+                    const sweepResults = {};
+                    data = await runBatchJob(formData, (job) => {
+                        progressText = `${job.completed.length}/${job.mpts.length} mpts `;
+                    }, (mpts, result) => {
+                        // First hierarchy in: show the live view behind the dialog
+                        if (Object.keys(sweepResults).length === 0) $('#batchConfigModal').modal('hide');
+                        sweepResults[mpts] = result;
+                        renderSweepPreview(sweepResults);
+                    });
+                }
 
                 // Store Data
                 latestAnalysis = data.analysis;
                 batchResults = data.results;
 
                 // Update Project Info Sidebar
-                const fileName = formData.get('file')?.name || 'Uploaded File';
                 document.getElementById('proj-name').innerText = fileName;
                 document.getElementById('proj-min-mpts').innerText = formData.get('min_mpts');
                 if (timeDisplay && data.execution_time) {
@@ -66,97 +338,202 @@ document.addEventListener('DOMContentLoaded', () => {
                 // Close Modal
                 $('#batchConfigModal').modal('hide');
 
-                // 1. Render Meta-Dendrogram
-                if (latestAnalysis.meta_dendrogram_json) {
-                    const figure = JSON.parse(latestAnalysis.meta_dendrogram_json);
-
-                    // Adjust margins and spacing
-                    figure.layout.margin = { t: 20, r: 20, l: 40, b: 20 };
-
-                    // Add Threshold draggable line
-                    let maxY = 0;
-                    if (figure.data) {
-                        figure.data.forEach(trace => {
-                            if (trace.y) {
-                                const max_val = Math.max(...trace.y);
-                                if (max_val > maxY) maxY = max_val;
-                            }
-                        });
-                    }
+                renderBatchAnalysis();
 
-                    let threshold = maxY / 2; // initial
-                    figure.layout.shapes = [{
-                        type: 'line',
-                        x0: 0,
-                        x1: 1,
-                        xref: 'paper',
-                        y0: threshold,
-                        y1: threshold,
-                        yref: 'y',
-                        line: { color: 'red', width: 2, dash: 'dot' },
-                        editable: true
-                    }];
-
-                    Plotly.react('meta-dendrogram', figure.data, figure.layout, {
-                        responsive: true, displayModeBar: false,
-                        edits: { shapePosition: true }
-                    });
+            } catch (err) {
+                alert('Batch Error: ' + err.message);
+            } finally {
+                clearInterval(timerInterval);
+                btn.disabled = false;
+                btn.innerHTML = originalBtnHtml;
+            }
+        };
+    }
 
-                    const dendroDiv = document.getElementById('meta-dendrogram');
-                    dendroDiv.on('plotly_relayout', async (eventData) => {
-                        let newY = null;
-                        if (eventData['shapes[0].y0'] !== undefined) {
-                            newY = eventData['shapes[0].y0'];
-                        } else if (eventData['shapes[0].y1'] !== undefined) {
-                            newY = eventData['shapes[0].y1'];
-                        } else if (eventData.shapes && eventData.shapes[0]) {
-                            newY = eventData.shapes[0].y0;
-                        }
-
-                        // Force threshold line to be horizontal by ensuring y0 == y1
-                        if (newY !== null) {
-                            // Enforce horizontal line if the user dragged just one end
-                            const isHorizontal = eventData['shapes[0].y0'] !== undefined && eventData['shapes[0].y1'] !== undefined;
-
-                            try {
-                                const res = await fetch('/cut_dendrogram', {
-                                    method: 'POST',
-                                    headers: { 'Content-Type': 'application/json' },
-                                    body: JSON.stringify({ y_threshold: newY })
-                                });
-                                const cutData = await res.json();
-                                if (!res.ok) throw new Error(cutData.error);
-
-                                // Store new labels and medoids to ensure redrawing happens smoothly
-                                latestAnalysis.meta_labels = cutData.meta_labels;
-                                latestAnalysis.medoids = cutData.medoids;
-                                renderReachabilityPlots(cutData.meta_labels, cutData.medoids);
-                            } catch (err) {
-                                console.error('Dendrogram cut failed:', err);
-                            }
-                        }
-                    });
-                }
+    // --- Extend Batch Form ---
+    const batchExtendForm = document.getElementById('batch-extend-form');
+    if (batchExtendForm) {
+        batchExtendForm.onsubmit = async (e) => {
+            e.preventDefault();
+            const formData = new FormData(e.target);
+            const btn = e.target.querySelector('button[type="submit"]');
+            const originalBtnHtml = btn.innerHTML;
+            btn.disabled = true;
+            btn.innerHTML = '<i class="fas fa-spinner fa-spin"></i> Extending...';
 
-                // 2. Render HAI Heatmap
-                renderHAIMatrix(latestAnalysis.hai_matrix, latestAnalysis.ordered_mpts);
+            try {
+                if (!formData.has('encoding')) formData.append('encoding', 'binary');
+                const res = await fetch('/batch/extend', { method: 'POST', body: formData });
+                const data = decodeTypedArrays(await res.json());
+                if (!res.ok) throw new Error(data.error || 'Unknown error');
 
-                // 3. Render Reachability Plots side by side
-                renderReachabilityPlots(latestAnalysis.meta_labels, latestAnalysis.medoids);
+                latestAnalysis = data.analysis;
+                batchResults = data.results;
 
+                const timeDisplay = document.getElementById('proj-time');
+                if (timeDisplay && data.execution_time) {
+                    timeDisplay.innerText = data.execution_time + 's';
+                }
+
+                $('#batchExtendModal').modal('hide');
+                renderBatchAnalysis();
             } catch (err) {
-                alert('Batch Error: ' + err.message);
+                alert('Extend Error: ' + err.message);
             } finally {
-                clearInterval(timerInterval);
                 btn.disabled = false;
                 btn.innerHTML = originalBtnHtml;
             }
         };
     }
 
+    // --- Single Run Form ---
+    const uploadForm = document.getElementById('upload-form');
+    if (uploadForm) {
+        uploadForm.onsubmit = async (e) => {
+            e.preventDefault();
+            const formData = new FormData(e.target);
+            const btn = e.target.querySelector('button[type="submit"]');
+            const originalBtnHtml = btn ? btn.innerHTML : '';
+            if (btn) {
+                btn.disabled = true;
+                btn.innerHTML = '<i class="fas fa-spinner fa-spin"></i> Processing...';
+            }
+
+            try {
+                if (!formData.has('encoding')) formData.append('encoding', 'binary');
+                await useRegisteredDataset(formData);
+                const res = await fetch('/upload', { method: 'POST', body: formData });
+                const data = decodeTypedArrays(await res.json());
+                if (!res.ok) throw new Error(data.error || 'Unknown error');
+
+                $('#configModal').modal('hide');
+
+                const results = data.results;
+                const viewLabel = document.getElementById('current-view-label');
+                if (viewLabel) viewLabel.innerText = results.n_clusters + ' clusters';
+
+                renderDendrogram('dendro-plot', results.dendrogram_json, 'single');
+
+                const reach = parseFigure(results.reachability_json);
+                Plotly.react('reach-plot', reach.data, reach.layout, { responsive: true, displayModeBar: false });
+
+                const map = parseFigure(results.map_json);
+                Plotly.react('map-plot', map.data, map.layout, { responsive: true, displayModeBar: false });
+
+                startTuningSession(data.tuning);
+            } catch (err) {
+                alert('Clustering Error: ' + err.message);
+            } finally {
+                if (btn) {
+                    btn.disabled = false;
+                    btn.innerHTML = originalBtnHtml;
+                }
+            }
+        };
+    }
+
+    // --- Tuning Session ---
+    // The slider re-extracts the clusters of the last single run for another
+    // min_cluster_size from its stored hierarchy (/tune) and only recolors the
+    // reachability plot and the map. While a request is running, only the latest
+    // slider position is kept and sent once it returns.
+    const MAX_TUNING_MCS = 500;
+    const tuningSlider = document.getElementById('tuning-mcs');
+    let tuneInFlight = false;
+    let tunePending = null;
+
+    function startTuningSession(tuning) {
+        const control = document.getElementById('tuning-control');
+        if (!tuningSlider || !control || !tuning) return;
+        tuningSlider.max = Math.max(2, Math.min(tuning.n_samples, MAX_TUNING_MCS));
+        tuningSlider.value = tuning.min_cluster_size;
+        document.getElementById('tuning-mcs-value').innerText = tuning.min_cluster_size;
+        document.getElementById('tuning-min-samples').innerText = tuning.min_samples;
+        control.classList.remove('d-none');
+    }
+
+    async function tuneClustering(minClusterSize) {
+        if (tuneInFlight) {
+            tunePending = minClusterSize;
+            return;
+        }
+        tuneInFlight = true;
+        try {
+            const res = await fetch('/tune', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ min_cluster_size: minClusterSize, encoding: 'binary' })
+            });
+            const data = decodeTypedArrays(await res.json());
+            if (!res.ok) throw new Error(data.error || 'Unknown error');
+
+            const viewLabel = document.getElementById('current-view-label');
+            if (viewLabel) viewLabel.innerText = data.n_clusters + ' clusters';
+            Plotly.restyle('reach-plot', { 'marker.color': [data.ordered_labels] }, [0]);
+            Plotly.restyle('map-plot', { 'marker.color': [data.labels] }, [0]);
+        } catch (err) {
+            console.error('Tuning error:', err);
+        } finally {
+            tuneInFlight = false;
+            if (tunePending !== null) {
+                const next = tunePending;
+                tunePending = null;
+                tuneClustering(next);
+            }
+        }
+    }
+
+    if (tuningSlider) {
+        tuningSlider.addEventListener('input', () => {
+            document.getElementById('tuning-mcs-value').innerText = tuningSlider.value;
+            tuneClustering(parseInt(tuningSlider.value, 10));
+        });
+    }
+
     // --- Helper Functions ---
 
-    function renderHAIMatrix(matrix, mpts_labels) {
+    // Dendrograms only draw the top of the hierarchy; leaves standing for a
+    // collapsed subtree carry its node id (>= number of points) in customdata.
+    // Clicking one fetches that subtree, double-clicking goes back to the root.
+    function renderDendrogram(divId, dendrogramJson, source) {
+        const figure = parseFigure(dendrogramJson);
+        Plotly.react(divId, figure.data, figure.layout, { responsive: true, displayModeBar: false });
+
+        const div = document.getElementById(divId);
+        if (div.dataset.zoomBound) {
+            div.dataset.source = source;
+            return;
+        }
+        div.dataset.zoomBound = 'true';
+        div.dataset.source = source;
+
+        const zoom = async (node) => {
+            try {
+                const res = await fetch('/dendrogram/zoom', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ source: div.dataset.source, node: node })
+                });
+                const zoomData = await res.json();
+                if (!res.ok) throw new Error(zoomData.error);
+
+                const zoomed = parseFigure(zoomData.dendrogram_json);
+                Plotly.react(divId, zoomed.data, zoomed.layout, { responsive: true, displayModeBar: false });
+            } catch (err) {
+                console.error('Dendrogram zoom failed:', err);
+            }
+        };
+
+        div.on('plotly_click', (eventData) => {
+            const point = eventData.points && eventData.points[0];
+            if (!point || point.customdata === undefined) return;
+            const text = String(point.text || '');
+            if (text.includes('click to expand')) zoom(point.customdata);
+        });
+        div.on('plotly_doubleclick', () => zoom(null));
+    }
+
+    function renderHAIMatrix(matrix, mpts_labels, errors) {
         const data = [{
             z: matrix,
             x: mpts_labels,
@@ -174,6 +551,12 @@ document.addEventListener('DOMContentLoaded', () => {
             }
         }];
 
+        // Sampled HAI: show the confidence interval half-width on hover
+        if (errors) {
+            data[0].customdata = errors;
+            data[0].hovertemplate = 'mpts %{x} vs %{y}<br>HAI: %{z:.4f} ± %{customdata:.4f}<extra></extra>';
+        }
+
         const layout = {
             margin: { t: 30, r: 20, l: 40, b: 60 }, // increased bottom margin for colorbar
             xaxis: {
@@ -193,6 +576,22 @@ document.addEventListener('DOMContentLoaded', () => {
         Plotly.react('hai-heatmap', data, layout, { responsive: true, displayModeBar: false });
     }
 
+    async function loadBatchFigures(mpts) {
+        const result = batchResults[mpts];
+        if (result.reachability_json) return result;
+
+        const res = await fetch('/batch/figures', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ mpts: mpts, encoding: 'binary' })
+        });
+        const figures = await res.json();
+        if (!res.ok) throw new Error(figures.error);
+
+        Object.assign(result, figures);
+        return result;
+    }
+
     function renderReachabilityPlots(labels, medoids_mpts) {
         const container = document.getElementById('reachability-container');
         container.innerHTML = ''; // Clear previous
@@ -209,7 +608,7 @@ document.addEventListener('DOMContentLoaded', () => {
             const mptsValue = medoids_mpts[label];
             const result = batchResults[mptsValue];
 
-            if (!result || !result.reachability_json) return;
+            if (!result) return;
 
             const color = colors[i % colors.length];
 
@@ -220,30 +619,36 @@ document.addEventListener('DOMContentLoaded', () => {
             rDiv.id = wrapperId;
             container.appendChild(rDiv);
 
-            // Parse Plotly JSON
-            const figure = JSON.parse(result.reachability_json);
+            // Figures are only sent for the initial medoids; fetch the others
+            loadBatchFigures(mptsValue).then(figures => {
+                // Parse Plotly JSON
+                const figure = parseFigure(figures.reachability_json);
 
-            // Override colors and layout for small multiples
-            if (figure.data && figure.data[0]) {
-                figure.data[0].marker = { color: color };
-                // figure.data[0].fillcolor = color; // If it's filled
-            }
-            // Remove full title, keep it minimal
-            figure.layout.title = '';
-            figure.layout.margin = { t: 10, r: 10, l: 30, b: 30 };
-
-            // Add custom annotation for 'mpts: X' at bottom center
-            figure.layout.annotations = [{
-                text: 'mpts: ' + mptsValue,
-                xref: 'paper', yref: 'paper',
-                x: 0.5, y: -0.05,
-                showarrow: false,
-                font: { color: '#fff', size: 12 },
-                bgcolor: color,
-                borderpad: 4
-            }];
-
-            Plotly.newPlot(wrapperId, figure.data, figure.layout, { responsive: true, displayModeBar: false });
+                // Override colors and layout for small multiples
+                if (figure.data && figure.data[0]) {
+                    figure.data[0].marker = { color: color };
+                    // figure.data[0].fillcolor = color; // If it's filled
+                }
+                // Remove full title, keep it minimal
+                figure.layout.title = '';
+                figure.layout.margin = { t: 10, r: 10, l: 30, b: 30 };
+
+                // Add custom annotation for 'mpts: X' at bottom center
+                figure.layout.annotations = [{
+                    // Grid sweeps name their hierarchies '<min_samples>x<min_cluster_size>'
+                    text: String(mptsValue).includes('x')
+                        ? 'min_samples × min_cluster_size: ' + mptsValue
+                        : 'mpts: ' + mptsValue,
+                    xref: 'paper', yref: 'paper',
+                    x: 0.5, y: -0.05,
+                    showarrow: false,
+                    font: { color: '#fff', size: 12 },
+                    bgcolor: color,
+                    borderpad: 4
+                }];
+
+                Plotly.newPlot(wrapperId, figure.data, figure.layout, { responsive: true, displayModeBar: false });
+            }).catch(err => console.error('Loading figures failed for mpts ' + mptsValue + ':', err));
 
             i++;
         });
@@ -0,0 +1,180 @@
+import io
+import numpy as np
+import pandas as pd
+import sys
+import os
+import tempfile
+from unittest import mock
+
+sys.path.append(os.getcwd())
+from app.core import batch, datasets, sessions
+from app.core.batch import (run_batch_clustering, serialize_batch_results, extend_batch_clustering, analyze_batch_results,
+                             run_adaptive_batch_clustering, run_grid_batch_clustering)
+from app.core.clustering import run_clustering
+
+
+def test_lean_batch_results():
+    print("Testing lean batch storage and on-demand figures...")
+    rng = np.random.default_rng(21)
+    df = pd.DataFrame(np.vstack([rng.normal(0, 1, (80, 2)), rng.normal(6, 1, (80, 2))]))
+
+    results = run_batch_clustering(df, 3, 6, 1, projection_method='pca')
+    print(f"Stored keys for mpts=4: {sorted(results['4'])}")
+
+    for result in results.values():
+        assert 'map_json' not in result and 'dendrogram_json' not in result
+        assert isinstance(result['labels'], np.ndarray) and result['labels'].dtype == np.int32
+        assert result['linkage_z'].shape == (len(df) - 1, 4)
+
+    serialized = serialize_batch_results(df, results, figure_keys={'5'}, projection_method='pca')
+    assert 'reachability_json' in serialized['5']
+    assert 'reachability_json' not in serialized['3']
+    assert 'linkage_z' not in serialized['5']
+    assert serialized['4']['labels'] == results['4']['labels'].tolist()
+
+
+def test_parallel_batch_matches_sequential():
+    print("Testing process-pool batch against the sequential run...")
+    rng = np.random.default_rng(22)
+    df = pd.DataFrame(np.vstack([rng.normal(0, 1, (60, 2)), rng.normal(6, 1, (60, 2))]))
+
+    sequential = run_batch_clustering(df, 2, 5, 1, n_workers=1)
+
+    # Small data normally stays in-process; force the pool for the test
+    min_samples = batch.BATCH_PARALLEL_MIN_SAMPLES
+    batch.BATCH_PARALLEL_MIN_SAMPLES = 0
+    try:
+        parallel = run_batch_clustering(df, 2, 5, 1, n_workers=2)
+    finally:
+        batch.BATCH_PARALLEL_MIN_SAMPLES = min_samples
+
+    print(f"mpts computed: {list(parallel)}")
+    assert list(parallel) == list(sequential)
+    for key in sequential:
+        assert np.array_equal(parallel[key]['linkage_z'], sequential[key]['linkage_z'])
+        assert np.array_equal(parallel[key]['labels'], sequential[key]['labels'])
+        assert np.array_equal(parallel[key]['probabilities'], sequential[key]['probabilities'])
+
+
+def test_extend_batch_matches_full_run():
+    print("Testing incremental batch extension against a full run...")
+    rng = np.random.default_rng(23)
+    df = pd.DataFrame(np.vstack([rng.normal(0, 1, (70, 2)), rng.normal(5, 1, (70, 2))]))
+
+    results = run_batch_clustering(df, 3, 6, 1)
+    analysis = analyze_batch_results(results)
+    extended = extend_batch_clustering(df, results, 2, 9, 1)
+    incremental = analyze_batch_results(extended, previous_analysis=analysis)
+    full = analyze_batch_results(run_batch_clustering(df, 2, 9, 1))
+
+    print(f"mpts after extension: {incremental['ordered_mpts']}")
+    assert incremental['ordered_mpts'] == full['ordered_mpts']
+    assert np.allclose(incremental['hai_matrix'], full['hai_matrix'], atol=1e-12)
+    assert np.array_equal(incremental['meta_labels'], full['meta_labels'])
+
+
+def test_adaptive_sweep():
+    print("Testing adaptive coarse-to-fine mpts sweep...")
+    rng = np.random.default_rng(24)
+    df = pd.DataFrame(np.vstack([rng.normal(0, 1, (120, 2)), rng.normal(5, 0.5, (80, 2)),
+                                 rng.uniform(-3, 8, (40, 2))]))
+
+    adaptive = run_adaptive_batch_clustering(df, 2, 30, 1, max_runs=10)
+    print(f"Adaptive mpts: {list(adaptive)}")
+    assert len(adaptive) <= 10
+    assert '2' in adaptive and '30' in adaptive
+    full = run_batch_clustering(df, 2, 30, 1)
+    for key, result in adaptive.items():
+        assert np.array_equal(result['linkage_z'], full[key]['linkage_z'])
+
+    # A threshold above every HAI with enough budget refines down to the full grid
+    refined = run_adaptive_batch_clustering(df, 2, 12, 1, hai_threshold=1.01, max_runs=100)
+    assert list(refined) == [str(mpts) for mpts in range(2, 13)]
+
+    analysis = analyze_batch_results(adaptive)
+    assert analysis['ordered_mpts'] == [int(key) for key in adaptive]
+
+    # Pairwise HAIs of the rounds stay in-process even where the HAI pool would start
+    from app.core import hai
+
+    def no_pool(*args, **kwargs):
+        raise AssertionError("the adaptive sweep started an HAI process pool for one pair")
+
+    with mock.patch.object(hai, 'HAI_PARALLEL_MIN_SAMPLES', 0), mock.patch.object(hai, 'HAI_WORKERS', 4), \
+            mock.patch.object(hai, '_run_hai_pool', no_pool):
+        pooled = run_adaptive_batch_clustering(df, 2, 30, 1, max_runs=10, hai_method='tree')
+    assert list(pooled) == list(adaptive)
+
+
+def test_grid_sweep_reuses_hierarchies():
+    print("Testing the min_samples x min_cluster_size grid sweep...")
+    rng = np.random.default_rng(25)
+    df = pd.DataFrame(np.vstack([rng.normal(0, 1, (70, 2)), rng.normal(6, 1, (50, 2)), rng.normal((0, 8), 0.5, (12, 2))]))
+
+    results = run_grid_batch_clustering(df, [3, 6], [5, 15, 40], n_workers=1)
+    print(f"Grid keys: {list(results)}")
+    assert list(results) == ['3x5', '3x15', '3x40', '6x5', '6x15', '6x40']
+    # One hierarchy per min_samples, shared by its cells
+    assert results['3x5']['linkage_z'] is results['3x40']['linkage_z']
+
+    expected = run_clustering(df, 15, min_samples=6, hierarchy='dense', lean=True)
+    assert np.array_equal(results['6x15']['labels'], expected['labels'])
+    assert results['6x15']['n_clusters'] == expected['n_clusters']
+
+    analysis = analyze_batch_results(results)
+    hai = np.array(analysis['hai_matrix'])
+    print(f"HAI 3x5 vs 3x40: {hai[0, 2]:.4f}")
+    assert analysis['ordered_mpts'] == list(results)
+    assert hai.shape == (6, 6) and np.allclose(hai, hai.T)
+    # Same tree, different min_cluster_size: no longer identical hierarchies
+    assert hai[0, 2] < 1.0
+    assert all(key in results for key in analysis['medoids'].values())
+
+
+@mock.patch.object(datasets, 'DATASETS_ROOT', tempfile.mkdtemp(prefix='mustache-test-datasets-'))
+@mock.patch.object(sessions, 'SESSIONS_ROOT', tempfile.mkdtemp(prefix='mustache-test-sessions-'))
+def test_extend_route_reports_mpts_values():
+    print("Testing the range reported by /batch/extend...")
+    from app import create_app
+    rng = np.random.default_rng(24)
+    X = np.vstack([rng.normal(0, 1, (60, 2)), rng.normal(6, 1, (60, 2))])
+    csv = "x,y\n" + "\n".join(f"{a},{b}" for a, b in X)
+
+    client = create_app().test_client()
+    form = {'file': (io.BytesIO(csv.encode()), 'points.csv'), 'min_mpts': '2', 'max_mpts': '6', 'step': '2',
+            'projection': 'pca'}
+    response = client.post('/batch', data=form, content_type='multipart/form-data')
+    assert response.get_json()['range'] == {'min': 2, 'max': 6, 'step': 2}
+
+    # 2, 4, 6 merged with 3, 5, 7: no step describes the result
+    response = client.post('/batch/extend', data={'min_mpts': '3', 'max_mpts': '7', 'step': '2'})
+    extended = response.get_json()
+    print(f"Extended range: {extended['range']}")
+    assert extended['range'] == {'min': 2, 'max': 7, 'values': [2, 3, 4, 5, 6, 7]}
+    assert sorted(extended['results'], key=int) == ['2', '3', '4', '5', '6', '7']
+
+
+def test_shared_knn_batch_matches_single_runs():
+    print("Testing shared-kNN batch labels against single runs on tie-heavy data...")
+    rng = np.random.default_rng(24)
+    # Integer coordinates: tied neighbor distances and tied merges everywhere
+    df = pd.DataFrame(np.vstack([rng.integers(0, 6, (100, 2)), rng.integers(8, 14, (100, 2))]).astype(float))
+
+    results = run_batch_clustering(df, 2, 14, 3, n_workers=1)
+    for key, result in results.items():
+        # Own kNN query at k = mpts instead of a slice of the one at k = 14
+        single = run_clustering(df, int(key), min_samples=int(key), lean=True)
+        print(f"mpts={key}: {result['n_clusters']} clusters")
+        assert np.array_equal(result['linkage_z'], single['linkage_z'])
+        assert np.array_equal(result['labels'], single['labels'])
+        assert result['n_clusters'] == single['n_clusters']
+
+
+if __name__ == "__main__":
+    test_lean_batch_results()
+    test_parallel_batch_matches_sequential()
+    test_extend_batch_matches_full_run()
+    test_adaptive_sweep()
+    test_grid_sweep_reuses_hierarchies()
+    test_extend_route_reports_mpts_values()
+    test_shared_knn_batch_matches_single_runs()
@@ -0,0 +1,55 @@
+import io
+import numpy as np
+import sys
+import os
+import tempfile
+from unittest import mock
+
+sys.path.append(os.getcwd())
+from app.core import datasets
+
+
+@mock.patch.object(datasets, 'DATASETS_ROOT', tempfile.mkdtemp(prefix='mustache-test-datasets-'))
+def test_dataset_registry():
+    print("Testing content-addressed dataset registry...")
+    rng = np.random.default_rng(51)
+    X = rng.normal(0, 1, (50, 3))
+    csv = "x,y,z,name\n" + "\n".join(f"{a},{b},{c},p{i}" for i, (a, b, c) in enumerate(X))
+
+    dataset_id = datasets.register_dataset(io.BytesIO(csv.encode()), 'points.csv')
+    info = datasets.dataset_info(dataset_id)
+    print(f"Registered {dataset_id[:12]}: {info['n_samples']} x {info['n_features']}, columns {info['columns']}")
+    assert info['columns'] == ['x', 'y', 'z']
+    assert info['preview'][0]['name'] == 'p0'
+
+    df = datasets.load_dataset(dataset_id)
+    # Read-only view of the memory-mapped matrix, not a parsed copy
+    assert not df.to_numpy().flags.writeable
+    assert np.allclose(df.to_numpy(), X)
+
+    # Same bytes again: same id, and the file is not parsed a second time
+    parse = datasets.parse_numeric_csv
+    datasets.parse_numeric_csv = None
+    try:
+        assert datasets.register_dataset(io.BytesIO(csv.encode()), 'copy.csv') == dataset_id
+    finally:
+        datasets.parse_numeric_csv = parse
+
+    # No numeric column with or without the header row: rejected
+    headerless = "a,b\nc,d\n" + "\n".join(f"{a},{b}" for a, b in X[:, :2])
+    try:
+        datasets.register_dataset(io.BytesIO(headerless.encode()))
+        assert False, "files without numeric columns must be rejected"
+    except ValueError:
+        pass
+
+    for bad_id in ('../x', '0' * 64):
+        try:
+            datasets.load_dataset(bad_id)
+            assert False, "unknown dataset ids must be rejected"
+        except ValueError:
+            pass
+
+
+if __name__ == "__main__":
+    test_dataset_registry()
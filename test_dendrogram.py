@@ -0,0 +1,38 @@
+import numpy as np
+import sys
+import os
+
+sys.path.append(os.getcwd())
+from app.core.dendrogram import dendrogram_figure, subtree_linkage
+from scipy.cluster.hierarchy import linkage, is_valid_linkage, cophenet
+
+
+def test_dendrogram_level_of_detail():
+    print("Testing truncated dendrogram and subtree zoom...")
+    rng = np.random.default_rng(5)
+    data = np.vstack([rng.normal(0, 1, (300, 2)), rng.normal(6, 1, (300, 2))])
+    Z = linkage(data, method='single')
+    n = data.shape[0]
+
+    fig = dendrogram_figure(Z, max_leaves=50)
+    leaf_ids = list(fig.data[-1].customdata)
+    print(f"Displayed leaves: {len(leaf_ids)}")
+    assert len(leaf_ids) == 50
+
+    # Zoom into the largest collapsed leaf: its subtree is a valid linkage
+    # with the same merge heights as in the full hierarchy
+    node = max((i for i in leaf_ids if i >= n), key=lambda i: Z[i - n, 3])
+    sub_Z, ids = subtree_linkage(Z, node)
+    assert is_valid_linkage(sub_Z)
+    assert len(sub_Z) + 1 == Z[node - n, 3]
+    assert ids[-1] == node
+    assert np.allclose(np.sort(sub_Z[:, 2]), np.sort(Z[ids[len(sub_Z) + 1:] - n, 2]))
+    assert cophenet(sub_Z).max() == Z[node - n, 2]
+
+    zoomed = dendrogram_figure(Z, node=node, max_leaves=50)
+    assert len(zoomed.data[-1].customdata) <= 50
+    assert all(i < node for i in zoomed.data[-1].customdata)
+
+
+if __name__ == "__main__":
+    test_dendrogram_level_of_detail()
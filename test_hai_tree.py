@@ -0,0 +1,99 @@
+import numpy as np
+import sys
+import os
+
+sys.path.append(os.getcwd())
+from app.core import hai
+from app.core.hai import (compute_hai_matrix, compute_hai_matrix_sampled, build_distance_matrix, linkage_gap_profile,
+                         hierarchy_distance_rows, pair_cluster_sizes, run_meta_clustering, compute_medoids,
+                         build_cut_index, cut_at)
+from scipy.cluster.hierarchy import linkage, fcluster
+
+
+def test_tree_hai_matches_dense():
+    print("Testing tree-based HAI against dense distance matrices...")
+    rng = np.random.default_rng(4)
+    n = 150
+    # Rounded coordinates give tied merge heights, as on MR graphs
+    linkage_list = [linkage(np.round(rng.normal(0, 1, (n, 2)), 1), method='single') for _ in range(4)]
+
+    # Rows from the gap profile reproduce build_distance_matrix exactly
+    order, gap_sizes = linkage_gap_profile(linkage_list[0])
+    rows = hierarchy_distance_rows(order, gap_sizes, np.arange(n))
+    assert np.allclose(rows / n, build_distance_matrix(linkage_list[0], n))
+
+    dense = compute_hai_matrix(linkage_list, n, method='dense')
+    tree = compute_hai_matrix(linkage_list, n)
+    print(f"Max difference: {np.abs(dense - tree).max()}")
+    assert np.allclose(dense, tree, atol=1e-12)
+
+    # Tiny memory budget: one row per block, same result
+    blocked = hai.compute_hai_matrix_tree(linkage_list, n, memory_budget=1)
+    assert np.allclose(blocked, tree, atol=1e-12)
+
+    # Process pool over chunks of points (forced on small data): same sums
+    min_samples = hai.HAI_PARALLEL_MIN_SAMPLES
+    hai.HAI_PARALLEL_MIN_SAMPLES = 0
+    try:
+        parallel = hai.compute_hai_matrix_tree(linkage_list, n, n_workers=2)
+    finally:
+        hai.HAI_PARALLEL_MIN_SAMPLES = min_samples
+    assert np.array_equal(parallel, tree)
+
+
+def test_sampled_hai_within_interval():
+    print("Testing sampled HAI estimate and confidence interval...")
+    rng = np.random.default_rng(8)
+    n = 300
+    linkage_list = [linkage(rng.normal(0, 1, (n, 2)), method='single') for _ in range(3)]
+
+    # Range-max queries give the same cluster sizes as the full rows
+    order, gap_sizes = linkage_gap_profile(linkage_list[0])
+    p = rng.integers(0, n, 500)
+    q = rng.integers(0, n, 500)
+    rows = hierarchy_distance_rows(order, gap_sizes, np.arange(n))
+    assert (pair_cluster_sizes(order, gap_sizes, p, q) == rows[p, q]).all()
+
+    exact = compute_hai_matrix(linkage_list, n)
+    estimate, margin = compute_hai_matrix_sampled(linkage_list, n, n_pairs=50000)
+    print(f"Max error: {np.abs(exact - estimate).max():.5f}, max margin: {margin.max():.5f}")
+    assert np.allclose(np.diag(estimate), 1.0)
+    assert (np.abs(exact - estimate) <= 2 * margin + 1e-12).all()
+
+
+def test_cut_index_matches_fcluster():
+    print("Testing precomputed meta-dendrogram cuts...")
+    rng = np.random.default_rng(12)
+    m = 30
+    # Rounded similarities give tied merge heights
+    noise = rng.uniform(0.8, 1.0, (m, m))
+    hai_matrix = np.round((noise + noise.T) / 2, 2)
+    np.fill_diagonal(hai_matrix, 1.0)
+    _, meta_linkage = run_meta_clustering(hai_matrix.copy())
+
+    heights, cut_labels, cut_medoids = build_cut_index(meta_linkage, hai_matrix)
+    print(f"{len(heights)} distinct cuts for {m} hierarchies")
+    Z = np.asarray(meta_linkage)
+    for threshold in np.concatenate([heights, rng.uniform(-0.1, 0.3, 100)]):
+        labels, medoids = cut_at(heights, cut_labels, cut_medoids, threshold)
+        expected = fcluster(Z, t=threshold, criterion='distance')
+        assert np.array_equal(labels, expected)
+        assert medoids == compute_medoids(hai_matrix, expected)
+
+    # Grid-sweep sized: medoids are updated merge by merge, not recomputed per height
+    m = 400
+    noise = rng.uniform(0.5, 1.0, (m, m))
+    hai_matrix = np.round((noise + noise.T) / 2, 3)
+    np.fill_diagonal(hai_matrix, 1.0)
+    _, meta_linkage = run_meta_clustering(hai_matrix.copy())
+    heights, cut_labels, cut_medoids = build_cut_index(meta_linkage, hai_matrix)
+    Z = np.asarray(meta_linkage)
+    for threshold in rng.choice(heights, 20):
+        labels, medoids = cut_at(heights, cut_labels, cut_medoids, threshold)
+        assert medoids == compute_medoids(hai_matrix, fcluster(Z, t=threshold, criterion='distance'))
+
+
+if __name__ == "__main__":
+    test_tree_hai_matches_dense()
+    test_sampled_hai_within_interval()
+    test_cut_index_matches_fcluster()
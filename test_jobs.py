@@ -0,0 +1,155 @@
+import io
+import numpy as np
+import sys
+import os
+import tempfile
+import time
+from unittest import mock
+
+sys.path.append(os.getcwd())
+from app.core import datasets, jobs, sessions
+from app.core.batch import run_batch_clustering
+
+
+def wait_for(job_id, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        progress = jobs.job_status(job_id)
+        if progress['status'] in ('done', 'cancelled', 'failed'):
+            return progress
+        time.sleep(0.1)
+    raise AssertionError(f"Job {job_id} did not finish")
+
+
+@mock.patch.object(jobs, 'JOBS_ROOT', tempfile.mkdtemp(prefix='mustache-test-jobs-'))
+@mock.patch.object(datasets, 'DATASETS_ROOT', tempfile.mkdtemp(prefix='mustache-test-datasets-'))
+def test_batch_job_lifecycle():
+    print("Testing background batch jobs...")
+    rng = np.random.default_rng(31)
+    X = np.vstack([rng.normal(0, 1, (80, 2)), rng.normal(6, 1, (80, 2))])
+    csv = "x,y\n" + "\n".join(f"{a},{b}" for a, b in X)
+    # Jobs read the registered dataset; they don't keep a copy of the data
+    dataset_id = datasets.register_dataset(io.BytesIO(csv.encode()), 'points.csv')
+    df = datasets.load_dataset(dataset_id)
+
+    job_id = jobs.submit_batch_job(dataset_id, 2, 6, 1)
+    progress = wait_for(job_id)
+    print(f"Job {job_id}: {progress['status']}, completed {progress['completed']}")
+    assert progress['status'] == 'done'
+    assert progress['completed'] == [2, 3, 4, 5, 6]
+
+    stored = jobs.load_job_results(job_id)
+    direct = run_batch_clustering(df, 2, 6, 1)
+    assert list(stored) == list(direct)
+    for key in direct:
+        assert np.array_equal(stored[key]['labels'], direct[key]['labels'])
+        assert np.array_equal(stored[key]['linkage_z'], direct[key]['linkage_z'])
+    assert list(jobs.load_job_results(job_id, exclude={'2', '3'})) == ['4', '5', '6']
+
+    job_df, params, analysis = jobs.load_job(job_id)
+    assert params['range'] == [2, 6, 1] and params['dataset_id'] == dataset_id
+    assert not os.path.exists(os.path.join(jobs.JOBS_ROOT, job_id, 'data.npy'))
+    assert np.array_equal(job_df.to_numpy(), df.to_numpy())
+    assert analysis['ordered_mpts'] == [2, 3, 4, 5, 6]
+
+    # Following a job hands out every hierarchy once, then the final state
+    job_id = jobs.submit_batch_job(dataset_id, 2, 8, 2)
+    followed = list(jobs.follow_job(job_id, poll_interval=0.05))
+    streamed = [key for _, new_results in followed for key in new_results]
+    print(f"Followed job in {len(followed)} updates: {streamed}")
+    assert sorted(streamed, key=int) == ['2', '4', '6', '8']
+    assert followed[-1][0]['status'] == 'done'
+
+    # Cancelled before its next mpts finishes: stops early, the .npz of every
+    # hierarchy finished so far is kept
+    job_id = jobs.submit_batch_job(dataset_id, 2, 60, 1)
+    jobs.cancel_job(job_id)
+    progress = wait_for(job_id)
+    print(f"Cancelled job completed {len(progress['completed'])} of {len(progress['mpts'])} mpts")
+    assert progress['status'] == 'cancelled'
+    assert len(progress['completed']) < len(progress['mpts'])
+
+    # A job whose owning process stopped beating is reported as failed
+    job_id = jobs.submit_batch_job(dataset_id, 2, 4, 1)
+    progress = wait_for(job_id)
+    assert progress['pid'] == os.getpid() and progress['heartbeat'] >= progress['created']
+    path = os.path.join(jobs.JOBS_ROOT, job_id, 'progress.json')
+    jobs.write_json(path, dict(progress, status='running', heartbeat=time.time() - jobs.JOB_HEARTBEAT_TIMEOUT - 1))
+    progress = jobs.job_status(job_id)
+    print(f"Stale job: {progress['status']} ({progress['error']})")
+    assert progress['status'] == 'failed'
+    assert list(jobs.follow_job(job_id))[-1][0]['status'] == 'failed'
+
+    # Following stops after max_seconds even if the job is still running
+    jobs.write_json(path, dict(progress, status='running', heartbeat=time.time() + 3600))
+    started = time.time()
+    followed = list(jobs.follow_job(job_id, poll_interval=0.05, max_seconds=0.2))
+    assert time.time() - started < 5
+    assert followed[-1][0]['status'] == 'running'
+
+    # The stale check re-reads progress under the job lock: a heartbeat written by
+    # the owner while the check waits for the lock keeps the job alive
+    import threading
+    jobs.write_json(path, dict(progress, status='running', heartbeat=time.time() - jobs.JOB_HEARTBEAT_TIMEOUT - 1))
+    checked = []
+    with jobs._progress_lock(os.path.dirname(path)):
+        checker = threading.Thread(target=lambda: checked.append(jobs.job_status(job_id)))
+        checker.start()
+        time.sleep(0.2)
+        jobs.write_json(path, dict(progress, status='running', heartbeat=time.time()))
+    checker.join(timeout=5)
+    print(f"Job beaten during the stale check: {checked[0]['status']}")
+    assert checked[0]['status'] == 'running'
+
+    try:
+        jobs.job_status('../etc')
+        assert False, "invalid job ids must be rejected"
+    except ValueError:
+        pass
+
+
+@mock.patch.object(jobs, 'JOBS_ROOT', tempfile.mkdtemp(prefix='mustache-test-jobs-'))
+@mock.patch.object(datasets, 'DATASETS_ROOT', tempfile.mkdtemp(prefix='mustache-test-datasets-'))
+@mock.patch.object(sessions, 'SESSIONS_ROOT', tempfile.mkdtemp(prefix='mustache-test-sessions-'))
+def test_finished_job_becomes_active_batch_once():
+    print("Testing repeated polls of a finished job...")
+    from app import create_app
+    rng = np.random.default_rng(32)
+    X = np.vstack([rng.normal(0, 1, (60, 2)), rng.normal(6, 1, (60, 2))])
+    csv = "x,y\n" + "\n".join(f"{a},{b}" for a, b in X)
+
+    client = create_app().test_client()
+    submitted = client.post('/jobs/batch', data={'file': (io.BytesIO(csv.encode()), 'points.csv'), 'min_mpts': '2',
+                                                 'max_mpts': '6', 'projection': 'pca'},
+                            content_type='multipart/form-data').get_json()
+    job_id = submitted['job_id']
+    wait_for(job_id)
+
+    def poll():
+        response = client.get(f'/jobs/{job_id}/results')
+        assert response.status_code == 200, response.get_json()
+        with client.session_transaction() as session:
+            state = sessions._read_state(os.path.join(sessions.SESSIONS_ROOT, session['sid']))
+        return response.get_json(), state['batch']
+
+    first, version = poll()
+    second, same_version = poll()
+    print(f"Batch version after the first poll: {version}, after the second: {same_version}")
+    # The second poll is served from the stored batch without saving it again
+    assert version is not None and same_version == version
+    assert second['results'] == first['results']
+    assert second['analysis']['medoids'] == first['analysis']['medoids']
+    assert client.post('/cut_dendrogram', json={'y_threshold': 0.0}).status_code == 200
+
+    # Another batch replaces it; the next poll makes the job the active batch again
+    client.post('/batch', data={'dataset_id': submitted['dataset_id'], 'min_mpts': '3', 'max_mpts': '4',
+                                'projection': 'pca'}, content_type='multipart/form-data')
+    _, replaced = poll()
+    assert replaced != version
+    with client.session_transaction() as session:
+        assert sessions.load_batch(session['sid'])['params']['job_id'] == job_id
+
+
+if __name__ == "__main__":
+    test_batch_job_lifecycle()
+    test_finished_job_becomes_active_batch_once()
@@ -0,0 +1,323 @@
+import numpy as np
+import sys
+import os
+
+sys.path.append(os.getcwd())
+from app.core.clustering import (compute_mutual_reachability, compute_mutual_reachability_condensed,
+                                 compute_core_distances, select_core_distances, run_clustering,
+                                 extract_flat_clustering)
+from app.core.transport import decode_array
+from app.core.coresg import build_core_graph, core_graph_mst
+from app.core.batch import run_batch_clustering
+from sklearn.metrics import adjusted_rand_score
+from app.core.mst import (mutual_reachability_mst, condensed_mst, mst_to_linkage, boruvka_mutual_reachability_mst,
+                          canonical_linkage, linkage_to_labels)
+from scipy.cluster.hierarchy import linkage, cophenet, is_valid_linkage
+from scipy.spatial.distance import squareform, pdist
+
+
+def hdbscan_tree_to_linkage(single_linkage_tree):
+    # sklearn's single linkage tree (left_node, right_node, value, cluster_size) as a
+    # linkage matrix with the canonical tie order, comparable with run_clustering's
+    tree = np.asarray(single_linkage_tree)
+    return canonical_linkage(np.column_stack([tree['left_node'], tree['right_node'], tree['value'],
+                                              tree['cluster_size']]).astype(np.float64))
+
+
+def test_mst_matches_dense_linkage():
+    print("Testing MST hierarchy engine against dense MR + scipy linkage...")
+    rng = np.random.default_rng(7)
+    data = np.vstack([rng.normal(0, 1, (80, 2)), rng.normal(6, 1, (80, 2))])
+
+    for min_samples in [2, 5, 10]:
+        core = select_core_distances(compute_core_distances(data, min_samples), min_samples)
+        Z = mst_to_linkage(mutual_reachability_mst(data, core), data.shape[0])
+
+        mr = compute_mutual_reachability(data, min_samples)
+        Z_dense = linkage(squareform(mr, checks=False), method='single')
+
+        print(f"min_samples={min_samples}: valid={is_valid_linkage(Z)}")
+        assert is_valid_linkage(Z)
+        # Merge heights and cophenetic distances do not depend on tie order
+        assert np.allclose(Z[:, 2], Z_dense[:, 2])
+        assert np.allclose(cophenet(Z), cophenet(Z_dense))
+
+
+def test_blockwise_condensed_mutual_reachability():
+    print("Testing block-wise condensed MR builder...")
+    rng = np.random.default_rng(9)
+    data = rng.normal(0, 1, (150, 3))
+    n = data.shape[0]
+    core = select_core_distances(compute_core_distances(data, 5), 5)
+
+    raw = squareform(pdist(data))
+    expected = np.maximum(np.maximum(raw, core[:, None]), core[None, :])
+    np.fill_diagonal(expected, 0)
+
+    # A tiny budget forces one-row blocks
+    for budget in [1, 10000, 10 ** 9]:
+        condensed = compute_mutual_reachability_condensed(data, 5, core_dist=core, memory_budget=budget)
+        assert np.array_equal(squareform(condensed), expected)
+
+    condensed32 = compute_mutual_reachability_condensed(data, 5, core_dist=core, dtype=np.float32, memory_budget=10000)
+    print(f"float32 vector: {condensed32.dtype}, {condensed32.nbytes} bytes")
+    assert condensed32.dtype == np.float32
+
+    Z = mst_to_linkage(condensed_mst(condensed32, n), n)
+    Z_dense = linkage(squareform(expected, checks=False), method='single')
+    assert is_valid_linkage(Z)
+    assert np.allclose(cophenet(Z), cophenet(Z_dense), rtol=1e-6)
+
+    # Rechecked against the data, the float32 vector gives the exact float64 tree
+    Z_exact = mst_to_linkage(condensed_mst(condensed32, n, data, core), n)
+    assert np.array_equal(Z_exact, canonical_linkage(Z_dense))
+
+
+def test_float32_backend_matches_on_decimal_data():
+    print("Testing the float32 backend on decimal data...")
+    import pandas as pd
+    for seed in range(5):
+        rng = np.random.default_rng(seed)
+        # Multiples of 0.1 are not exact in binary: float32 rounding merges and
+        # splits ties that float64 keeps apart
+        df = pd.DataFrame(rng.integers(0, 40, (200, 2)) * 0.1)
+        for mpts in [3, 5, 8]:
+            expected = run_clustering(df, mpts, mpts, hierarchy='mst', lean=True)
+            result = run_clustering(df, mpts, mpts, hierarchy='dense-float32', lean=True)
+            assert result['linkage_z'].dtype == np.float64
+            assert np.array_equal(result['linkage_z'], expected['linkage_z']), (seed, mpts)
+            assert np.array_equal(result['labels'], expected['labels']), (seed, mpts)
+
+
+def test_flat_clustering_from_stored_tree():
+    print("Testing min_cluster_size re-extraction from a stored hierarchy...")
+    import pandas as pd
+    rng = np.random.default_rng(11)
+    df = pd.DataFrame(np.vstack([rng.normal(0, 1, (70, 2)), rng.normal(6, 1, (50, 2)), rng.normal((0, 8), 0.5, (15, 2))]))
+
+    Z = run_clustering(df, 5, min_samples=5, lean=True)['linkage_z']
+    for min_cluster_size in [2, 10, 20, 60]:
+        expected = run_clustering(df, min_cluster_size, min_samples=5, lean=True)
+        tuned = extract_flat_clustering(Z, min_cluster_size, encoding='binary')
+        print(f"min_cluster_size={min_cluster_size}: {tuned['n_clusters']} clusters")
+        # Same labels, numbered the same way as a fresh run
+        assert np.array_equal(decode_array(tuned['labels']), expected['labels'])
+        assert np.allclose(decode_array(tuned['probabilities']), expected['probabilities'])
+        assert tuned['n_clusters'] == expected['n_clusters']
+        assert tuned['noise_points'] == expected['noise_points']
+
+    try:
+        extract_flat_clustering(Z, 1)
+        assert False, "min_cluster_size=1 must be rejected"
+    except ValueError:
+        pass
+
+
+def test_core_graph_contains_every_mst():
+    print("Testing the native CORE-SG engine against Prim's MST per mpts...")
+    rng = np.random.default_rng(13)
+    data = np.vstack([rng.normal(0, 1, (90, 3)), rng.normal(5, 1, (90, 3))])
+    data[1] = data[0]  # duplicate points give zero MR distances at mpts=1
+
+    for metric in ['euclidean', 'manhattan']:
+        graph = build_core_graph(data, 12, metric)
+        print(f"{metric}: {len(graph['sources'])} core graph edges for {len(data)} points")
+        for min_samples in [1, 3, 7, 12]:
+            core = select_core_distances(graph['knn_distances'], min_samples)
+            Z = mst_to_linkage(core_graph_mst(graph, core), len(data))
+            Z_prim = mst_to_linkage(mutual_reachability_mst(data, core, metric), len(data))
+            assert is_valid_linkage(Z)
+            assert np.allclose(Z[:, 2], Z_prim[:, 2])
+            assert np.allclose(cophenet(Z), cophenet(Z_prim))
+
+    import pandas as pd
+    df = pd.DataFrame(data)
+    core_sg = run_batch_clustering(df, 2, 12, 5, algorithm='core-sg', n_workers=1)
+    exact = run_batch_clustering(df, 2, 12, 5, hierarchy='dense', n_workers=1)
+    assert list(core_sg) == list(exact)
+    for key in exact:
+        assert np.allclose(cophenet(core_sg[key]['linkage_z']), cophenet(exact[key]['linkage_z']))
+        assert core_sg[key]['n_clusters'] == exact[key]['n_clusters']
+
+
+def test_sparse_boruvka_matches_prim():
+    print("Testing the sparse (kNN-seeded Boruvka) hierarchy backend...")
+    rng = np.random.default_rng(17)
+    # Gaussian blob, heavy-tailed outliers and a grid with many tied distances
+    data = np.vstack([rng.normal(0, 1, (100, 2)), rng.standard_cauchy((60, 2)),
+                      rng.integers(0, 4, (60, 2)).astype(float)])
+
+    for metric in ['euclidean', 'chebyshev']:
+        knn_distances, knn_indices = compute_core_distances(data, 16, metric, return_indices=True)
+        for min_samples in [1, 4, 10]:
+            core = select_core_distances(knn_distances, min_samples)
+            Z_prim = mst_to_linkage(mutual_reachability_mst(data, core, metric), len(data))
+            for seeds in [(knn_distances, knn_indices), (None, None)]:
+                Z = mst_to_linkage(boruvka_mutual_reachability_mst(data, core, metric, *seeds), len(data))
+                assert is_valid_linkage(Z)
+                assert np.allclose(Z[:, 2], Z_prim[:, 2])
+                assert np.allclose(cophenet(Z), cophenet(Z_prim))
+
+    import pandas as pd
+    df = pd.DataFrame(data)
+    sparse = run_clustering(df, 8, min_samples=4, hierarchy='sparse', lean=True)
+    dense = run_clustering(df, 8, min_samples=4, hierarchy='dense', lean=True)
+    print(f"sparse: {sparse['n_clusters']} clusters, dense: {dense['n_clusters']} clusters")
+    assert np.allclose(cophenet(sparse['linkage_z']), cophenet(dense['linkage_z']))
+    assert adjusted_rand_score(sparse['labels'], dense['labels']) == 1.0
+
+
+def test_sparse_batch_shares_one_knn_query():
+    print("Testing the shared kNN graph of sparse batches...")
+    import pandas as pd
+    from app.core import batch, clustering
+    rng = np.random.default_rng(19)
+    df = pd.DataFrame(np.vstack([rng.normal(0, 1, (120, 2)), rng.normal(6, 1, (120, 2))]))
+    expected = {mpts: run_clustering(df, mpts, min_samples=mpts, hierarchy='sparse', lean=True) for mpts in [2, 5, 20]}
+
+    queries = []
+    compute = clustering.compute_core_distances
+
+    def counting_compute(data, max_k, metric='euclidean', return_indices=False):
+        queries.append(max_k)
+        return compute(data, max_k, metric, return_indices=return_indices)
+
+    batch.compute_core_distances = clustering.compute_core_distances = counting_compute
+    try:
+        results = run_batch_clustering(df, 2, 20, 1, hierarchy='sparse', n_workers=1, mpts_values=[2, 5, 20])
+    finally:
+        batch.compute_core_distances = clustering.compute_core_distances = compute
+    print(f"kNN queries: {queries}")
+    assert queries == [20]
+
+    # Same through the process pool, where workers memory-map the shared indices
+    parallel_min_samples = batch.BATCH_PARALLEL_MIN_SAMPLES
+    batch.BATCH_PARALLEL_MIN_SAMPLES = 0
+    try:
+        pooled = run_batch_clustering(df, 2, 20, 1, hierarchy='sparse', n_workers=2, mpts_values=[2, 5, 20])
+    finally:
+        batch.BATCH_PARALLEL_MIN_SAMPLES = parallel_min_samples
+
+    for mpts, result in expected.items():
+        for shared in (results, pooled):
+            assert np.allclose(shared[str(mpts)]['linkage_z'][:, 2], result['linkage_z'][:, 2])
+            assert np.array_equal(shared[str(mpts)]['labels'], result['labels'])
+
+
+def test_tied_merges_are_canonical():
+    print("Testing the canonical order of tied merges...")
+    rng = np.random.default_rng(23)
+    # Integer coordinates: most mutual reachability distances are tied
+    data = rng.integers(0, 10, (200, 2)).astype(float)
+    core = select_core_distances(compute_core_distances(data, 6), 6)
+    mst = mutual_reachability_mst(data, core)
+    Z = mst_to_linkage(mst, len(data))
+
+    # Neither the order of the edges nor the MST picked among equal-weight ones matters
+    for seed in range(3):
+        shuffled = mst[np.random.default_rng(seed).permutation(len(mst))]
+        assert np.array_equal(mst_to_linkage(shuffled, len(data)), Z)
+    assert np.array_equal(mst_to_linkage(boruvka_mutual_reachability_mst(data, core), len(data)), Z)
+
+
+def test_labels_match_sklearn_on_tied_data():
+    print("Testing labels of every backend against sklearn's HDBSCAN on tie-heavy data...")
+    import pandas as pd
+    from sklearn.cluster import HDBSCAN
+    rng = np.random.default_rng(29)
+    datasets = {
+        'integer grid': rng.integers(0, 12, (320, 2)).astype(float),
+        'integer blobs': np.vstack([rng.integers(0, 6, (150, 2)), rng.integers(10, 16, (150, 2)),
+                                    rng.integers(0, 16, (30, 2))]).astype(float),
+        'gaussian blobs': np.vstack([rng.normal(0, 1, (150, 2)), rng.normal(5, 1, (150, 2)),
+                                     rng.uniform(-5, 10, (30, 2))]),
+    }
+
+    for name, data in datasets.items():
+        df = pd.DataFrame(data)
+        for mpts in [4, 8, 15]:
+            # sklearn orders tied merges with an unstable sort; under the canonical
+            # tie order its own hierarchy must give exactly the labels of every backend
+            clusterer = HDBSCAN(min_cluster_size=mpts, min_samples=mpts).fit(data)
+            expected, _ = linkage_to_labels(hdbscan_tree_to_linkage(clusterer._single_linkage_tree_), mpts)
+
+            runs = {hierarchy: run_clustering(df, mpts, mpts, hierarchy=hierarchy, lean=True)
+                    for hierarchy in ['mst', 'sparse', 'dense', 'dense-float32']}
+            runs['core-sg'] = run_clustering(df, mpts, mpts, algorithm='core-sg', lean=True)
+            runs['batch'] = run_batch_clustering(df, mpts, mpts, 1, n_workers=1)[str(mpts)]
+            print(f"{name}, mpts={mpts}: {expected.max() + 1} clusters "
+                  f"(raw sklearn: {clusterer.labels_.max() + 1})")
+            for backend, result in runs.items():
+                assert np.array_equal(result['labels'], expected), backend
+                assert result['n_clusters'] == expected.max() + 1, backend
+
+
+def test_drift_from_sklearn_on_wine():
+    print("Testing how far labels drift from sklearn's HDBSCAN on the wine dataset...")
+    import pandas as pd
+    from sklearn.cluster import HDBSCAN
+    from sklearn.datasets import load_wine
+    data = load_wine().data
+    df = pd.DataFrame(data)
+
+    # mpts: (min ARI, max cluster count difference, max noise count difference)
+    # against sklearn's raw labels; measured with scikit-learn 1.3.2 plus a margin
+    allowed = {3: (0.9, 1, 5), 4: (0.99, 0, 2), 5: (0.95, 1, 5), 8: (0.95, 1, 5), 10: (0.7, 1, 8),
+               15: (0.95, 1, 5)}
+    for mpts, (min_ari, max_clusters, max_noise) in allowed.items():
+        clusterer = HDBSCAN(min_cluster_size=mpts, min_samples=mpts).fit(data)
+        result = run_clustering(df, mpts, mpts, lean=True)
+        labels, raw = result['labels'], clusterer.labels_
+        ari = adjusted_rand_score(labels, raw)
+        print(f"mpts={mpts}: ARI {ari:.3f}, clusters {labels.max() + 1} vs {raw.max() + 1}, "
+              f"noise {(labels == -1).sum()} vs {(raw == -1).sum()}")
+        # Same hierarchy: only the order of tied merges differs
+        expected, _ = linkage_to_labels(hdbscan_tree_to_linkage(clusterer._single_linkage_tree_), mpts)
+        assert np.array_equal(labels, expected), mpts
+        assert ari >= min_ari, (mpts, ari)
+        assert abs(labels.max() - raw.max()) <= max_clusters, mpts
+        assert abs((labels == -1).sum() - (raw == -1).sum()) <= max_noise, mpts
+
+    # At mpts=20 the tie order decides whether the root splits at all: no clusters
+    # here, two for sklearn, and none for sklearn either once the rows are reversed
+    assert run_clustering(df, 20, 20, lean=True)['n_clusters'] == 0
+    assert HDBSCAN(min_cluster_size=20, min_samples=20).fit(data).labels_.max() + 1 == 2
+    assert HDBSCAN(min_cluster_size=20, min_samples=20).fit(data[::-1]).labels_.max() + 1 == 0
+
+
+def test_sklearn_private_tree_api():
+    print("Testing the private sklearn HDBSCAN helpers behind linkage_to_labels...")
+    from sklearn.cluster import HDBSCAN
+    try:
+        from sklearn.cluster._hdbscan._tree import tree_to_labels, HIERARCHY_dtype
+    except ImportError as e:
+        raise AssertionError("sklearn.cluster._hdbscan._tree moved: linkage_to_labels needs porting "
+                             "to this scikit-learn release") from e
+    assert HIERARCHY_dtype.names == ('left_node', 'right_node', 'value', 'cluster_size'), HIERARCHY_dtype.names
+
+    rng = np.random.default_rng(31)
+    data = np.vstack([rng.normal(0, 1, (80, 2)), rng.normal(5, 1, (60, 2)), rng.uniform(-4, 9, (20, 2))])
+    for options in [{}, {'cluster_selection_method': 'leaf'}, {'allow_single_cluster': True}]:
+        clusterer = HDBSCAN(min_cluster_size=7, min_samples=4, **options).fit(data)
+        tree = clusterer._single_linkage_tree_
+        # sklearn's own tree as is (no canonical reordering): the labels must be its own
+        Z = np.column_stack([tree['left_node'], tree['right_node'], tree['value'], tree['cluster_size']])
+        labels, probabilities = linkage_to_labels(Z, 7, **options)
+        print(f"{options or 'defaults'}: {labels.max() + 1} clusters")
+        assert np.array_equal(labels, clusterer.labels_), \
+            f"tree_to_labels arguments changed meaning ({options}): linkage_to_labels needs porting"
+        assert np.allclose(probabilities, clusterer.probabilities_)
+
+
+if __name__ == "__main__":
+    test_mst_matches_dense_linkage()
+    test_blockwise_condensed_mutual_reachability()
+    test_float32_backend_matches_on_decimal_data()
+    test_flat_clustering_from_stored_tree()
+    test_core_graph_contains_every_mst()
+    test_sparse_boruvka_matches_prim()
+    test_sparse_batch_shares_one_knn_query()
+    test_tied_merges_are_canonical()
+    test_labels_match_sklearn_on_tied_data()
+    test_drift_from_sklearn_on_wine()
+    test_sklearn_private_tree_api()
@@ -0,0 +1,107 @@
+import numpy as np
+import pandas as pd
+import sys
+import os
+
+sys.path.append(os.getcwd())
+from app.core import projection
+from app.core.batch import run_batch_clustering, render_batch_figures
+from app.core.clustering import run_clustering
+
+
+def test_projection_cache():
+    print("Testing the projection cache...")
+    rng = np.random.default_rng(71)
+    df = pd.DataFrame(np.vstack([rng.normal(0, 1, (60, 3)), rng.normal(5, 1, (60, 3))]))
+    data = df.to_numpy()
+
+    calls = []
+    compute = projection.compute_projection
+
+    def counting_compute(data, method='auto', random_state=42):
+        calls.append((method, random_state))
+        return compute(data, method=method, random_state=random_state)
+
+    projection.compute_projection = counting_compute
+    try:
+        projection._projection_cache.clear()
+        run_clustering(df, 5, projection_method='pca')
+        run_clustering(df, 8, projection_method='pca')
+        results = run_batch_clustering(df, 2, 4, 1, projection_method='pca')
+        render_batch_figures(df, results['3'], projection_method='pca')
+        print(f"Projections computed: {calls}")
+        assert calls == [('pca', 42)]
+
+        # Another method or seed is another entry
+        projection.get_projection(data, method='svd')
+        projection.get_projection(data, method='pca', random_state=7)
+        assert calls == [('pca', 42), ('svd', 42), ('pca', 7)]
+    finally:
+        projection.compute_projection = compute
+
+    # Cached arrays are shared between callers, so they can't be modified in place
+    cached = projection.get_projection(data, method='pca')
+    assert cached is projection.get_projection(data, method='pca')
+    try:
+        cached[0, 0] = 1.0
+        assert False, "cached projections must be read-only"
+    except ValueError:
+        pass
+
+
+def test_auto_projection_thresholds():
+    print("Testing the 'auto' projection thresholds...")
+    resolve = projection.resolve_projection_method
+    assert resolve(10) == 'tsne'
+    assert resolve(projection.TSNE_MAX_SAMPLES) == 'tsne'
+    assert resolve(projection.TSNE_MAX_SAMPLES + 1) == 'landmark-tsne'
+    assert resolve(projection.LANDMARK_MAX_SAMPLES) == 'landmark-tsne'
+    assert resolve(projection.LANDMARK_MAX_SAMPLES + 1) == 'svd'
+    # Explicit methods are kept whatever the size
+    assert resolve(10, 'svd') == 'svd'
+    assert resolve(projection.LANDMARK_MAX_SAMPLES + 1, 'pca') == 'pca'
+    try:
+        resolve(10, 'umap')
+        assert False, "unknown methods must be rejected"
+    except ValueError:
+        pass
+
+
+def test_landmark_tsne_projection():
+    print("Testing landmark t-SNE...")
+    rng = np.random.default_rng(72)
+    data = np.vstack([rng.normal(0, 1, (200, 4)), rng.normal(8, 1, (200, 4))])
+    n_landmarks = 80
+
+    embedding = projection.landmark_tsne_projection(data, random_state=3, n_landmarks=n_landmarks)
+    assert embedding.shape == (len(data), 2)
+    assert np.all(np.isfinite(embedding))
+
+    # Same landmark draw as the projection
+    landmarks = np.sort(np.random.default_rng(3).choice(len(data), size=n_landmarks, replace=False))
+    others = np.setdiff1d(np.arange(len(data)), landmarks)
+
+    # Every other point lands inside the box spanned by its nearest landmarks
+    dist = np.linalg.norm(data[others][:, None, :] - data[landmarks][None, :, :], axis=2)
+    nearest = np.argsort(dist, axis=1)[:, :projection.LANDMARK_NEIGHBORS]
+    neighborhood = embedding[landmarks][nearest]
+    assert np.all(embedding[others] >= neighborhood.min(axis=1) - 1e-9)
+    assert np.all(embedding[others] <= neighborhood.max(axis=1) + 1e-9)
+
+    # The two blobs stay apart: each point is closer to its own blob's centroid
+    blob = np.arange(len(data)) >= 200
+    centroids = np.array([embedding[~blob].mean(axis=0), embedding[blob].mean(axis=0)])
+    closest = np.linalg.norm(embedding[:, None, :] - centroids[None, :, :], axis=2).argmin(axis=1)
+    print(f"Points closest to their own blob: {(closest == blob).mean():.3f}")
+    assert np.all(closest == blob)
+
+    # Up to n_landmarks points it is plain t-SNE
+    small = data[:60]
+    assert np.allclose(projection.landmark_tsne_projection(small, random_state=3, n_landmarks=n_landmarks),
+                       projection.tsne_projection(small, random_state=3))
+
+
+if __name__ == "__main__":
+    test_projection_cache()
+    test_auto_projection_thresholds()
+    test_landmark_tsne_projection()
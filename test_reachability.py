@@ -0,0 +1,32 @@
+import numpy as np
+import sys
+import os
+
+sys.path.append(os.getcwd())
+from app.core.reachability import reachability_from_linkage
+from scipy.cluster.hierarchy import linkage, cophenet, leaves_list
+from scipy.spatial.distance import squareform
+
+
+def test_reachability_from_linkage():
+    print("Testing reachability ordering derived from a linkage matrix...")
+    rng = np.random.default_rng(3)
+    data = np.vstack([rng.normal(0, 1, (60, 2)), rng.normal(8, 1, (60, 2))])
+    Z = linkage(data, method='single')
+
+    ordering, reachability = reachability_from_linkage(Z)
+    print(f"First reachabilities: {reachability[:4]}")
+
+    assert (ordering == leaves_list(Z)).all()
+    assert np.isinf(reachability[0])
+
+    # Each point's reachability is the cophenetic distance to its predecessor
+    coph = squareform(cophenet(Z))
+    assert np.allclose(reachability[1:], coph[ordering[:-1], ordering[1:]])
+
+    # Exactly one gap (between the two blobs) reaches the root merge height
+    assert np.sum(reachability[1:] == Z[-1, 2]) == 1
+
+
+if __name__ == "__main__":
+    test_reachability_from_linkage()
@@ -0,0 +1,121 @@
+import io
+import numpy as np
+import sys
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
+
+sys.path.append(os.getcwd())
+from app.core import datasets, sessions
+from app.core.batch import run_batch_clustering, analyze_batch_results
+
+
+def _register(seed):
+    rng = np.random.default_rng(seed)
+    X = np.vstack([rng.normal(0, 1, (60, 2)), rng.normal(5, 1, (60, 2))])
+    csv = "x,y\n" + "\n".join(f"{a},{b}" for a, b in X)
+    dataset_id = datasets.register_dataset(io.BytesIO(csv.encode()), 'points.csv')
+    return dataset_id, datasets.load_dataset(dataset_id)
+
+
+@mock.patch.object(datasets, 'DATASETS_ROOT', tempfile.mkdtemp(prefix='mustache-test-datasets-'))
+@mock.patch.object(sessions, 'SESSIONS_ROOT', tempfile.mkdtemp(prefix='mustache-test-sessions-'))
+def test_session_store_roundtrip_and_eviction():
+    print("Testing on-disk session store...")
+    dataset_id, df = _register(41)
+    results = run_batch_clustering(df, 2, 6, 2)
+    analysis = analyze_batch_results(results)
+    params = {'metric': 'euclidean', 'algorithm': 'hdbscan', 'projection_method': 'pca',
+              'hierarchy': 'mst', 'hai_method': 'auto'}
+
+    first = sessions.new_session_id()
+    sessions.save_batch(first, dataset_id, results, analysis, params)
+    sessions.save_single_run(first, results['2']['linkage_z'], {'min_samples': 2, 'min_cluster_size': 2})
+
+    batch = sessions.load_batch(first)
+    assert isinstance(batch['analysis']['hai_matrix'], np.memmap)
+    assert np.allclose(batch['analysis']['hai_matrix'], analysis['hai_matrix'])
+    assert np.allclose(batch['meta_linkage'], analysis['meta_linkage'])
+    assert batch['analysis']['ordered_mpts'] == [2, 4, 6]
+    # The data comes from the dataset registry, not from a copy in the session
+    assert batch['dataset_id'] == dataset_id
+    assert np.array_equal(batch['df'].to_numpy(), df.to_numpy())
+    version = sessions._read_state(os.path.join(sessions.SESSIONS_ROOT, first))['batch']
+    assert not os.path.exists(os.path.join(sessions.SESSIONS_ROOT, first, version, 'data.npy'))
+    for key in results:
+        assert np.array_equal(batch['results'][key]['labels'], results[key]['labels'])
+        assert batch['results'][key]['n_clusters'] == results[key]['n_clusters']
+    assert np.array_equal(sessions.load_linkage(first, '4'), results['4']['linkage_z'])
+    assert np.array_equal(sessions.load_linkage(first, 'single'), results['2']['linkage_z'])
+    single = sessions.load_single_run(first)
+    assert single['params']['min_samples'] == 2 and single['true_labels'] is None
+    assert sessions.load_linkage(first, '../4') is None
+
+    # Sessions are independent
+    second = sessions.new_session_id()
+    assert sessions.load_batch(second) is None
+
+    # Saving again replaces the old version directory
+    sessions.save_batch(first, dataset_id, results, analysis, params)
+    print(f"Session files: {sorted(os.listdir(os.path.join(sessions.SESSIONS_ROOT, first)))}")
+    assert len([name for name in os.listdir(os.path.join(sessions.SESSIONS_ROOT, first)) if name.startswith('batch-')]) == 1
+
+    # Over the size cap the least recently used session goes first
+    sessions.save_single_run(second, results['2']['linkage_z'], {'min_samples': 2, 'min_cluster_size': 2})
+    time.sleep(0.05)
+    sessions.load_batch(first)
+    sessions.evict_sessions(max_bytes=1, keep=first)
+    assert sessions.load_batch(first) is not None
+    assert sessions.load_linkage(second, 'single') is None
+
+
+@mock.patch.object(datasets, 'DATASETS_ROOT', tempfile.mkdtemp(prefix='mustache-test-datasets-'))
+@mock.patch.object(sessions, 'SESSIONS_ROOT', tempfile.mkdtemp(prefix='mustache-test-sessions-'))
+def test_concurrent_saves_and_loads():
+    print("Testing concurrent saves and loads of one session...")
+    dataset_id, df = _register(42)
+    results = run_batch_clustering(df, 2, 4, 1)
+    analysis = analyze_batch_results(results)
+    params = {'metric': 'euclidean', 'algorithm': 'hdbscan', 'projection_method': 'pca',
+              'hierarchy': 'mst', 'hai_method': 'auto'}
+    sid = sessions.new_session_id()
+    sessions.save_batch(sid, dataset_id, results, analysis, params)
+
+    errors = []
+
+    def save():
+        try:
+            for _ in range(10):
+                sessions.save_batch(sid, dataset_id, results, analysis, params)
+                sessions.save_single_run(sid, results['2']['linkage_z'], {'min_samples': 2})
+        except Exception as e:
+            errors.append(e)
+
+    def load():
+        try:
+            for _ in range(40):
+                batch = sessions.load_batch(sid)
+                assert batch is not None and np.asarray(batch['results']['3']['labels']).size == len(df)
+                assert sessions.load_linkage(sid, '4') is not None
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=save) for _ in range(3)] + [threading.Thread(target=load) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors, errors
+
+    # Every save but the last one was replaced: no orphaned versions are left behind
+    names = os.listdir(os.path.join(sessions.SESSIONS_ROOT, sid))
+    print(f"Session files: {sorted(names)}")
+    assert len([name for name in names if name.startswith('batch-')]) == 1
+    assert len([name for name in names if name.startswith('single-')]) == 1
+
+
+if __name__ == "__main__":
+    test_session_store_roundtrip_and_eviction()
+    test_concurrent_saves_and_loads()
@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+import json
+import sys
+import os
+
+sys.path.append(os.getcwd())
+from app.core import run_clustering
+from app.core.transport import encode_array, decode_array
+
+
+def test_binary_encoding_roundtrip():
+    print("Testing binary typed array encoding of clustering results...")
+    rng = np.random.default_rng(11)
+    df = pd.DataFrame(np.vstack([rng.normal(0, 1, (100, 2)), rng.normal(6, 1, (100, 2))]))
+
+    plain = run_clustering(df, min_cluster_size=5, projection_method='pca')
+    binary = run_clustering(df, min_cluster_size=5, projection_method='pca', encoding='binary')
+
+    labels = decode_array(binary['labels'])
+    print(f"labels dtype: {labels.dtype}, linkage dtype: {decode_array(binary['linkage_z']).dtype}")
+    assert labels.dtype == np.int8
+    assert (labels == np.array(plain['labels'])).all()
+    assert np.allclose(decode_array(binary['linkage_z']), plain['linkage_z'], rtol=1e-6)
+    assert np.allclose(decode_array(binary['probabilities']), plain['probabilities'], rtol=1e-6)
+
+    # Figures keep their structure; long arrays become typed array specs
+    fig = json.loads(binary['map_json'])
+    assert np.allclose(decode_array(fig['data'][0]['x']), json.loads(plain['map_json'])['data'][0]['x'], rtol=1e-5)
+    assert len(binary['map_json']) < len(plain['map_json'])
+
+    assert encode_array([1, 2, 3]) == [1, 2, 3]
+    assert decode_array(encode_array(np.arange(70000), 'binary')).dtype == np.int32
+
+
+if __name__ == "__main__":
+    test_binary_encoding_roundtrip()
@@ -0,0 +1,62 @@
+import io
+import numpy as np
+import sys
+import os
+import tempfile
+from unittest import mock
+
+sys.path.append(os.getcwd())
+from app import create_app
+from app.core import datasets, sessions
+from app.core.clustering import run_clustering
+
+
+def _upload(client, X, **form):
+    csv = "x,y\n" + "\n".join(f"{a},{b}" for a, b in X)
+    form['file'] = (io.BytesIO(csv.encode()), 'points.csv')
+    response = client.post('/upload', data=form, content_type='multipart/form-data')
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+@mock.patch.object(datasets, 'DATASETS_ROOT', tempfile.mkdtemp(prefix='mustache-test-datasets-'))
+@mock.patch.object(sessions, 'SESSIONS_ROOT', tempfile.mkdtemp(prefix='mustache-test-sessions-'))
+def test_upload_stores_full_precision_tree():
+    print("Testing the tuning session stored by /upload...")
+    rng = np.random.default_rng(61)
+    X = np.vstack([rng.normal(0, 1, (70, 2)), rng.normal(5, 1, (70, 2))])
+
+    client = create_app().test_client()
+    # The binary encoding narrows linkage_z to float32; the stored tree stays float64
+    uploaded = _upload(client, X, min_cluster_size='5', projection='pca', encoding='binary')
+    with client.session_transaction() as session:
+        stored = sessions.load_single_run(session['sid'])['linkage_z']
+
+    df = datasets.load_dataset(uploaded['dataset_id'])
+    expected = run_clustering(df, 5, projection_method='pca', lean=True)['linkage_z']
+    print(f"Stored tree dtype: {stored.dtype}")
+    assert stored.dtype == np.float64
+    assert np.array_equal(stored, expected)
+
+
+@mock.patch.object(datasets, 'DATASETS_ROOT', tempfile.mkdtemp(prefix='mustache-test-datasets-'))
+@mock.patch.object(sessions, 'SESSIONS_ROOT', tempfile.mkdtemp(prefix='mustache-test-sessions-'))
+def test_tune_at_upload_min_cluster_size_keeps_labels():
+    print("Testing /tune against the /upload labels...")
+    rng = np.random.default_rng(62)
+    X = np.vstack([rng.normal(0, 1, (60, 2)), rng.normal(6, 1, (50, 2)), rng.normal((0, 8), 0.5, (20, 2))])
+
+    client = create_app().test_client()
+    for min_cluster_size in [5, 15]:
+        uploaded = _upload(client, X, min_cluster_size=str(min_cluster_size), projection='pca')
+        tuned = client.post('/tune', json={'min_cluster_size': min_cluster_size}).get_json()
+        print(f"min_cluster_size={min_cluster_size}: {tuned['n_clusters']} clusters")
+        # Unchanged, cluster ids included: the plots keep their colors
+        assert tuned['labels'] == uploaded['results']['labels']
+        assert tuned['probabilities'] == uploaded['results']['probabilities']
+        assert tuned['n_clusters'] == uploaded['results']['n_clusters']
+
+
+if __name__ == "__main__":
+    test_upload_stores_full_precision_tree()
+    test_tune_at_upload_min_cluster_size_keeps_labels()